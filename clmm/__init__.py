@@ -1,8 +1,13 @@
 """ CLMM is a cluster mass modeling code. """
 from .galaxycluster import load_cluster, GalaxyCluster
-from .polaraveraging import compute_shear, make_shear_profile
-from .utils import compute_radial_averages, make_bins, convert_units
-from .modeling import cclify_astropy_cosmo, get_reduced_shear_from_convergence, get_3d_density, predict_surface_density, predict_excess_surface_density, angular_diameter_dist_a1a2, get_critical_surface_density, predict_tangential_shear, predict_convergence, predict_reduced_tangential_shear
+from .clusterarchive import ClusterArchive
+from .sourceindex import SourceIndex
+from .polaraveraging import compute_shear, compute_shear_batch, make_shear_profile
+from .stacking import StackedProfile
+from .photoz import PhotoZPDFs
+from .covariance import compute_shear_covariance, compute_stacked_covariance
+from .utils import compute_radial_averages, compute_inverse_variance_weights, make_bins, convert_units
+from .modeling import cclify_astropy_cosmo, get_reduced_shear_from_convergence, get_3d_density, predict_surface_density, predict_excess_surface_density, angular_diameter_dist_a1a2, get_critical_surface_density, predict_tangential_shear, predict_convergence, predict_reduced_tangential_shear, predict_lensing_observables, compute_beta_s_moments, compute_mean_inverse_critical_surface_density
 
 from . import lsst
 
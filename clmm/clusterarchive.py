@@ -0,0 +1,212 @@
+"""@file clusterarchive.py
+The ClusterArchive class, a single file storing many galaxy clusters
+"""
+import os
+import json
+import mmap
+import pickle
+import struct
+import numpy as np
+from astropy.table import Table
+from .galaxycluster import GalaxyCluster, _column_header, _build_galcat
+
+
+_MAGIC = b'CLMMARCH'
+# Offset and size of the index, followed by the magic string
+_FOOTER = struct.Struct('<QQ8s')
+# Alignment of the arrays in the file, in bytes
+_ALIGNMENT = 64
+
+
+class ClusterArchive():
+    """Single file storing the galaxy catalogs of many clusters, with an index for random access
+
+    The file is a sequence of arrays, one per column of the galaxy catalog of each cluster,
+    followed by a JSON index with the metadata of the clusters and the offsets of their
+    columns, and by a fixed-size footer pointing to the index. Clusters are appended after the
+    last index, which is then rewritten, so that the previous content of the file is never
+    modified. The columns are read by offset, memory-mapped by default, without opening one
+    file per cluster.
+
+    Attributes
+    ----------
+    filename : str
+        Name of the archive file
+    mode : str
+        `r` to read an existing archive, `a` to read and append to an archive, created if it
+        does not exist, or `w` to create a new archive, replacing any existing file
+    """
+    def __init__(self, filename, mode='r'):
+        if mode not in ('r', 'a', 'w'):
+            raise ValueError(f"Mode {mode} not currently supported")
+        self.filename = filename
+        self.mode = mode
+        if mode == 'w' or (mode == 'a' and not os.path.exists(filename)):
+            self._file = open(filename, 'w+b')
+            self._file.write(_MAGIC)
+            self._clusters = []
+            self._write_index()
+        else:
+            self._file = open(filename, 'rb' if mode == 'r' else 'r+b')
+            self._clusters = self._read_index()
+        self._positions = {cluster['unique_id']: i for i, cluster in enumerate(self._clusters)}
+
+    def _read_index(self):
+        """Metadata of the clusters from the index of the file"""
+        if self._file.read(len(_MAGIC)) != _MAGIC:
+            raise ValueError(f'{self.filename} is not a cluster archive')
+        with mmap.mmap(self._file.fileno(), 0, access=mmap.ACCESS_READ) as data:
+            # The file ends with the footer of the last index, unless an append was
+            # interrupted, in which case the last complete footer is searched backwards
+            end = len(data)
+            while True:
+                position = data.rfind(_MAGIC, len(_MAGIC), end)
+                if position < 0:
+                    raise ValueError(f'{self.filename} is not a complete cluster archive')
+                footer = position+len(_MAGIC)-_FOOTER.size
+                end = position+len(_MAGIC)-1
+                if footer < len(_MAGIC):
+                    continue
+                offset, size, _ = _FOOTER.unpack(data[footer:footer+_FOOTER.size])
+                if offset+size != footer:
+                    continue
+                try:
+                    return json.loads(data[offset:footer].decode())['clusters']
+                except (ValueError, KeyError, TypeError):
+                    continue
+
+    def _write_index(self):
+        """Writes the index of the clusters and the footer at the end of the file"""
+        index = json.dumps({'clusters': self._clusters}).encode()
+        self._file.seek(0, os.SEEK_END)
+        offset = self._file.tell()
+        self._file.write(index)
+        self._file.write(_FOOTER.pack(offset, len(index), _MAGIC))
+        self._file.flush()
+
+    def _write_array(self, array_header, array):
+        """Writes an aligned array at the end of the file and records its offset"""
+        self._file.seek(0, os.SEEK_END)
+        self._file.write(bytes(-self._file.tell() % _ALIGNMENT))
+        array_header['offset'] = self._file.tell()
+        if array.dtype.hasobject:
+            data = pickle.dumps(array)
+            array_header['nbytes'] = len(data)
+            self._file.write(data)
+        else:
+            self._file.write(np.ascontiguousarray(array).data)
+
+    def _read_array(self, array_header, mmap):
+        """Reads an array from its offset, memory-mapped if possible"""
+        dtype, shape = np.dtype(array_header['dtype']), tuple(array_header['shape'])
+        if dtype.hasobject:
+            self._file.seek(array_header['offset'])
+            return pickle.loads(self._file.read(array_header['nbytes']))
+        if mmap and np.prod(shape) > 0:
+            return np.memmap(self._file, dtype=dtype, mode='r', offset=array_header['offset'],
+                             shape=shape)
+        self._file.seek(array_header['offset'])
+        return np.fromfile(self._file, dtype=dtype, count=int(np.prod(shape))).reshape(shape)
+
+    def append(self, clusters):
+        """Appends clusters to the archive, writing the index once for all of them
+
+        Parameters
+        ----------
+        clusters : GalaxyCluster or iterable
+            Cluster(s) to append, with unique ids not already in the archive
+        """
+        if self.mode == 'r':
+            raise ValueError('Cannot append to an archive opened in read mode')
+        if isinstance(clusters, GalaxyCluster):
+            clusters = [clusters]
+        nclusters = len(self._clusters)
+        try:
+            for cluster in clusters:
+                nclusters = len(self._clusters)
+                if cluster.unique_id in self._positions:
+                    raise ValueError(f'Cluster {cluster.unique_id} already in the archive')
+                header = cluster._header()
+                header['ngals'] = len(cluster.galcat)
+                columns = [_column_header(cluster.galcat[name])
+                           for name in cluster.galcat.colnames]
+                header['columns'] = [column for column, _ in columns]
+                # Checks that the metadata can be indexed before writing any array
+                json.dumps(header)
+                for column, arrays in columns:
+                    for array_header, array in zip((column, column.get('mask')), arrays):
+                        self._write_array(array_header, array)
+                self._positions[cluster.unique_id] = nclusters
+                self._clusters.append(header)
+        except BaseException:
+            # The cluster that failed is not indexed, so that the index can still be written
+            for header in self._clusters[nclusters:]:
+                del self._positions[header['unique_id']]
+            del self._clusters[nclusters:]
+            raise
+        finally:
+            # The clusters written so far are indexed even if one of them fails
+            self._write_index()
+
+    def get(self, unique_id, columns=None, mmap=True):
+        """Loads a cluster of the archive
+
+        Parameters
+        ----------
+        unique_id : int or str
+            Unique identifier of the cluster
+        columns : list, optional
+            Names of the columns of the galaxy catalog to load. Defaults to all the columns.
+        mmap : bool, optional
+            Memory-map the columns instead of reading them
+
+        Returns
+        -------
+        cluster : GalaxyCluster
+            The galaxy cluster
+        """
+        header = self._clusters[self._positions[str(unique_id)]]
+        galcat = _build_galcat(header, columns, lambda array: self._read_array(array, mmap))
+        return GalaxyCluster(header['unique_id'], header['ra'], header['dec'], header['z'],
+                             galcat)
+
+    def __getitem__(self, unique_id):
+        """Loads a cluster of the archive with all its columns, memory-mapped"""
+        return self.get(unique_id)
+
+    def __contains__(self, unique_id):
+        return str(unique_id) in self._positions
+
+    def __len__(self):
+        return len(self._clusters)
+
+    def __iter__(self):
+        """Iterates over the clusters in the order in which they were stored"""
+        for header in self._clusters:
+            yield self.get(header['unique_id'])
+
+    @property
+    def unique_ids(self):
+        """Unique identifiers of the clusters, in storage order"""
+        return [header['unique_id'] for header in self._clusters]
+
+    @property
+    def metadata(self):
+        """Table of the unique_id, ra, dec, z and number of galaxies of the clusters"""
+        names = ('unique_id', 'ra', 'dec', 'z', 'ngals')
+        return Table([[header[name] for header in self._clusters] for name in names],
+                     names=names, dtype=(str, float, float, float, int))
+
+    def close(self):
+        """Closes the archive file"""
+        self._file.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+    def __repr__(self):
+        """Generates string for print(ClusterArchive)"""
+        return f'ClusterArchive {self.filename} of {len(self)} clusters'
@@ -0,0 +1,252 @@
+"""@file covariance.py
+Jackknife and bootstrap covariance matrices of shear profiles
+"""
+import numpy as np
+from scipy import sparse
+from .utils import convert_units, make_bins, _digitize_bins
+from .polaraveraging import _compute_lensing_angles_flatsky
+
+
+def _compute_unit_sums(binnumber, unit, nunits, nbins, values):
+    r"""Sums values by resampling unit and radial bin in a single pass
+
+    Parameters
+    ----------
+    binnumber: array_like
+        Radial bin of each source
+    unit: array_like
+        Resampling unit (patch, source or cluster) of each source
+    nunits: int
+        Number of resampling units
+    nbins: int
+        Number of radial bins
+    values: list
+        Arrays to sum, with one value per source
+
+    Returns
+    -------
+    sums: list
+        Sparse matrices of shape (nunits, nbins) with the sums of each array of `values`
+    """
+    return [sparse.csr_matrix((val, (unit, binnumber)), shape=(nunits, nbins))
+            for val in values]
+
+
+def _compute_resampled_covariance(sum_w, sum_wg, method, nboot=100, seed=None):
+    r"""Covariance of the binned weighted means from the sums of each resampling unit
+
+    The weighted mean shear of a resample is the ratio of the resampled sums,
+    :math:`\sum_u c_u S_{wg,u}/\sum_u c_u S_{w,u}`, where :math:`c_u` is the number of
+    times the unit :math:`u` is drawn. All the resamples are therefore matrix products
+    of the per unit sums, which are computed in a single pass over the sources.
+
+    Parameters
+    ----------
+    sum_w: array_like or sparse matrix
+        Sum of the weights of each unit in each bin, shape (nunits, nbins)
+    sum_wg: list
+        Weighted sums of the shears of each unit in each bin, same shape as `sum_w`
+    method: str
+        Resampling method, "jackknife" or "bootstrap"
+    nboot: int, optional
+        Number of bootstrap resamples
+    seed: int, optional
+        Seed of the random generator used for the bootstrap resamples
+
+    Returns
+    -------
+    cov: list
+        Covariance matrices of the weighted means of each array of `sum_wg`, of shape
+        (nbins, nbins). The rows and columns of empty bins are NaN.
+    """
+    nunits = sum_w.shape[0]
+    if method == 'jackknife':
+        if nunits < 2:
+            raise ValueError("At least two patches are needed for a jackknife covariance")
+        sum_w = _todense(sum_w)
+        # Leave one unit out: the resampled sums are the totals minus the sums of the unit
+        with np.errstate(divide='ignore', invalid='ignore'):
+            means = [(sum_wg_.sum(axis=0)-sum_wg_)/(sum_w.sum(axis=0)-sum_w)
+                     for sum_wg_ in map(_todense, sum_wg)]
+        return [(nunits-1.)*_cov(mean, ddof=0) for mean in means]
+    if method == 'bootstrap':
+        if nboot < 2:
+            raise ValueError("At least two bootstrap resamples are needed")
+        rng = np.random.default_rng(seed)
+        sum_w_t = sparse.csr_matrix(sum_w).T
+        sum_wg_t = [sparse.csr_matrix(sum_wg_).T for sum_wg_ in sum_wg]
+        means = [[] for _ in sum_wg]
+        # Draw the counts of the units by chunks of resamples to bound the memory used
+        chunk = max(1, min(nboot, 10000000//nunits))
+        for start in range(0, nboot, chunk):
+            counts = rng.multinomial(nunits, np.full(nunits, 1./nunits),
+                                     size=min(chunk, nboot-start)).T
+            res_w = sum_w_t@counts
+            with np.errstate(divide='ignore', invalid='ignore'):
+                for mean, sum_wg_t_ in zip(means, sum_wg_t):
+                    mean.append((sum_wg_t_@counts/res_w).T)
+        return [_cov(np.vstack(mean), ddof=1) for mean in means]
+    raise ValueError(f"Resampling method {method} not currently supported.")
+
+
+def _todense(matrix):
+    """Dense array of a sparse or dense matrix"""
+    return matrix.toarray() if sparse.issparse(matrix) else np.asarray(matrix, dtype=float)
+
+
+def _cov(samples, ddof):
+    """Covariance of the columns of samples, of shape (nsamples, nbins), keeping the
+    columns with NaN values (empty bins) as NaN"""
+    deviations = samples-samples.mean(axis=0)
+    return deviations.T@deviations/(len(samples)-ddof)
+
+
+def _sector_patches(cluster, npatch):
+    r"""Splits the sources of a cluster in `npatch` angular sectors around its center,
+    with the same number of sources in each sector
+
+    The sectors contain sources at all radii, so that each jackknife resample keeps
+    the full radial range of the profile.
+    """
+    if npatch > len(cluster.galcat):
+        raise ValueError(f"Cannot split {len(cluster.galcat)} sources in {npatch} patches")
+    _, phi = _compute_lensing_angles_flatsky(cluster.ra, cluster.dec, cluster.galcat['ra'],
+                                             cluster.galcat['dec'], validate=False)
+    patches = np.empty(len(phi), dtype=int)
+    patches[np.argsort(phi, kind='stable')] = np.arange(len(phi))*npatch//len(phi)
+    return patches
+
+
+def compute_shear_covariance(cluster, angsep_units, bin_units, bins=10, method='jackknife',
+                             patches=None, nboot=100, cosmo=None, weights=None, seed=None):
+    r"""Compute the covariance matrices of the tangential and cross shear profiles of
+    a cluster by jackknife or bootstrap resampling
+
+    The sources are grouped in resampling units, either patches on the sky or the sources
+    themselves, and the weighted sums of the shears of each unit in each radial bin are
+    computed in a single pass. Each resampled profile is then a combination of these sums,
+    so that the cost of the resamples does not scale with the number of sources.
+
+    Parameters
+    ----------
+    cluster : GalaxyCluster
+        Instance of GalaxyCluster that contains the cross and tangential shears of
+        each source galaxy in its `galcat`
+    angsep_units : str
+        Units of the calculated separation of the source galaxies
+    bin_units : str
+        Units to use for the radial bins of the shear profile
+    bins : array_like, optional
+        Bin edges, or number of bins between the minimum and maximum separations, as in
+        `make_shear_profile`
+    method : str, optional
+        Resampling method:
+
+            * 'jackknife' - Delete one patch jackknife over the patches of the sources
+
+            * 'bootstrap' - Bootstrap over the patches of the sources, or over the sources
+              themselves if `patches` is not provided
+
+    patches : int, str or array_like, optional
+        Resampling units of the sources: a number of angular sectors around the cluster center
+        with the same number of sources, the name of a `galcat` column with the patch of each
+        source, or the patches themselves. Defaults to 10 sectors for the jackknife and to
+        the individual sources for the bootstrap.
+    nboot : int, optional
+        Number of bootstrap resamples
+    cosmo: dict, optional
+        Cosmology parameters to convert angular separations to physical distances
+    weights: str or array_like, optional
+        Weights of the source galaxies, either the name of a column of the `galcat` or an
+        array, as in `make_shear_profile`
+    seed : int, optional
+        Seed of the random generator used for the bootstrap resamples
+
+    Returns
+    -------
+    cov_gt : array_like
+        Covariance matrix of the tangential shear profile, of shape (nbins, nbins)
+    cov_gx : array_like
+        Covariance matrix of the cross shear profile, of shape (nbins, nbins)
+
+    Notes
+    -----
+    The covariance matrices cover all the bins, the rows and columns of the empty bins being
+    NaN, while `make_shear_profile` drops the bins with less than two sources by default.
+    """
+    if not all([t_ in cluster.galcat.columns for t_ in ('gt', 'gx', 'theta')]):
+        raise TypeError('Shear information is missing in galaxy catalog must have tangential' +\
+                        'and cross shears (gt,gx). Run compute_shear first!')
+
+    if angsep_units is not bin_units:
+        source_seps = convert_units(cluster.galcat['theta'], angsep_units, bin_units,
+                                    redshift=cluster.z, cosmo=cosmo)
+    else:
+        source_seps = cluster.galcat['theta']
+    if not hasattr(bins, '__len__'):
+        bins = make_bins(np.min(source_seps), np.max(source_seps), bins)
+    nbins = len(bins)-1
+
+    # Resampling units
+    if patches is None:
+        patches = 10 if method == 'jackknife' else np.arange(len(cluster.galcat))
+    if isinstance(patches, str):
+        patches = cluster.galcat[patches].data
+    elif not hasattr(patches, '__len__'):
+        patches = _sector_patches(cluster, patches)
+    if len(patches) != len(cluster.galcat):
+        raise TypeError('patches must have the same length as the galaxy catalog.')
+    unit_labels, patches = np.unique(patches, return_inverse=True)
+
+    if isinstance(weights, str):
+        weights = cluster.galcat[weights].data
+    weights = np.ones(len(source_seps)) if weights is None else np.asarray(weights, dtype=float)
+    if len(weights) != len(source_seps):
+        raise TypeError('weights must have the same length as the galaxy catalog.')
+
+    binnumber, inrange = _digitize_bins(np.asarray(source_seps), bins)
+    binnumber, patches, weights = binnumber[inrange], patches.ravel()[inrange], weights[inrange]
+    sum_w, sum_wgt, sum_wgx = _compute_unit_sums(
+        binnumber, patches, len(unit_labels), nbins,
+        [weights, weights*cluster.galcat['gt'].data[inrange],
+         weights*cluster.galcat['gx'].data[inrange]])
+    cov_gt, cov_gx = _compute_resampled_covariance(sum_w, [sum_wgt, sum_wgx], method,
+                                                   nboot=nboot, seed=seed)
+    return cov_gt, cov_gx
+
+
+def compute_stacked_covariance(stacks, method='jackknife', nboot=100, seed=None):
+    r"""Compute the covariance matrices of a stacked shear profile by jackknife or bootstrap
+    resampling of its clusters
+
+    Each element of `stacks` is a resampling unit, e.g. a `StackedProfile` per cluster or per
+    patch of the survey. Their sums are combined without going back to the sources.
+
+    Parameters
+    ----------
+    stacks : list
+        `StackedProfile` instances with the same bins
+    method : str, optional
+        Resampling method, 'jackknife' or 'bootstrap'
+    nboot : int, optional
+        Number of bootstrap resamples
+    seed : int, optional
+        Seed of the random generator used for the bootstrap resamples
+
+    Returns
+    -------
+    cov_gt : array_like
+        Covariance matrix of the stacked tangential shear profile, of shape (nbins, nbins)
+    cov_gx : array_like
+        Covariance matrix of the stacked cross shear profile, of shape (nbins, nbins)
+    """
+    if len(stacks) == 0:
+        raise ValueError("No stacked profiles to resample")
+    if any(not np.array_equal(stack.bins, stacks[0].bins) or
+           stack.bin_units != stacks[0].bin_units for stack in stacks):
+        raise ValueError('Cannot resample stacked profiles with different bins')
+    sum_w, sum_wgt, sum_wgx = [np.array([getattr(stack, name) for stack in stacks])
+                               for name in ('sum_w', 'sum_wgt', 'sum_wgx')]
+    cov_gt, cov_gx = _compute_resampled_covariance(sum_w, [sum_wgt, sum_wgx], method,
+                                                   nboot=nboot, seed=seed)
+    return cov_gt, cov_gx
@@ -0,0 +1,203 @@
+"""@file distances.py
+The DistanceTable class, tabulated cosmological distances
+"""
+import numpy as np
+from .constants import Constants as const
+
+
+class DistanceTable():
+    r"""Comoving distances of a cosmology tabulated on a redshift grid
+
+    The line of sight comoving distance
+
+    .. math::
+        D_C(z) = D_H \int_0^z \frac{dz'}{E(z')}
+
+    is integrated once with a Gauss-Legendre rule on each interval of a grid regular in
+    :math:`\ln(1+z)`, and interpolated with a cubic Hermite spline that matches both
+    :math:`D_C` and its derivative :math:`D_H/E(z)` at the nodes. All the distances are then
+    vectorized interpolations, with relative errors below :math:`10^{-10}`. The table is
+    extended when a redshift beyond its range is requested.
+
+    Attributes
+    ----------
+    cosmo : astropy.cosmology.FLRW
+        Astropy cosmology object, whose `inv_efunc` is integrated
+    hubble_distance : float
+        Hubble distance :math:`c/H_0` in :math:`M\!pc`
+    zmax : float
+        Maximum redshift of the table
+    """
+    def __init__(self, cosmo, zmax=10., step=2.e-3, nodes=8):
+        self.cosmo = cosmo
+        self.hubble_distance = const.CLIGHT_KMS.value/cosmo.H0.value
+        self._omega_k = cosmo.Ok0
+        self._step = step
+        self._nodes, self._node_weights = np.polynomial.legendre.leggauss(nodes)
+        self._lnzp1 = np.zeros(1)
+        self._dc_over_dh = np.zeros(1)
+        self.zmax = 0.
+        self._coeffs = None
+        self._extend(zmax)
+
+    def _extend(self, zmax):
+        """Extends the table up to redshift zmax"""
+        nsteps = int(np.ceil((np.log1p(zmax)-self._lnzp1[-1])/self._step))
+        edges = self._lnzp1[-1]+self._step*np.arange(nsteps+1)
+        # Gauss-Legendre quadrature of (1+z)/E(z) dln(1+z) on each new interval
+        half = 0.5*np.diff(edges)
+        lnzp1 = (0.5*(edges[1:]+edges[:-1]))[:, None]+half[:, None]*self._nodes
+        integrand = np.exp(lnzp1)*self.cosmo.inv_efunc(np.expm1(lnzp1))
+        intervals = half*(integrand@self._node_weights)
+
+        self._lnzp1 = np.concatenate((self._lnzp1, edges[1:]))
+        self._dc_over_dh = np.concatenate((self._dc_over_dh,
+                                           self._dc_over_dh[-1]+np.cumsum(intervals)))
+        self.zmax = np.expm1(self._lnzp1[-1])
+        # Cubic Hermite coefficients of each interval, highest order first
+        derivative = np.exp(self._lnzp1)*self.cosmo.inv_efunc(np.expm1(self._lnzp1))
+        step = np.diff(self._lnzp1)
+        slope = np.diff(self._dc_over_dh)/step
+        self._coeffs = np.array([(derivative[:-1]+derivative[1:]-2.*slope)/step**2,
+                                 (3.*slope-2.*derivative[:-1]-derivative[1:])/step,
+                                 derivative[:-1], self._dc_over_dh[:-1]])
+
+    def _interpolate(self, lnzp1):
+        """Evaluates the spline of :math:`D_C/D_H` at :math:`\\ln(1+z)`, locating the
+        intervals directly on the regular grid"""
+        index = np.minimum((lnzp1*(1./self._step)).astype(np.intp), self._coeffs.shape[1]-1)
+        dlnzp1 = lnzp1-self._lnzp1.take(index)
+        dc_over_dh = self._coeffs[0].take(index)
+        for coeffs in self._coeffs[1:]:
+            dc_over_dh *= dlnzp1
+            dc_over_dh += coeffs.take(index)
+        return dc_over_dh
+
+    def _check_range(self, redshift):
+        """Redshifts as an array, extending the table if needed"""
+        redshift = np.asarray(redshift, dtype=float)
+        if redshift.size > 0:
+            if np.min(redshift) < 0.:
+                raise ValueError("Cannot compute distances at negative redshift")
+            zmax = np.max(redshift)
+            if zmax > self.zmax:
+                self._extend(max(zmax, 2.*self.zmax))
+        return redshift
+
+    def comoving_distance(self, redshift):
+        r"""Line of sight comoving distance in :math:`M\!pc`
+
+        Parameters
+        ----------
+        redshift : array_like
+            Redshift(s)
+
+        Returns
+        -------
+        d_c : array_like
+            Comoving distance(s)
+        """
+        redshift = self._check_range(redshift)
+        return self.hubble_distance*self._interpolate(np.log1p(redshift))
+
+    def transverse_comoving_distance(self, redshift):
+        r"""Transverse comoving distance in :math:`M\!pc`, equal to the comoving distance in
+        a flat universe
+
+        Parameters
+        ----------
+        redshift : array_like
+            Redshift(s)
+
+        Returns
+        -------
+        d_m : array_like
+            Transverse comoving distance(s)
+        """
+        return self._comoving_to_transverse(self.comoving_distance(redshift))
+
+    def _comoving_to_transverse(self, d_c):
+        """Transverse comoving distance from the line of sight comoving distance"""
+        if self._omega_k == 0.:
+            return d_c
+        sqrt_ok = np.sqrt(abs(self._omega_k))
+        if self._omega_k > 0.:
+            return self.hubble_distance/sqrt_ok*np.sinh(sqrt_ok*d_c/self.hubble_distance)
+        return self.hubble_distance/sqrt_ok*np.sin(sqrt_ok*d_c/self.hubble_distance)
+
+    def angular_diameter_distance(self, redshift):
+        r"""Angular diameter distance in :math:`M\!pc`
+
+        Parameters
+        ----------
+        redshift : array_like
+            Redshift(s)
+
+        Returns
+        -------
+        d_a : array_like
+            Angular diameter distance(s)
+        """
+        redshift = self._check_range(redshift)
+        return self.transverse_comoving_distance(redshift)/(1.+redshift)
+
+    def angular_diameter_distance_z1z2(self, redshift1, redshift2):
+        r"""Angular diameter distance between two redshifts in :math:`M\!pc`, as seen from
+        `redshift1`, following astropy's `angular_diameter_distance_z1z2`
+
+        Parameters
+        ----------
+        redshift1 : array_like
+            Redshift(s) of the first object(s), e.g. the lens
+        redshift2 : array_like
+            Redshift(s) of the second object(s), e.g. the sources. Must broadcast with
+            `redshift1`.
+
+        Returns
+        -------
+        d_a : array_like
+            Angular diameter distance(s)
+        """
+        redshift1, redshift2 = self._check_range(redshift1), self._check_range(redshift2)
+        d_m1 = self.transverse_comoving_distance(redshift1)
+        d_m2 = self.transverse_comoving_distance(redshift2)
+        return self._transverse_distance_z1z2(d_m1, d_m2)/(1.+redshift2)
+
+    def _transverse_distance_z1z2(self, d_m1, d_m2):
+        """Transverse comoving distance between two objects from their transverse comoving
+        distances"""
+        if self._omega_k == 0.:
+            return d_m2-d_m1
+        ok_over_dh2 = self._omega_k/self.hubble_distance**2
+        return d_m2*np.sqrt(1.+ok_over_dh2*d_m1**2)-d_m1*np.sqrt(1.+ok_over_dh2*d_m2**2)
+
+    def distance_ratio(self, redshift1, redshift2):
+        r"""Ratio of the angular diameter distance between two redshifts and of the angular
+        diameter distance to the second one, :math:`D_A(z_1, z_2)/D_A(z_2)`, e.g. the
+        lensing efficiency :math:`D_{LS}/D_S` of sources at `redshift2` behind a lens at
+        `redshift1`
+
+        The distances to `redshift2` are interpolated only once, which makes it the fastest
+        way to compute critical surface densities of many sources.
+
+        Parameters
+        ----------
+        redshift1 : array_like
+            Redshift(s) of the first object(s), e.g. the lens
+        redshift2 : array_like
+            Redshift(s) of the second object(s), e.g. the sources. Must broadcast with
+            `redshift1`.
+
+        Returns
+        -------
+        ratio : array_like
+            Distance ratio(s), negative for `redshift2` < `redshift1`
+        """
+        d_m1 = self.transverse_comoving_distance(redshift1)
+        d_m2 = self.transverse_comoving_distance(redshift2)
+        return self._transverse_distance_z1z2(d_m1, d_m2)/d_m2
+
+    def __repr__(self):
+        """Generates string for print(DistanceTable)"""
+        return f'DistanceTable of {self.cosmo} up to z={self.zmax:.2f} ' +\
+               f'({len(self._lnzp1)} nodes)'
@@ -1,14 +1,103 @@
 """@file galaxycluster.py
 The GalaxyCluster class
 """
+import os
+import json
+import uuid
 import pickle
-from astropy.table import Table
+import numpy as np
+from astropy.table import Table, Column, MaskedColumn
 
 
-def load_cluster(filename, **kwargs):
-    """Loads GalaxyCluster object from filename using Pickle"""
-    with open(filename, 'rb') as fin:
-        return pickle.load(fin, **kwargs)
+_HEADER = 'header.json'
+
+
+def load_cluster(filename, columns=None, mmap=True, **kwargs):
+    """Loads GalaxyCluster object from filename
+
+    Parameters
+    ----------
+    filename : str
+        Directory written by `GalaxyCluster.save`, or pickle file
+    columns : list, optional
+        Names of the columns of the galaxy catalog to load. Defaults to all the columns.
+    mmap : bool, optional
+        Memory-map the columns instead of reading them, so that their data are only read from
+        disk when accessed. Not applicable to pickle files and to columns of Python objects.
+    **kwargs
+        Parameters of `pickle.load`, for pickle files
+
+    Returns
+    -------
+    cluster : GalaxyCluster
+        The galaxy cluster
+    """
+    if not os.path.isdir(filename):
+        with open(filename, 'rb') as fin:
+            cluster = pickle.load(fin, **kwargs)
+        if columns is not None:
+            cluster.galcat = cluster.galcat[list(columns)]
+        return cluster
+    with open(os.path.join(filename, _HEADER), 'r') as fin:
+        header = json.load(fin)
+    galcat = _build_galcat(header, columns,
+                           lambda array: _load_npy(os.path.join(filename, array['file']), mmap))
+    return GalaxyCluster(header['unique_id'], header['ra'], header['dec'], header['z'], galcat)
+
+
+def _load_npy(filename, mmap):
+    """Array of a .npy file, memory-mapped if possible"""
+    try:
+        return np.load(filename, mmap_mode='r' if mmap else None)
+    except ValueError:
+        # Arrays of Python objects cannot be memory-mapped
+        return np.load(filename, allow_pickle=True)
+
+
+def _array_header(array):
+    """Description of a stored array"""
+    return {'dtype': array.dtype.str, 'shape': list(array.shape)}
+
+
+def _column_header(column):
+    """Description of a column of the galaxy catalog, and arrays of its data and mask"""
+    header = dict(_array_header(column), name=column.name, description=column.description,
+                  unit=None if column.unit is None else column.unit.to_string())
+    arrays = [np.asarray(column)]
+    if isinstance(column, MaskedColumn):
+        header['mask'] = _array_header(np.asarray(column.mask))
+        arrays = [np.asarray(column.data.data), np.asarray(column.mask)]
+    return header, arrays
+
+
+def _build_galcat(header, columns, load):
+    """Galaxy catalog of a cluster from its header, the arrays being read by `load` from
+    their description in the header"""
+    headers = {column['name']: column for column in header['columns']}
+    names = list(headers) if columns is None else list(columns)
+    missing = [name for name in names if name not in headers]
+    if missing:
+        raise KeyError(f'Columns {missing} not in the galaxy catalog')
+    galcat = []
+    for name in names:
+        column = headers[name]
+        kwargs = {'name': name, 'unit': column['unit'], 'description': column['description'],
+                  'copy': False}
+        if 'mask' in column:
+            galcat.append(MaskedColumn(load(column), mask=load(column['mask']), **kwargs))
+        else:
+            galcat.append(Column(load(column), **kwargs))
+    galcat = Table(galcat, copy=False)
+    galcat.meta.update(header['meta'])
+    return galcat
+
+
+def _column_files(header):
+    """Files of the columns of a cluster saved in the columnar format"""
+    for column in header['columns']:
+        yield column['file']
+        if 'mask' in column:
+            yield column['mask']['file']
 
 
 class GalaxyCluster():
@@ -61,10 +150,72 @@ class GalaxyCluster():
         self.z = z
         self.galcat = galcat
 
-    def save(self, filename, **kwargs):
-        """Saves GalaxyCluster object to filename using Pickle"""
-        with open(filename, 'wb') as fin:
-            pickle.dump(self, fin, **kwargs)
+    def save(self, filename, format='columnar', **kwargs):
+        """Saves GalaxyCluster object to filename
+
+        Parameters
+        ----------
+        filename : str
+            Name of the directory, or of the pickle file
+        format : str, optional
+            File format, with the following supported options:
+
+                `columnar` (default) - directory with the metadata of the cluster and of its
+                columns in a JSON header, and one .npy file per column of the galaxy catalog.
+                The columns can then be loaded selectively and memory-mapped by
+                `load_cluster`. The files do not depend on the versions of the packages,
+                except for columns of Python objects (e.g. ragged arrays), which are pickled.
+                Saving again into the same directory replaces the cluster, and the previous
+                save is kept if this fails.
+
+                `pickle` - pickle file of the object
+
+        **kwargs
+            Parameters of `pickle.dump`, for the `pickle` format
+        """
+        if format == 'pickle':
+            with open(filename, 'wb') as fin:
+                pickle.dump(self, fin, **kwargs)
+            return
+        if format != 'columnar':
+            raise ValueError(f"File format {format} not currently supported")
+        # New column files get new names, and the header is replaced last, so that the
+        # directory always holds a complete save
+        prefix = f'column_{uuid.uuid4().hex[:8]}'
+        header = self._header()
+        columns = [_column_header(self.galcat[name]) for name in self.galcat.colnames]
+        for i, (column, _) in enumerate(columns):
+            column['file'] = f'{prefix}_{i}.npy'
+            if 'mask' in column:
+                column['mask']['file'] = f'{prefix}_{i}_mask.npy'
+            header['columns'].append(column)
+        header_text = json.dumps(header, indent=1)
+        os.makedirs(filename, exist_ok=True)
+        header_file = os.path.join(filename, _HEADER)
+        old_files = set()
+        if os.path.exists(header_file):
+            with open(header_file, 'r') as fin:
+                old_files = set(_column_files(json.load(fin)))
+        try:
+            for column, arrays in columns:
+                for array_header, array in zip((column, column.get('mask')), arrays):
+                    np.save(os.path.join(filename, array_header['file']), array,
+                            allow_pickle=array.dtype.hasobject)
+            with open(header_file+'.tmp', 'w') as fout:
+                fout.write(header_text)
+            os.replace(header_file+'.tmp', header_file)
+        except BaseException:
+            for new_file in _column_files(header):
+                if os.path.exists(os.path.join(filename, new_file)):
+                    os.remove(os.path.join(filename, new_file))
+            raise
+        for old_file in old_files:
+            os.remove(os.path.join(filename, old_file))
+
+    def _header(self):
+        """Metadata of the cluster and of its galaxy catalog, without the columns"""
+        return {'unique_id': self.unique_id, 'ra': self.ra, 'dec': self.dec, 'z': self.z,
+                'meta': dict(self.galcat.meta), 'columns': []}
 
     def __repr__(self):
         """Generates string for print(GalaxyCluster)"""
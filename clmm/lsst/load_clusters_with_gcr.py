@@ -6,6 +6,7 @@ import os
 import numpy as np
 from astropy.table import Table
 from ..galaxycluster import GalaxyCluster
+from ..clusterarchive import ClusterArchive
 from ..modeling import get_reduced_shear_from_convergence
 
 def load_GCR_catalog(catalog_name):
@@ -49,13 +50,14 @@ def _make_GCR_filter(filter_name, low_bound, high_bound):
             '%s < %d'%(filter_name, high_bound)]
 
 def load_from_dc2(nclusters, catalog_name, save_dir, ra_range=(-0.3, 0.3), dec_range=(-0.3, 0.3),
-                  z_range=(0.1, 1.5), verbose=False, _reader='GCR'):
+                  z_range=(0.1, 1.5), verbose=False, archive='clusters.clmm', _reader='GCR'):
     """Load random clusters from DC2 using GCRCatalogs
 
     This function saves a set of random clusters loaded from a DC2 catalog. The galaxies
     selected for each cluster are cut within a rectangular projected region around the true
     cluster center. The parameters for this cut are specified by the ra_range, dec_range,
-    and z_range arguments.
+    and z_range arguments. The clusters are appended to a single `ClusterArchive` file, or
+    saved in one pickle file each if `archive` is None.
 
     Parameters
     ----------
@@ -73,6 +75,9 @@ def load_from_dc2(nclusters, catalog_name, save_dir, ra_range=(-0.3, 0.3), dec_r
         Range of redshift values to cut galaxies relative to the cluster center
     verbose: bool
         Sets the function to print the id of each cluster while loading
+    archive: str, optional
+        Name of the archive file in save_dir, created if it does not exist. If None, each
+        cluster is saved in its own pickle file '<id>.p'.
     _reader: str
         Reader argument used for testing. In practice, should be default to 'GCR'.
     """
@@ -83,6 +88,9 @@ def load_from_dc2(nclusters, catalog_name, save_dir, ra_range=(-0.3, 0.3), dec_r
         raise ValueError('dec_range incorrect length: %i'%len(dec_range))
     if len(z_range)!=2:
         raise ValueError('z_range incorrect length: %i'%len(z_range))
+    # check that ranges are valid before any file is written
+    for name, value_range in (('ra', ra_range), ('dec', dec_range), ('redshift', z_range)):
+        _make_GCR_filter(name, *value_range)
 
     # load catalog
     if _reader=='GCR':
@@ -100,7 +108,19 @@ def load_from_dc2(nclusters, catalog_name, save_dir, ra_range=(-0.3, 0.3), dec_r
                                    filters=['halo_mass > 1e14', 'is_central==True'])
 
     # generate GalaxyCluster objects
-    for i in np.random.choice(range(len(halos['galaxy_id'])), nclusters, replace=False):
+    indices = np.random.choice(range(len(halos['galaxy_id'])), nclusters, replace=False)
+    clusters = _generate_clusters(catalog, halos, indices, ra_range, dec_range, z_range, verbose)
+    if archive is None:
+        for c in clusters:
+            c.save(os.path.join(save_dir, '%s.p'%c.unique_id), format='pickle')
+    else:
+        with ClusterArchive(os.path.join(save_dir, archive), mode='a') as cluster_archive:
+            cluster_archive.append(clusters)
+
+
+def _generate_clusters(catalog, halos, indices, ra_range, dec_range, z_range, verbose):
+    """Generates the GalaxyCluster objects of the halos of given indices, see `load_from_dc2`"""
+    for i in indices:
         # specify cluster information
         cl_id = halos['galaxy_id'][i]
         cl_ra = halos['ra'][i]
@@ -135,4 +155,4 @@ def load_from_dc2(nclusters, catalog_name, save_dir, ra_range=(-0.3, 0.3), dec_r
         c = GalaxyCluster(unique_id=int(cl_id), ra=cl_ra, dec=cl_dec, z=cl_z,
                           galcat=t)
 
-        c.save(os.path.join(save_dir, '%i.p'%cl_id))
+        yield c
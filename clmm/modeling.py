@@ -1,10 +1,13 @@
 """ Functions to model halo profiles """
-import cluster_toolkit as ct
+from collections import OrderedDict, namedtuple
 import numpy as np
-from astropy import units
+from scipy.integrate import simpson
 from astropy.cosmology import LambdaCDM
 from .constants import Constants as const
+from .distances import DistanceTable
 from .cluster_toolkit_patches import _patch_zevolution_cluster_toolkit_rho_m
+from .nfw import _get_rho_m, _get_nfw_scales, _get_nfw_template, _nfw_rho_reduced,\
+    _nfw_sigma_reduced, _nfw_mean_sigma_reduced
 
 
 def cclify_astropy_cosmo(cosmoin):
@@ -66,10 +69,151 @@ def astropyify_ccl_cosmo(cosmoin):
     """
     if isinstance(cosmoin, LambdaCDM):
         return cosmoin
-    if isinstance(cosmoin, dict):
-        omega_m = cosmoin['Omega_b'] + cosmoin['Omega_c']
-        return LambdaCDM(H0=cosmoin['H0'], Om0=omega_m, Ob0=cosmoin['Omega_b'], Ode0=1.0-omega_m)
-    raise TypeError("Only astropy LambdaCDM objects or dicts can be converted to astropy.")
+    return _COSMOLOGIES.get(cosmoin).astropy
+
+
+_CosmologyEntry = namedtuple('_CosmologyEntry', ['astropy', 'distance_table', 'beta_s_moments'])
+
+
+class _MomentsCache():
+    """ Cache of the moments of the lensing efficiency of a cosmology, keyed by the source
+    redshift distribution, the cluster redshift and the maximum source redshift
+
+    The least recently used moments are evicted beyond `maxsize` entries, so that fitting
+    the cluster redshift, or redefining the distribution at each call, does not grow the
+    cache without limit.
+
+    Attributes
+    ----------
+    maxsize : int
+        Maximum number of moments kept
+    """
+    def __init__(self, maxsize=1024):
+        self.maxsize = maxsize
+        self._moments = OrderedDict()
+
+    def get(self, key):
+        """ Cached moments of a key, None if not cached """
+        if key not in self._moments:
+            return None
+        self._moments.move_to_end(key)
+        return self._moments[key]
+
+    def update(self, items):
+        """ Caches the moments of (key, moments) pairs """
+        for key, moments in items:
+            self._moments[key] = moments
+            self._moments.move_to_end(key)
+        while len(self._moments) > self.maxsize:
+            self._moments.popitem(last=False)
+
+    def __len__(self):
+        return len(self._moments)
+
+
+class _CosmologyRegistry():
+    """ Registry of the cosmologies in use, with their astropy cosmology object, their
+    distance table and their cached moments of the lensing efficiency, shared by all the
+    modeling functions
+
+    Cosmologies are identified by their parameters, so that equal CCL-like dicts share the
+    same objects. The least recently used cosmologies are evicted beyond `maxsize` entries.
+
+    Attributes
+    ----------
+    maxsize : int
+        Maximum number of cosmologies kept
+    """
+    def __init__(self, maxsize=16):
+        self.maxsize = maxsize
+        self._entries = OrderedDict()
+
+    @staticmethod
+    def _key(cosmo):
+        """ Hashable key of the parameters of a CCL-like dict or astropy cosmology """
+        if isinstance(cosmo, dict):
+            return tuple(sorted(cosmo.items()))
+        if isinstance(cosmo, LambdaCDM):
+            return repr(cosmo)
+        raise TypeError("Only astropy LambdaCDM objects or dicts can be converted to astropy.")
+
+    def get(self, cosmo):
+        """ Entry of a cosmology, created with its distance table at the first request
+
+        Parameters
+        ----------
+        cosmo : pyccl.core.Cosmology or astropy.cosmology.LambdaCDM
+            CCL or astropy cosmology object
+
+        Returns
+        -------
+        entry : _CosmologyEntry
+            Astropy cosmology object, distance table and moments of the lensing efficiency of
+            the cosmology
+        """
+        key = self._key(cosmo)
+        if key in self._entries:
+            self._entries.move_to_end(key)
+            return self._entries[key]
+        if isinstance(cosmo, dict):
+            omega_m = cosmo['Omega_b'] + cosmo['Omega_c']
+            ap_cosmo = LambdaCDM(H0=cosmo['H0'], Om0=omega_m, Ob0=cosmo['Omega_b'],
+                                 Ode0=1.0-omega_m)
+        else:
+            ap_cosmo = cosmo
+        entry = _CosmologyEntry(ap_cosmo, DistanceTable(ap_cosmo), _MomentsCache())
+        self._entries[key] = entry
+        while len(self._entries) > self.maxsize:
+            self._entries.popitem(last=False)
+        return entry
+
+    def clear(self):
+        """ Removes all the cosmologies from the registry """
+        self._entries.clear()
+
+    def __len__(self):
+        return len(self._entries)
+
+
+_COSMOLOGIES = _CosmologyRegistry()
+
+
+def _import_cluster_toolkit():
+    """ Imports cluster_toolkit, which is only needed by the `cluster_toolkit` backend
+
+    Returns
+    -------
+    cluster_toolkit : module
+        The cluster_toolkit package
+    """
+    try:
+        import cluster_toolkit
+    except ImportError as err:
+        raise ImportError("The cluster_toolkit backend requires cluster_toolkit to be "
+                          "installed, use backend='analytic' instead.") from err
+    return cluster_toolkit
+
+
+def _add_radial_axes(radius, *params):
+    """ Reshapes halo parameters to broadcast against radii, so that the profiles of the
+    halos have the shape of the parameters followed by the shape of the radii
+
+    Parameters
+    ----------
+    radius : array_like
+        Radii
+    params : array_like
+        Halo parameters, e.g. masses, concentrations and redshifts, that broadcast together
+
+    Returns
+    -------
+    params : list
+        Halo parameters with additional axes for the radii
+    """
+    ndim = np.ndim(radius)
+    return [param.reshape(param.shape+(1,)*ndim)
+            for param in np.broadcast_arrays(*[np.asarray(param, dtype=float)
+                                                for param in params])]
 
 
 def _get_a_from_z(redshift):
@@ -130,7 +274,8 @@ def get_reduced_shear_from_convergence(shear, convergence):
     return reduced_shear
 
 
-def get_3d_density(r3d, mdelta, cdelta, z_cl, cosmo, delta_mdef=200, halo_profile_model='nfw'):
+def get_3d_density(r3d, mdelta, cdelta, z_cl, cosmo, delta_mdef=200, halo_profile_model='nfw',
+                   backend='analytic'):
     r"""Retrieve the 3d density :math:`\rho(r)`.
 
     Profiles implemented so far are:
@@ -142,11 +287,11 @@ def get_3d_density(r3d, mdelta, cdelta, z_cl, cosmo, delta_mdef=200, halo_profil
     ----------
     r3d : array_like, float
         Radial position from the cluster center in :math:`M\!pc\ h^{-1}`.
-    mdelta : float
+    mdelta : array_like, float
         Galaxy cluster mass in :math:`M_\odot\ h^{-1}`.
-    cdelta : float
+    cdelta : array_like, float
         Galaxy cluster concentration
-    z_cl: float
+    z_cl: array_like, float
         Redshift of the cluster
     cosmo : pyccl.core.Cosmology object
         CCL Cosmology object
@@ -157,29 +302,49 @@ def get_3d_density(r3d, mdelta, cdelta, z_cl, cosmo, delta_mdef=200, halo_profil
 
             `nfw` (default)
 
+    backend : str, optional
+        Implementation of the profile, with the following supported options:
+
+            `analytic` (default) - closed form of the profile, `template` is an alias
+
+            `cluster_toolkit` - cluster_toolkit functions, requires cluster_toolkit
+
     Returns
     -------
     rho : array_like, float
-        3-dimensional mass density in units of :math:`h^2\ M_\odot\ pc^{-3}` DOUBLE CHECK THIS
+        3-dimensional mass density in units of :math:`h^2\ M_\odot\ M\!pc^{-3}`
 
     Notes
     -----
     Need to refactor later so we only require arguments that are necessary for all profiles
     and use another structure to take the arguments necessary for specific models
+
+    With the `analytic` and `template` backends, the masses, concentrations and cluster
+    redshifts can be arrays that broadcast together, e.g. a grid or an ensemble of walkers.
+    The profiles of all the halos are evaluated at once, and have the shape of the halo
+    parameters followed by the shape of the radii.
     """
     cosmo = cclify_astropy_cosmo(cosmo)
     omega_m = cosmo['Omega_c'] + cosmo['Omega_b']
-    omega_m_transformed = _patch_zevolution_cluster_toolkit_rho_m(omega_m, z_cl)
 
-    if halo_profile_model.lower() == 'nfw':
-        rho = ct.density.rho_nfw_at_r(r3d, mdelta, cdelta, omega_m_transformed, delta=delta_mdef)
-    else:
+    if halo_profile_model.lower() != 'nfw':
         raise ValueError(f"Profile model {halo_profile_model} not currently supported")
+    if backend in ('analytic', 'template'):
+        mdelta, cdelta, z_cl = _add_radial_axes(r3d, mdelta, cdelta, z_cl)
+        r_s, rho_s = _get_nfw_scales(mdelta, cdelta, _get_rho_m(omega_m, z_cl), delta_mdef)
+        rho = rho_s*_nfw_rho_reduced(np.asarray(r3d)/r_s)
+    elif backend == 'cluster_toolkit':
+        omega_m_transformed = _patch_zevolution_cluster_toolkit_rho_m(omega_m, z_cl)
+        rho = _import_cluster_toolkit().density.rho_nfw_at_r(r3d, mdelta, cdelta,
+                                                             omega_m_transformed,
+                                                             delta=delta_mdef)
+    else:
+        raise ValueError(f"Backend {backend} not currently supported")
     return rho
 
 
 def predict_surface_density(r_proj, mdelta, cdelta, z_cl, cosmo, delta_mdef=200,
-                            halo_profile_model='nfw'):
+                            halo_profile_model='nfw', backend='analytic'):
     r""" Computes the surface mass density
 
     .. math::
@@ -191,11 +356,11 @@ def predict_surface_density(r_proj, mdelta, cdelta, z_cl, cosmo, delta_mdef=200,
     ----------
     r_proj : array_like
         Projected radial position from the cluster center in :math:`M\!pc\ h^{-1}`.
-    mdelta : float
+    mdelta : array_like, float
         Galaxy cluster mass in :math:`M_\odot\ h^{-1}`.
-    cdelta : float
+    cdelta : array_like, float
         Galaxy cluster concentration
-    z_cl: float
+    z_cl: array_like, float
         Redshift of the cluster
     cosmo : pyccl.core.Cosmology object
         CCL Cosmology object
@@ -206,6 +371,15 @@ def predict_surface_density(r_proj, mdelta, cdelta, z_cl, cosmo, delta_mdef=200,
 
             `nfw` (default)
 
+    backend : str, optional
+        Implementation of the profile, with the following supported options:
+
+            `analytic` (default) - closed form of the profile
+
+            `template` - rescaling of a dimensionless profile tabulated once
+
+            `cluster_toolkit` - cluster_toolkit functions, requires cluster_toolkit
+
     Returns
     -------
     sigma : array_like, float
@@ -215,21 +389,18 @@ def predict_surface_density(r_proj, mdelta, cdelta, z_cl, cosmo, delta_mdef=200,
     -----
     Need to refactory so we only require arguments that are necessary for all models and use
     another structure to take the arguments necessary for specific models.
-    """
-    cosmo = cclify_astropy_cosmo(cosmo)
-    omega_m = cosmo['Omega_c'] + cosmo['Omega_b']
-    omega_m_transformed = _patch_zevolution_cluster_toolkit_rho_m(omega_m, z_cl)
 
-    if halo_profile_model.lower() == 'nfw':
-        sigma = ct.deltasigma.Sigma_nfw_at_R(r_proj, mdelta, cdelta, omega_m_transformed,
-                                             delta=delta_mdef)
-    else:
-        raise ValueError(f"Profile model {halo_profile_model} not currently supported")
-    return sigma
+    With the `analytic` and `template` backends, the masses, concentrations and cluster
+    redshifts can be arrays that broadcast together, e.g. a grid or an ensemble of walkers.
+    The profiles of all the halos are evaluated at once, and have the shape of the halo
+    parameters followed by the shape of the radii.
+    """
+    return _compute_surface_densities(r_proj, mdelta, cdelta, z_cl, cosmo, delta_mdef,
+                                      halo_profile_model, backend, ('sigma',))[0]
 
 
 def predict_excess_surface_density(r_proj, mdelta, cdelta, z_cl, cosmo, delta_mdef=200,
-                                   halo_profile_model='nfw'):
+                                   halo_profile_model='nfw', backend='analytic'):
     r""" Computes the excess surface density
 
     .. math::
@@ -244,11 +415,11 @@ def predict_excess_surface_density(r_proj, mdelta, cdelta, z_cl, cosmo, delta_md
     ----------
     r_proj : array_like
         Projected radial position from the cluster center in :math:`M\!pc\ h^{-1}`.
-    mdelta : float
+    mdelta : array_like, float
         Galaxy cluster mass in :math:`M_\odot\ h^{-1}`.
-    cdelta : float
+    cdelta : array_like, float
         Galaxy cluster concentration
-    z_cl: float
+    z_cl: array_like, float
         Redshift of the cluster
     cosmo : pyccl.core.Cosmology object
         CCL Cosmology object
@@ -259,27 +430,90 @@ def predict_excess_surface_density(r_proj, mdelta, cdelta, z_cl, cosmo, delta_md
 
             `nfw` (default)
 
+    backend : str, optional
+        Implementation of the profile, with the following supported options:
+
+            `analytic` (default) - closed form of the profile
+
+            `template` - rescaling of a dimensionless profile tabulated once
+
+            `cluster_toolkit` - cluster_toolkit functions, requires cluster_toolkit
+
     Returns
     -------
     deltasigma : array_like, float
         Excess surface density in units of :math:`h\ M_\odot\ pc^{-2}`.
+
+    Notes
+    -----
+    With the `analytic` and `template` backends, the masses, concentrations and cluster
+    redshifts can be arrays that broadcast together, e.g. a grid or an ensemble of walkers.
+    The profiles of all the halos are evaluated at once, and have the shape of the halo
+    parameters followed by the shape of the radii.
+    """
+    return _compute_surface_densities(r_proj, mdelta, cdelta, z_cl, cosmo, delta_mdef,
+                                      halo_profile_model, backend, ('deltasigma',))[0]
+
+
+def _compute_surface_densities(r_proj, mdelta, cdelta, z_cl, cosmo, delta_mdef,
+                               halo_profile_model, backend, profiles=('sigma', 'deltasigma')):
+    r"""Computes the surface density and/or the excess surface density of halos, sharing the
+    cosmology conversion, the scales of the halos and the surface density between them
+
+    Parameters
+    ----------
+    r_proj, mdelta, cdelta, z_cl, cosmo, delta_mdef, halo_profile_model, backend
+        See `predict_surface_density`
+    profiles : tuple, optional
+        Profiles to compute, among `sigma` and `deltasigma`
+
+    Returns
+    -------
+    out : list
+        Profiles in units of :math:`h\ M_\odot\ pc^{-2}`, in the order of `profiles`
     """
     cosmo = cclify_astropy_cosmo(cosmo)
     omega_m = cosmo['Omega_c'] + cosmo['Omega_b']
-    omega_m_transformed = _patch_zevolution_cluster_toolkit_rho_m(omega_m, z_cl)
 
-    sigma_r_proj = np.logspace(-3, 4, 1000)
-
-    if halo_profile_model.lower() == 'nfw':
-        sigma = ct.deltasigma.Sigma_nfw_at_R(sigma_r_proj, mdelta, cdelta,
-                                             omega_m_transformed, delta=delta_mdef)
-        # ^ Note: Let's not use this naming convention when transfering ct to ccl....
-        deltasigma = ct.deltasigma.DeltaSigma_at_R(r_proj, sigma_r_proj,
-                                                   sigma, mdelta, cdelta,
-                                                   omega_m_transformed, delta=delta_mdef)
-    else:
+    if halo_profile_model.lower() != 'nfw':
         raise ValueError(f"Profile model {halo_profile_model} not currently supported")
-    return deltasigma
+    out = {}
+    if backend in ('analytic', 'template'):
+        mdelta, cdelta, z_cl = _add_radial_axes(r_proj, mdelta, cdelta, z_cl)
+        r_s, rho_s = _get_nfw_scales(mdelta, cdelta, _get_rho_m(omega_m, z_cl), delta_mdef)
+        x = np.asarray(r_proj)/r_s
+        # rho_s*r_s in h Msun/Mpc^2, converted to h Msun/pc^2
+        scale = rho_s*r_s*1.e-12
+        if backend == 'analytic':
+            sigma = _nfw_sigma_reduced(x)
+            if 'sigma' in profiles:
+                out['sigma'] = scale*sigma
+            if 'deltasigma' in profiles:
+                out['deltasigma'] = scale*(_nfw_mean_sigma_reduced(x)-sigma)
+        else:
+            template = _get_nfw_template()
+            if 'sigma' in profiles:
+                out['sigma'] = scale*template.sigma(x)
+            if 'deltasigma' in profiles:
+                out['deltasigma'] = scale*template.excess_sigma(x)
+    elif backend == 'cluster_toolkit':
+        ct = _import_cluster_toolkit()
+        omega_m_transformed = _patch_zevolution_cluster_toolkit_rho_m(omega_m, z_cl)
+        if 'sigma' in profiles:
+            out['sigma'] = ct.deltasigma.Sigma_nfw_at_R(r_proj, mdelta, cdelta,
+                                                        omega_m_transformed, delta=delta_mdef)
+        if 'deltasigma' in profiles:
+            sigma_r_proj = np.logspace(-3, 4, 1000)
+            sigma = ct.deltasigma.Sigma_nfw_at_R(sigma_r_proj, mdelta, cdelta,
+                                                 omega_m_transformed, delta=delta_mdef)
+            # ^ Note: Let's not use this naming convention when transfering ct to ccl....
+            out['deltasigma'] = ct.deltasigma.DeltaSigma_at_R(r_proj, sigma_r_proj,
+                                                              sigma, mdelta, cdelta,
+                                                              omega_m_transformed,
+                                                              delta=delta_mdef)
+    else:
+        raise ValueError(f"Backend {backend} not currently supported")
+    return [out[profile] for profile in profiles]
 
 
 def angular_diameter_dist_a1a2(cosmo, a1, a2=1.):
@@ -290,36 +524,31 @@ def angular_diameter_dist_a1a2(cosmo, a1, a2=1.):
     distance from a=1 to a1. If both a1 and a2 are specified, this function
     returns the angular diameter distance between a1 and a2.
 
-    Temporarily using the astropy implementation.
+    The distances are interpolated from a table of the comoving distance of the cosmology,
+    computed once, so that a1 and a2 can be large arrays.
 
     Parameters
     ----------
     cosmo : pyccl.core.Cosmology object
             CCL Cosmology object
-    a1 : float
-        Scale factor.
-    a2 : float, optional
-        Scale factor.
+    a1 : array_like, float
+        Scale factor(s).
+    a2 : array_like, float, optional
+        Scale factor(s).
 
     Returns
     -------
-    d_a : float
-        Angular diameter distance in units :math:`M\!pc\ h^{-1}`
-
-    Notes
-    -----
-    This is definitely broken if other cosmological parameter specifications differ,
-    so we'll have to revise this later. We need to switch angular_diameter_distance_z1z2
-    to CCL equivalent angular distance once implemented
+    d_a : array_like, float
+        Angular diameter distance in units :math:`pc\ h^{-1}`
     """
     redshift1 = _get_z_from_a(a2)
     redshift2 = _get_z_from_a(a1)
-    ap_cosmo = astropyify_ccl_cosmo(cosmo)
+    table = _COSMOLOGIES.get(cosmo).distance_table
 
-    # astropy angular diameter distance in Mpc
+    # angular diameter distance in Mpc
     # need to return in pc/h
-    return ap_cosmo.angular_diameter_distance_z1z2(redshift1, redshift2).to_value(units.pc)\
-           * ap_cosmo.H0.value*.01
+    return table.angular_diameter_distance_z1z2(redshift1, redshift2)*1.e6\
+           *table.cosmo.H0.value*.01
 
 
 def get_critical_surface_density(cosmo, z_cluster, z_source):
@@ -341,28 +570,197 @@ def get_critical_surface_density(cosmo, z_cluster, z_source):
     -------
     sigmacrit : float
         Cosmology-dependent critical surface density in units of :math:`h\ M_\odot\ pc^{-2}`
-
-    Notes
-    -----
-    We will need :math:`\gamma_\infty` and :math:`\kappa_\infty` for alternative
-    z_src_models using :math:`\beta_s`.
     """
+    table = _COSMOLOGIES.get(cosmo).distance_table
+    sigmacrit = _get_critical_surface_density_inf(table, z_cluster)\
+                / table.distance_ratio(z_cluster, z_source)
+    return sigmacrit
+
+
+def _get_critical_surface_density_inf(table, z_cluster):
+    r"""Critical surface density :math:`c^2/(4\pi G D_L)` of sources with a lensing efficiency
+    :math:`D_{LS}/D_S = 1`, in units of :math:`h\ M_\odot\ pc^{-2}`"""
     clight_pc_s = const.CLIGHT_KMS.value * 1000. / const.PC_TO_METER.value
     gnewt_pc3_msun_s2 = const.GNEWT.value * const.SOLAR_MASS.value / const.PC_TO_METER.value**3
 
-    aexp_cluster = _get_a_from_z(z_cluster)
-    aexp_src = _get_a_from_z(z_source)
+    # Distance in Mpc, converted to pc/h
+    d_l = table.angular_diameter_distance(z_cluster)
+    return 1. / d_l / (1.e6 * table.cosmo.H0.value * .01)\
+           * clight_pc_s * clight_pc_s / (4.0 * np.pi * gnewt_pc3_msun_s2)
 
-    d_l = angular_diameter_dist_a1a2(cosmo, aexp_cluster, 1.0)
-    d_s = angular_diameter_dist_a1a2(cosmo, aexp_src, 1.0)
-    d_ls = angular_diameter_dist_a1a2(cosmo, aexp_src, aexp_cluster)
 
-    sigmacrit = d_s / (d_l * d_ls) * clight_pc_s * clight_pc_s / (4.0 * np.pi * gnewt_pc3_msun_s2)
-    return sigmacrit
+def compute_beta_s_moments(cosmo, z_cluster, z_distribution, zmax=10.):
+    r"""Computes the mean and the mean square of the lensing efficiency of sources with a
+    redshift distribution :math:`n(z)`,
+
+    .. math::
+        \langle\beta_s^k\rangle = \frac{\int_0^{z_{max}} dz\ n(z)\ \beta_s(z)^k}
+        {\int_0^{z_{max}} dz\ n(z)}, \quad
+        \beta_s(z) = \max\left(0, \frac{D_{LS}}{D_S}\right)
+
+    The integrals are computed once per cosmology, cluster redshift and distribution, and
+    cached with the distance table of the cosmology, so that the shear and convergence of
+    any halo at the same redshift are rescalings of :math:`\gamma_\infty` and
+    :math:`\kappa_\infty`, the values for :math:`\beta_s = 1`. The 1024 most recently used
+    moments are kept per cosmology.
+
+    Parameters
+    ----------
+    cosmo : pyccl.core.Cosmology object
+        CCL Cosmology object
+    z_cluster : array_like, float
+        Galaxy cluster redshift(s)
+    z_distribution : callable
+        Source redshift distribution :math:`n(z)`, not necessarily normalized, vectorized
+        over redshifts. The cache is keyed by the function itself, which should then be
+        reused between calls rather than redefined.
+    zmax : float, optional
+        Maximum source redshift of the integrals
+
+    Returns
+    -------
+    beta_s_mean : array_like
+        Mean lensing efficiency :math:`\langle\beta_s\rangle`, with the shape of `z_cluster`
+    beta_s_square_mean : array_like
+        Mean square lensing efficiency :math:`\langle\beta_s^2\rangle`, with the shape of
+        `z_cluster`
+    """
+    entry = _COSMOLOGIES.get(cosmo)
+    z_cluster = np.asarray(z_cluster, dtype=float)
+    z_unique, index = np.unique(z_cluster, return_inverse=True)
+    if np.any(z_unique >= zmax):
+        raise ValueError(f"Cluster redshifts must be below zmax={zmax}")
+    moments = {z_cl: entry.beta_s_moments.get((z_distribution, z_cl, zmax))
+               for z_cl in z_unique}
+    missing = [z_cl for z_cl, moment in moments.items() if moment is None]
+    if missing:
+        moments.update(zip(missing, _integrate_beta_s_moments(
+            entry.distance_table, np.array(missing), z_distribution, zmax)))
+        entry.beta_s_moments.update(((z_distribution, z_cl, zmax), moments[z_cl])
+                                    for z_cl in missing)
+    moments = np.array([moments[z_cl] for z_cl in z_unique])[index.reshape(z_cluster.shape)]
+    return moments[..., 0], moments[..., 1]
+
+
+def _integrate_beta_s_moments(table, z_cluster, z_distribution, zmax, npoints=2001):
+    """Integrates the moments of the lensing efficiency with Simpson's rule, the sources
+    being lensed only behind the clusters
+
+    Parameters
+    ----------
+    table : DistanceTable
+        Distance table of the cosmology
+    z_cluster : array_like
+        Cluster redshifts, 1d array
+    z_distribution : callable
+        Source redshift distribution
+    zmax : float
+        Maximum source redshift
+    npoints : int, optional
+        Number of redshifts of the integration grids
+
+    Returns
+    -------
+    moments : array_like
+        Mean and mean square lensing efficiency of each cluster redshift, shape (n, 2)
+    """
+    z_grid = np.linspace(0., zmax, npoints)
+    norm = simpson(z_distribution(z_grid), x=z_grid)
+    z_cluster = z_cluster[:, None]
+    z_grid = z_cluster+(zmax-z_cluster)*np.linspace(0., 1., npoints)
+    weights = z_distribution(z_grid)/norm
+    beta_s = table.distance_ratio(z_cluster, z_grid)
+    return np.stack([simpson(weights*beta_s, x=z_grid, axis=-1),
+                     simpson(weights*beta_s**2, x=z_grid, axis=-1)], axis=-1)
+
+
+def compute_mean_inverse_critical_surface_density(cosmo, z_cluster, pdfs):
+    r"""Computes the mean inverse critical surface density of sources with photometric
+    redshift PDFs,
+
+    .. math::
+        \langle\Sigma_{crit}^{-1}\rangle_i = \int dz\ p_i(z)\ \Sigma_{crit}^{-1}(z),
+
+    where :math:`\Sigma_{crit}^{-1}` is zero for sources in front of the cluster.
+
+    :math:`\Sigma_{crit}^{-1}` is tabulated once on the redshift grid of the PDFs, and the
+    means of all the sources are a single product of this row with the PDFs.
+
+    Parameters
+    ----------
+    cosmo : pyccl.core.Cosmology object
+        CCL Cosmology object
+    z_cluster : array_like, float
+        Galaxy cluster redshift(s)
+    pdfs : PhotoZPDFs
+        Photometric redshift PDFs of the sources
+
+    Returns
+    -------
+    sigma_c_inv : array_like
+        Mean inverse critical surface density of each source in units of
+        :math:`pc^2\ h^{-1}\ M_\odot^{-1}`, with the shape of `z_cluster` followed by the
+        number of sources
+    """
+    table = _COSMOLOGIES.get(cosmo).distance_table
+    z_cluster = np.asarray(z_cluster, dtype=float)[..., None]
+    # Grid redshifts below zero are in front of any cluster
+    with np.errstate(divide='ignore'):
+        beta_s = np.maximum(table.distance_ratio(z_cluster, np.maximum(pdfs.zbins, 0.)), 0.)
+    sigma_c_inv = beta_s/_get_critical_surface_density_inf(table, z_cluster)
+    means = pdfs.integrate(sigma_c_inv.reshape(-1, len(pdfs.zbins)).T)
+    return means.T.reshape(z_cluster.shape[:-1]+(len(pdfs),))
+
+
+def _get_inverse_critical_surface_density(cosmo, r_proj, z_cluster, z_source, z_src_model):
+    r"""Inverse critical surface density of the sources at each projected radius
+
+    Parameters
+    ----------
+    cosmo : pyccl.core.Cosmology object
+        CCL Cosmology object
+    r_proj : array_like
+        The projected radial positions in :math:`M\!pc\ h^{-1}`
+    z_cluster : array_like, float
+        Galaxy cluster redshift(s)
+    z_source : array_like, float
+        Background source galaxy redshift(s), or redshift distribution
+    z_src_model : str
+        Source redshift model, `single_plane`, `known_z_src` or `z_src_distribution`
+
+    Returns
+    -------
+    sigma_c_inv : array_like
+        Inverse critical surface density in units of :math:`pc^2\ h^{-1}\ M_\odot^{-1}`, with
+        the shape of `z_cluster` followed by the shape of `r_proj`
+    """
+    if z_src_model == 'single_plane':
+        return 1./get_critical_surface_density(cosmo, _add_radial_axes(r_proj, z_cluster)[0],
+                                               z_source)
+    if z_src_model == 'known_z_src':
+        # The distances are computed once per distinct source redshift, and the sources in
+        # front of the cluster, including those with negative (photometric) redshifts, are
+        # not lensed
+        z_source = np.broadcast_to(np.asarray(z_source, dtype=float), np.shape(r_proj))
+        z_unique, index = np.unique(z_source, return_inverse=True)
+        z_cluster = np.expand_dims(np.asarray(z_cluster, dtype=float), -1)
+        with np.errstate(divide='ignore'):
+            sigma_c_inv = np.where(z_unique > z_cluster,
+                                   1./get_critical_surface_density(cosmo, z_cluster,
+                                                                   np.maximum(z_unique, 0.)),
+                                   0.)
+        return sigma_c_inv.take(index.reshape(z_source.shape), axis=-1)
+    if z_src_model == 'z_src_distribution':
+        z_cluster = _add_radial_axes(r_proj, z_cluster)[0]
+        beta_s_mean = compute_beta_s_moments(cosmo, z_cluster, z_source)[0]
+        return beta_s_mean/_get_critical_surface_density_inf(
+            _COSMOLOGIES.get(cosmo).distance_table, z_cluster)
+    raise ValueError("Unsupported z_src_model")
 
 
 def predict_tangential_shear(r_proj, mdelta, cdelta, z_cluster, z_source, cosmo, delta_mdef=200,
-                             halo_profile_model='nfw', z_src_model='single_plane'):
+                             halo_profile_model='nfw', z_src_model='single_plane',
+                             backend='analytic'):
     r"""Computes the tangential shear
 
     .. math::
@@ -377,14 +775,15 @@ def predict_tangential_shear(r_proj, mdelta, cdelta, z_cluster, z_source, cosmo,
     ----------
     r_proj : array_like
         The projected radial positions in :math:`M\!pc\ h^{-1}`.
-    mdelta : float
+    mdelta : array_like, float
         Galaxy cluster mass in :math:`M_\odot\ h^{-1}`.
-    cdelta : float
+    cdelta : array_like, float
         Galaxy cluster NFW concentration.
-    z_cluster : float
+    z_cluster : array_like, float
         Galaxy cluster redshift
     z_source : array_like, float
-        Background source galaxy redshift(s)
+        Background source galaxy redshift(s), e.g. one per radius, or redshift distribution
+        for the `z_src_distribution` model
     cosmo : pyccl.core.Cosmology object
         CCL Cosmology object
     delta_mdef : int, optional
@@ -395,9 +794,13 @@ def predict_tangential_shear(r_proj, mdelta, cdelta, z_cluster, z_source, cosmo,
     z_src_model : str, optional
         Source redshift model, with the following supported options:
         `single_plane` (default) - all sources at one redshift
-        `known_z_src` - known individual source galaxy redshifts e.g. discrete case
+        `known_z_src` - known individual source galaxy redshifts e.g. discrete case, with one
+        redshift per radius. The sources in front of the cluster are not lensed.
         `z_src_distribution` - known source redshift distribution e.g. continuous
-        case requiring integration.
+        case, `z_source` being the distribution :math:`n(z)`, see `compute_beta_s_moments`.
+    backend : str, optional
+        Implementation of the halo profile, `analytic` (default), `template` or
+        `cluster_toolkit`, see `predict_surface_density`.
 
     Returns
     -------
@@ -406,31 +809,24 @@ def predict_tangential_shear(r_proj, mdelta, cdelta, z_cluster, z_source, cosmo,
 
     Notes
     -----
-    TODO: Implement `known_z_src` and `z_src_distribution` options
-    We will need :math:`\gamma_\infty` and :math:`\kappa_\infty` for alternative
-    z_src_models using :math:`\beta_s`.
+    With `z_src_distribution`, :math:`\beta_s` is the mean lensing efficiency of the
+    distribution, see `compute_beta_s_moments`.
     Need to figure out if we want to raise exceptions rather than errors here?
+
+    The masses, concentrations and cluster redshifts can be arrays that broadcast together,
+    the result then has their shape followed by the shape of `r_proj`.
     """
     delta_sigma = predict_excess_surface_density(r_proj, mdelta, cdelta, z_cluster, cosmo,
                                                  delta_mdef=delta_mdef,
-                                                 halo_profile_model=halo_profile_model)
-
-    if z_src_model == 'single_plane':
-        sigma_c = get_critical_surface_density(cosmo, z_cluster, z_source)
-        gammat = delta_sigma / sigma_c
-    # elif z_src_model == 'known_z_src': # Discrete case
-    #     raise NotImplementedError('Need to implemnt Beta_s functionality, or average' +
-    #                               'delta_sigma/sigma_c gamma_t = Beta_s*gamma_inf')
-    # elif z_src_model == 'z_src_distribution': # Continuous ( from a distribution) case
-    #     raise NotImplementedError('Need to implement Beta_s calculation from integrating' +
-    #                               'distribution of redshifts in each radial bin')
-    else:
-        raise ValueError("Unsupported z_src_model")
-    return gammat
+                                                 halo_profile_model=halo_profile_model,
+                                                 backend=backend)
+    return delta_sigma*_get_inverse_critical_surface_density(cosmo, r_proj, z_cluster,
+                                                             z_source, z_src_model)
 
 
 def predict_convergence(r_proj, mdelta, cdelta, z_cluster, z_source, cosmo, delta_mdef=200,
-                        halo_profile_model='nfw', z_src_model='single_plane'):
+                        halo_profile_model='nfw', z_src_model='single_plane',
+                        backend='analytic'):
     r"""Computes the mass convergence
 
     .. math::
@@ -445,14 +841,15 @@ def predict_convergence(r_proj, mdelta, cdelta, z_cluster, z_source, cosmo, delt
     ----------
     r_proj : array_like
         The projected radial positions in :math:`M\!pc\ h^{-1}`.
-    mdelta : float
+    mdelta : array_like, float
         Galaxy cluster mass in :math:`M_\odot\ h^{-1}`.
-    cdelta : float
+    cdelta : array_like, float
         Galaxy cluster NFW concentration.
-    z_cluster : float
+    z_cluster : array_like, float
         Galaxy cluster redshift
     z_source : array_like, float
-        Background source galaxy redshift(s)
+        Background source galaxy redshift(s), e.g. one per radius, or redshift distribution
+        for the `z_src_distribution` model
     cosmo : pyccl.core.Cosmology object
         CCL Cosmology object
     delta_mdef : int, optional
@@ -463,9 +860,13 @@ def predict_convergence(r_proj, mdelta, cdelta, z_cluster, z_source, cosmo, delt
     z_src_model : str, optional
         Source redshift model, with the following supported options:
         `single_plane` (default) - all sources at one redshift
-        `known_z_src` - known individual source galaxy redshifts e.g. discrete case
+        `known_z_src` - known individual source galaxy redshifts e.g. discrete case, with one
+        redshift per radius. The sources in front of the cluster are not lensed.
         `z_src_distribution` - known source redshift distribution e.g. continuous
-        case requiring integration.
+        case, `z_source` being the distribution :math:`n(z)`, see `compute_beta_s_moments`.
+    backend : str, optional
+        Implementation of the halo profile, `analytic` (default), `template` or
+        `cluster_toolkit`, see `predict_surface_density`.
 
     Returns
     -------
@@ -475,41 +876,35 @@ def predict_convergence(r_proj, mdelta, cdelta, z_cluster, z_source, cosmo, delt
     Notes
     -----
     Need to figure out if we want to raise exceptions rather than errors here?
+
+    The masses, concentrations and cluster redshifts can be arrays that broadcast together,
+    the result then has their shape followed by the shape of `r_proj`.
     """
     sigma = predict_surface_density(r_proj, mdelta, cdelta, z_cluster, cosmo,
-                                    delta_mdef=delta_mdef, halo_profile_model=halo_profile_model)
-
-    if z_src_model == 'single_plane':
-        sigma_c = get_critical_surface_density(cosmo, z_cluster, z_source)
-        kappa = sigma / sigma_c
-    # elif z_src_model == 'known_z_src': # Discrete case
-    #     raise NotImplementedError('Need to implemnt Beta_s functionality, or average' +\
-    #                               'sigma/sigma_c kappa_t = Beta_s*kappa_inf')
-    # elif z_src_model == 'z_src_distribution': # Continuous ( from a distribution) case
-    #     raise NotImplementedError('Need to implement Beta_s calculation from integrating' +\
-    #                               'distribution of redshifts in each radial bin')
-    else:
-        raise ValueError("Unsupported z_src_model")
-    return kappa
+                                    delta_mdef=delta_mdef, halo_profile_model=halo_profile_model,
+                                    backend=backend)
+    return sigma*_get_inverse_critical_surface_density(cosmo, r_proj, z_cluster, z_source,
+                                                       z_src_model)
 
 
 def predict_reduced_tangential_shear(r_proj, mdelta, cdelta, z_cluster, z_source, cosmo,
                                      delta_mdef=200, halo_profile_model='nfw',
-                                     z_src_model='single_plane'):
+                                     z_src_model='single_plane', backend='analytic'):
     r"""Computes the reduced tangential shear :math:`g_t = \frac{\gamma_t}{1-\kappa}`.
 
     Parameters
     ----------
     r_proj : array_like
         The projected radial positions in :math:`M\!pc\ h^{-1}`.
-    mdelta : float
+    mdelta : array_like, float
         Galaxy cluster mass in :math:`M_\odot\ h^{-1}`.
-    cdelta : float
+    cdelta : array_like, float
         Galaxy cluster NFW concentration.
-    z_cluster : float
+    z_cluster : array_like, float
         Galaxy cluster redshift
     z_source : array_like, float
-        Background source galaxy redshift(s)
+        Background source galaxy redshift(s), e.g. one per radius, or redshift distribution
+        for the `z_src_distribution` model
     cosmo : pyccl.core.Cosmology object
         CCL Cosmology object
     delta_mdef : int, optional
@@ -520,9 +915,13 @@ def predict_reduced_tangential_shear(r_proj, mdelta, cdelta, z_cluster, z_source
     z_src_model : str, optional
         Source redshift model, with the following supported options:
         `single_plane` (default) - all sources at one redshift
-        `known_z_src` - known individual source galaxy redshifts e.g. discrete case
-        `z_src_distribution` - known source redshift distribution, e.g. continuous
-        case requiring integration.
+        `known_z_src` - known individual source galaxy redshifts e.g. discrete case, with one
+        redshift per radius. The sources in front of the cluster are not lensed.
+        `z_src_distribution` - known source redshift distribution e.g. continuous
+        case, `z_source` being the distribution :math:`n(z)`, see `compute_beta_s_moments`.
+    backend : str, optional
+        Implementation of the halo profile, `analytic` (default), `template` or
+        `cluster_toolkit`, see `predict_surface_density`.
 
     Returns
     -------
@@ -532,20 +931,92 @@ def predict_reduced_tangential_shear(r_proj, mdelta, cdelta, z_cluster, z_source
     Notes
     -----
     Need to figure out if we want to raise exceptions rather than errors here?
+
+    The masses, concentrations and cluster redshifts can be arrays that broadcast together,
+    the result then has their shape followed by the shape of `r_proj`.
     """
-    if z_src_model == 'single_plane':
-        kappa = predict_convergence(r_proj, mdelta, cdelta, z_cluster, z_source, cosmo, delta_mdef,
-                                    halo_profile_model,
-                                    z_src_model)
-        gamma_t = predict_tangential_shear(r_proj, mdelta, cdelta, z_cluster, z_source, cosmo,
-                                           delta_mdef, halo_profile_model, z_src_model)
-        red_tangential_shear = gamma_t / (1 - kappa)
-    # elif z_src_model == 'known_z_src': # Discrete case
-    #     raise NotImplementedError('Need to implemnt Beta_s functionality, or average' +
-    #                               'sigma/sigma_c kappa_t = Beta_s*kappa_inf')
-    # elif z_src_model == 'z_src_distribution': # Continuous ( from a distribution) case
-    #     raise NotImplementedError('Need to implement Beta_s and Beta_s2 calculation from' +
-    #                               'integrating distribution of redshifts in each radial bin')
+    return predict_lensing_observables(r_proj, mdelta, cdelta, z_cluster, z_source, cosmo,
+                                       delta_mdef=delta_mdef,
+                                       halo_profile_model=halo_profile_model,
+                                       z_src_model=z_src_model, backend=backend)['gt']
+
+
+def predict_lensing_observables(r_proj, mdelta, cdelta, z_cluster, z_source, cosmo,
+                                delta_mdef=200, halo_profile_model='nfw',
+                                z_src_model='single_plane', backend='analytic',
+                                magnification=False):
+    r"""Computes the tangential shear, the convergence and the reduced tangential shear
+    together, and optionally the magnification
+
+    .. math::
+        \gamma_t = \frac{\Delta\Sigma}{\Sigma_{crit}}, \quad
+        \kappa = \frac{\Sigma}{\Sigma_{crit}}, \quad
+        g_t = \frac{\gamma_t}{1-\kappa}, \quad
+        \mu = \frac{1}{(1-\kappa)^2-\gamma_t^2}
+
+    The cosmology conversion, the halo scales, the surface density profile and the critical
+    surface density are computed once for all the observables, instead of once per call of
+    `predict_tangential_shear` and `predict_convergence`. With `z_src_distribution`, the
+    reduced shear is :math:`\langle\beta_s\rangle\gamma_\infty/
+    (1-\kappa_\infty\langle\beta_s^2\rangle/\langle\beta_s\rangle)`.
+
+    Parameters
+    ----------
+    r_proj : array_like
+        The projected radial positions in :math:`M\!pc\ h^{-1}`.
+    mdelta : array_like, float
+        Galaxy cluster mass in :math:`M_\odot\ h^{-1}`.
+    cdelta : array_like, float
+        Galaxy cluster NFW concentration.
+    z_cluster : array_like, float
+        Galaxy cluster redshift
+    z_source : array_like, float
+        Background source galaxy redshift(s), e.g. one per radius, or redshift distribution
+        for the `z_src_distribution` model
+    cosmo : pyccl.core.Cosmology object
+        CCL Cosmology object
+    delta_mdef : int, optional
+        Mass overdensity definition.  Defaults to 200.
+    halo_profile_model : str, optional
+        Profile model parameterization, with the following supported options:
+        `nfw` (default) - [insert citation here]
+    z_src_model : str, optional
+        Source redshift model, with the following supported options:
+        `single_plane` (default) - all sources at one redshift
+        `known_z_src` - known individual source galaxy redshifts, with one redshift per radius
+        `z_src_distribution` - known source redshift distribution :math:`n(z)`
+    backend : str, optional
+        Implementation of the halo profile, `analytic` (default), `template` or
+        `cluster_toolkit`, see `predict_surface_density`.
+    magnification : bool, optional
+        Also compute the magnification
+
+    Returns
+    -------
+    observables : dict
+        Tangential shear `gammat`, convergence `kappa`, reduced tangential shear `gt` and,
+        if requested, magnification `mu`
+
+    Notes
+    -----
+    The masses, concentrations and cluster redshifts can be arrays that broadcast together,
+    the observables then have their shape followed by the shape of `r_proj`.
+    """
+    sigma, delta_sigma = _compute_surface_densities(r_proj, mdelta, cdelta, z_cluster, cosmo,
+                                                    delta_mdef, halo_profile_model, backend)
+    sigma_c_inv = _get_inverse_critical_surface_density(cosmo, r_proj, z_cluster, z_source,
+                                                        z_src_model)
+    gammat, kappa = delta_sigma*sigma_c_inv, sigma*sigma_c_inv
+    if z_src_model == 'z_src_distribution':
+        # g_t = <beta_s> gamma_inf/(1-<beta_s^2>/<beta_s> kappa_inf), Seitz & Schneider (1997)
+        beta_s_mean, beta_s_square_mean = compute_beta_s_moments(
+            cosmo, _add_radial_axes(r_proj, z_cluster)[0], z_source)
+        with np.errstate(divide='ignore', invalid='ignore'):
+            kappa_factor = np.where(beta_s_mean > 0., beta_s_square_mean/beta_s_mean**2, 1.)
+        gt = get_reduced_shear_from_convergence(gammat, kappa*kappa_factor)
     else:
-        raise ValueError("Unsupported z_src_model")
-    return red_tangential_shear
+        gt = get_reduced_shear_from_convergence(gammat, kappa)
+    observables = {'gammat': gammat, 'kappa': kappa, 'gt': gt}
+    if magnification:
+        observables['mu'] = 1./((1.-kappa)**2-gammat**2)
+    return observables
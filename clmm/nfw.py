@@ -0,0 +1,220 @@
+"""@file nfw.py
+Closed forms and precomputed templates of the NFW profile
+"""
+import numpy as np
+from scipy.interpolate import CubicSpline
+from .constants import Constants as const
+
+
+def _get_rho_m(omega_m, redshift):
+    r"""Mean matter density at a redshift, :math:`\Omega_m(1+z)^3\rho_{crit,0}`, in
+    :math:`h^2\ M_\odot\ M\!pc^{-3}`
+
+    Parameters
+    ----------
+    omega_m : float
+        Mean matter density at z=0 in units of the critical density
+    redshift : array_like
+        Redshift
+
+    Returns
+    -------
+    rho_m : array_like
+        Mean matter density
+    """
+    rhocrit_mks = 3.*100.*100./(8.*np.pi*const.GNEWT.value)
+    rhocrit_cosmo = rhocrit_mks*1000.*1000.*const.PC_TO_METER.value*1.e6/const.SOLAR_MASS.value
+    return omega_m*(1.+np.asarray(redshift))**3*rhocrit_cosmo
+
+
+def _get_nfw_scales(mdelta, cdelta, rho_m, delta_mdef):
+    r"""Scale radius and density of an NFW halo, such that
+    :math:`\rho(r) = \rho_s/\left(x(1+x)^2\right)` with :math:`x = r/r_s`
+
+    Parameters
+    ----------
+    mdelta : array_like
+        Galaxy cluster mass in :math:`M_\odot\ h^{-1}`
+    cdelta : array_like
+        Galaxy cluster concentration
+    rho_m : array_like
+        Mean matter density in :math:`h^2\ M_\odot\ M\!pc^{-3}`
+    delta_mdef : int
+        Mass overdensity definition
+
+    Returns
+    -------
+    r_s : array_like
+        Scale radius in :math:`M\!pc\ h^{-1}`
+    rho_s : array_like
+        Scale density in :math:`h^2\ M_\odot\ M\!pc^{-3}`
+    """
+    r_delta = (3.*mdelta/(4.*np.pi*delta_mdef*rho_m))**(1./3.)
+    rho_s = delta_mdef*rho_m*cdelta**3/(3.*(np.log1p(cdelta)-cdelta/(1.+cdelta)))
+    return r_delta/cdelta, rho_s
+
+
+def _nfw_rho_reduced(x):
+    r"""Density of an NFW halo in units of :math:`\rho_s`, :math:`1/\left(x(1+x)^2\right)`"""
+    x = np.asarray(x, dtype=float)
+    return 1./(x*(1.+x)**2)
+
+
+def _nfw_f(x):
+    r"""The function :math:`F(x)` of the projected NFW profile
+
+    .. math::
+        F(x) = \frac{{\rm arccosh}(1/x)}{\sqrt{1-x^2}}\ (x<1), \quad
+        \frac{\arccos(1/x)}{\sqrt{x^2-1}}\ (x>1)
+
+    Both branches are the series :math:`\sum_n (1-x^2)^n/(2n+1)`, which is used close to
+    :math:`x=1`.
+    """
+    x = np.asarray(x, dtype=float)
+    s = (x-1.)*(x+1.)
+    out = np.empty(np.shape(x))
+    inner, outer = s < -1.e-2, s > 1.e-2
+    sqrt_s = np.sqrt(-s[inner])
+    out[inner] = np.log((1.+sqrt_s)/x[inner])/sqrt_s
+    sqrt_s = np.sqrt(s[outer])
+    out[outer] = np.arctan(sqrt_s)/sqrt_s
+    near = ~(inner | outer)
+    out[near] = np.polynomial.polynomial.polyval(-s[near], 1./(2.*np.arange(10)+1.))
+    return out
+
+
+def _nfw_sigma_reduced(x):
+    r"""Surface density of an NFW halo in units of :math:`\rho_s r_s`,
+
+    .. math::
+        \Sigma(x)/(\rho_s r_s) = 2\frac{1-F(x)}{x^2-1}
+    """
+    x = np.asarray(x, dtype=float)
+    s = (x-1.)*(x+1.)
+    out = np.empty(np.shape(x))
+    far = np.abs(s) > 1.e-2
+    out[far] = 2.*(1.-_nfw_f(x[far]))/s[far]
+    # (1-F)/s = sum_n (-1)^n s^n/(2n+3), without the cancellation of the closed form
+    near = ~far
+    out[near] = 2.*np.polynomial.polynomial.polyval(-s[near], 1./(2.*np.arange(10)+3.))
+    return out
+
+
+def _nfw_mean_sigma_reduced(x):
+    r"""Mean surface density of an NFW halo within :math:`x` in units of
+    :math:`\rho_s r_s`,
+
+    .. math::
+        \bar{\Sigma}(<x)/(\rho_s r_s) = \frac{4}{x^2}\left(\ln\frac{x}{2} + F(x)\right)
+    """
+    x = np.asarray(x, dtype=float)
+    out = np.empty(np.shape(x))
+    # At small x, ln(x/2) and F(x) cancel, write their sum with t = sqrt(1-x^2) as
+    # [-x^2 ln(x/2)/(1+t) + ln(1-x^2/(2(1+t)))]/t
+    small = x < 0.5
+    x_small = x[small]
+    t_small = np.sqrt((1.-x_small)*(1.+x_small))
+    out[small] = 4.*(-np.log(x_small/2.)/(1.+t_small)
+                     +np.log1p(-x_small**2/(2.*(1.+t_small)))/x_small**2)/t_small
+    x_large = x[~small]
+    out[~small] = 4.*(np.log(x_large/2.)+_nfw_f(x_large))/x_large**2
+    return out
+
+
+def _nfw_excess_sigma_reduced(x):
+    r"""Excess surface density of an NFW halo in units of :math:`\rho_s r_s`,
+    :math:`\bar{\Sigma}(<x)-\Sigma(x)`"""
+    return _nfw_mean_sigma_reduced(x)-_nfw_sigma_reduced(x)
+
+
+class NFWTemplate():
+    r"""Dimensionless surface density and excess surface density of the NFW profile,
+    tabulated once as functions of :math:`x = R/r_s`
+
+    The profile of any halo is a rescaling of the template,
+    :math:`\Sigma(R) = \rho_s r_s \tilde{\Sigma}(R/r_s)` and
+    :math:`\Delta\Sigma(R) = \rho_s r_s \Delta\tilde{\Sigma}(R/r_s)`, so that the closed forms
+    are evaluated only when building the template. The logarithms of the profiles are
+    interpolated with cubic splines on a grid regular in :math:`\ln x`, with relative errors
+    below :math:`10^{-10}`. The closed forms are used outside of the grid.
+
+    Attributes
+    ----------
+    xmin : float
+        Lower bound of the grid
+    xmax : float
+        Upper bound of the grid
+    """
+    def __init__(self, xmin=1.e-5, xmax=1.e5, step=5.e-3):
+        nsteps = int(np.ceil(np.log(xmax/xmin)/step))
+        self._lnx = np.log(xmin)+step*np.arange(nsteps+1)
+        self._step = step
+        self.xmin, self.xmax = xmin, np.exp(self._lnx[-1])
+        x = np.exp(self._lnx)
+        self._coeffs = {
+            'sigma': CubicSpline(self._lnx, np.log(_nfw_sigma_reduced(x))).c,
+            'excess_sigma': CubicSpline(self._lnx, np.log(_nfw_excess_sigma_reduced(x))).c}
+
+    def _interpolate(self, name, x):
+        """Evaluates the spline of a profile, locating the intervals directly on the grid"""
+        lnx = np.log(x)
+        index = np.clip(((lnx-self._lnx[0])*(1./self._step)).astype(np.intp), 0,
+                        len(self._lnx)-2)
+        dlnx = lnx-self._lnx.take(index)
+        coeffs = self._coeffs[name]
+        lnprofile = coeffs[0].take(index)
+        for coeffs_ in coeffs[1:]:
+            lnprofile *= dlnx
+            lnprofile += coeffs_.take(index)
+        return np.exp(lnprofile)
+
+    def _evaluate(self, name, x, closed_form):
+        """Template inside the grid, closed form outside"""
+        x = np.asarray(x, dtype=float)
+        ingrid = (x >= self.xmin) & (x <= self.xmax)
+        if np.all(ingrid):
+            return self._interpolate(name, x)
+        out = np.empty(x.shape)
+        out[ingrid] = self._interpolate(name, x[ingrid])
+        out[~ingrid] = closed_form(x[~ingrid])
+        return out
+
+    def sigma(self, x):
+        r"""Surface density in units of :math:`\rho_s r_s`
+
+        Parameters
+        ----------
+        x : array_like
+            Projected radius in units of the scale radius
+
+        Returns
+        -------
+        sigma : array_like
+            Reduced surface density
+        """
+        return self._evaluate('sigma', x, _nfw_sigma_reduced)
+
+    def excess_sigma(self, x):
+        r"""Excess surface density in units of :math:`\rho_s r_s`
+
+        Parameters
+        ----------
+        x : array_like
+            Projected radius in units of the scale radius
+
+        Returns
+        -------
+        excess_sigma : array_like
+            Reduced excess surface density
+        """
+        return self._evaluate('excess_sigma', x, _nfw_excess_sigma_reduced)
+
+
+_TEMPLATE = []
+
+
+def _get_nfw_template():
+    """NFW template of the process, built at the first call"""
+    if not _TEMPLATE:
+        _TEMPLATE.append(NFWTemplate())
+    return _TEMPLATE[0]
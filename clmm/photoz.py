@@ -0,0 +1,99 @@
+"""@file photoz.py
+The PhotoZPDFs class, photometric redshift PDFs of source galaxies on a shared grid
+"""
+import numpy as np
+
+
+class PhotoZPDFs():
+    r"""Photometric redshift PDFs of many source galaxies, sampled on a shared redshift grid
+
+    The PDFs are stored in a single 2d array of shape (ngals, nz), in single precision by
+    default, rather than one array per galaxy. The PDFs are normalized with the trapezoidal
+    rule on the grid, so that the mean of any function of redshift over each PDF,
+
+    .. math::
+        \langle f \rangle_i = \int dz\ p_i(z) f(z),
+
+    is a single matrix-vector product of the PDFs with the tabulated function, see
+    `integrate`.
+
+    Attributes
+    ----------
+    zbins : array_like
+        Redshift grid, strictly increasing
+    pdfs : array_like
+        Normalized PDFs of the galaxies on the grid, shape (ngals, nz)
+    """
+    def __init__(self, zbins, pdfs, dtype=np.float32):
+        zbins = np.asarray(zbins, dtype=float)
+        if zbins.ndim != 1 or len(zbins) < 2 or np.any(np.diff(zbins) <= 0.):
+            raise ValueError("zbins must be an increasing sequence of at least two redshifts")
+        pdfs = np.asarray(pdfs, dtype=dtype)
+        if pdfs.ndim != 2 or pdfs.shape[1] != len(zbins):
+            raise ValueError("pdfs must be a 2d array with one column per redshift of zbins")
+        self.zbins = zbins
+        # Trapezoidal rule weights of the grid
+        self._weights = np.zeros(len(zbins))
+        self._weights[1:] += 0.5*np.diff(zbins)
+        self._weights[:-1] += 0.5*np.diff(zbins)
+        norms = pdfs@self._weights.astype(dtype)
+        if not np.all(norms > 0.):
+            raise ValueError("The PDFs must have a positive integral on the redshift grid")
+        self.pdfs = pdfs/norms[:, None]
+
+    @classmethod
+    def from_ragged(cls, pzbins, pzpdf, zbins, dtype=np.float32):
+        """Builds the PDFs from one redshift grid per galaxy, e.g. the `pzbins` and `pzpdf`
+        columns of a catalog, by linear interpolation on a shared grid
+
+        Parameters
+        ----------
+        pzbins : list
+            Redshift grid of each galaxy
+        pzpdf : list
+            PDF of each galaxy on its grid
+        zbins : array_like
+            Shared redshift grid. The PDFs are zero outside of the grid of each galaxy.
+        dtype : data-type, optional
+            Data type of the stored PDFs
+
+        Returns
+        -------
+        pdfs : PhotoZPDFs
+            PDFs on the shared grid
+        """
+        if len(pzbins) != len(pzpdf):
+            raise TypeError('pzbins and pzpdf must have the same length.')
+        zbins = np.asarray(zbins, dtype=float)
+        pdfs = np.empty((len(pzbins), len(zbins)), dtype=dtype)
+        for pdf, zbins_gal, pdf_gal in zip(pdfs, pzbins, pzpdf):
+            pdf[:] = np.interp(zbins, zbins_gal, pdf_gal, left=0., right=0.)
+        return cls(zbins, pdfs, dtype=dtype)
+
+    def integrate(self, values):
+        r"""Means of tabulated functions of redshift over the PDF of each galaxy
+
+        Parameters
+        ----------
+        values : array_like
+            Function(s) tabulated on `zbins`, of shape (nz,) or (nz, nfunc)
+
+        Returns
+        -------
+        means : array_like
+            Mean of the function(s) over each PDF, of shape (ngals,) or (ngals, nfunc)
+        """
+        values = np.asarray(values, dtype=float)
+        if values.shape[0] != len(self.zbins):
+            raise ValueError("values must be tabulated on zbins")
+        weights = self._weights if values.ndim == 1 else self._weights[:, None]
+        return (self.pdfs@(weights*values).astype(self.pdfs.dtype)).astype(float)
+
+    def __len__(self):
+        """Number of galaxies"""
+        return len(self.pdfs)
+
+    def __repr__(self):
+        """Generates string for print(PhotoZPDFs)"""
+        return f'PhotoZPDFs of {len(self)} galaxies on {len(self.zbins)} redshifts ' +\
+               f'from {self.zbins[0]:.3f} to {self.zbins[-1]:.3f}'
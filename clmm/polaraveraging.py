@@ -7,8 +7,9 @@ import math
 import warnings
 import numpy as np
 from astropy.table import Table
-from .utils import compute_radial_averages, make_bins, convert_units
+from .utils import _compute_binned_statistics, make_bins, convert_units
 from .galaxycluster import GalaxyCluster
+from .sourceindex import SourceIndex
 
 # def _astropy_to_CCL_cosmo_object(astropy_cosmology_object): # 7481794
 #     """Generates a ccl cosmology object from an GCR or astropy cosmology object.
@@ -25,7 +26,7 @@ from .galaxycluster import GalaxyCluster
 
 def compute_shear(cluster=None, ra_lens=None, dec_lens=None, ra_source_list=None,
                   dec_source_list=None, shear1=None, shear2=None, geometry='flat',
-                  add_to_cluster=True):
+                  add_to_cluster=True, validate=True):
     r"""Computes tangential shear, cross shear, and angular separation
 
     To compute the shear, we need the right ascension and declination of the lens and of
@@ -58,6 +59,10 @@ def compute_shear(cluster=None, ra_lens=None, dec_lens=None, ra_source_list=None
         \left(\alpha_l-\alpha_s\right)^2\cos^2(\delta_l)\\
         \tan\phi = & \frac{\delta_s - \delta_l}{\left(\alpha_l - \alpha_s\right)\cos(\delta_l)}
 
+    On the curved sky, :math:`\theta` is the great-circle separation and :math:`\phi` is
+    measured in the plane tangent to the sphere at the lens position, see
+    `_compute_lensing_offsets_curvedsky`.
+
     The tangential, :math:`g_t`, and cross, :math:`g_x`, shears are calculated using the two
     shear components :math:`g_1` and :math:`g_2` of the source galaxies, following Eq.7 and Eq.8
     in Schrabback et al. (2018), arXiv:1611:03866
@@ -88,10 +93,14 @@ def compute_shear(cluster=None, ra_lens=None, dec_lens=None, ra_source_list=None
     shear2: array_like, optional
         The measured shear of the source galaxies
     geometry: str, optional
-        Sky geometry to compute angular separation.
-        Flat is currently the only supported option.
+        Sky geometry to compute angular separation. Options are `flat` (default), the flat
+        sky approximation, and `curve`, exact great-circle separations and position angles
+        on the sphere.
     add_to_cluster: bool
         If `True` and a cluster was input, add the computed shears to the `GalaxyCluster` object
+    validate: bool, optional
+        If `True` (default), check that the lens and source coordinates are within their
+        domains. Set to `False` to skip these checks on trusted input.
 
     Returns
     -------
@@ -127,14 +136,17 @@ def compute_shear(cluster=None, ra_lens=None, dec_lens=None, ra_source_list=None
 
     # Compute the lensing angles
     if geometry == 'flat':
-        angsep, phi = _compute_lensing_angles_flatsky(ra_lens, dec_lens, ra_source_list,
-                                                      dec_source_list)
+        angsep, deltax, deltay = _compute_lensing_offsets_flatsky(
+            ra_lens, dec_lens, ra_source_list, dec_source_list, validate=validate)
+    elif geometry == 'curve':
+        angsep, deltax, deltay = _compute_lensing_offsets_curvedsky(
+            ra_lens, dec_lens, ra_source_list, dec_source_list, validate=validate)
     else:
         raise NotImplementedError(f"Sky geometry {geometry} is not currently supported")
 
     # Compute the tangential and cross shears
-    tangential_shear = _compute_tangential_shear(shear1, shear2, phi)
-    cross_shear = _compute_cross_shear(shear1, shear2, phi)
+    tangential_shear, cross_shear = _compute_tangential_and_cross_shear(shear1, shear2,
+                                                                        deltax, deltay)
 
     if add_to_cluster:
         cluster.galcat['theta'] = angsep
@@ -144,7 +156,108 @@ def compute_shear(cluster=None, ra_lens=None, dec_lens=None, ra_source_list=None
     return angsep, tangential_shear, cross_shear
 
 
-def _compute_lensing_angles_flatsky(ra_lens, dec_lens, ra_source_list, dec_source_list):
+def compute_shear_batch(ra_lens, dec_lens, max_angsep, galcat=None, ra_source_list=None,
+                        dec_source_list=None, shear1=None, shear2=None, geometry='flat',
+                        validate=True, source_index=None):
+    r"""Computes tangential shear, cross shear, and angular separation of all the lens-source
+    pairs closer than a maximum separation, for many lenses sharing one source catalog
+
+    The sources around each lens are found with a `SourceIndex` of the source positions, and
+    the shears of all the pairs are then computed in a single vectorized call, as in
+    `compute_shear`. The source catalog can be given as a table::
+
+        compute_shear_batch(ra_lens, dec_lens, max_angsep, galcat)
+
+    or as arrays::
+
+        compute_shear_batch(ra_lens, dec_lens, max_angsep, ra_source_list=ra,
+                            dec_source_list=dec, shear1=e1, shear2=e2)
+
+    Parameters
+    ----------
+    ra_lens: array_like
+        Right ascensions of the lensing clusters in degrees
+    dec_lens: array_like
+        Declinations of the lensing clusters in degrees
+    max_angsep: float
+        Maximum angular separation of the lens-source pairs in radians
+    galcat: astropy.table.Table, optional
+        Source catalog with `ra`, `dec`, `e1` and `e2` columns. If specified, the source
+        position and shear inputs are ignored.
+    ra_source_list: array_like, optional
+        Right ascensions of each source galaxy
+    dec_source_list: array_like, optional
+        Declinations of each source galaxy
+    shear1: array_like, optional
+        The measured shear of the source galaxies
+    shear2: array_like, optional
+        The measured shear of the source galaxies
+    geometry: str, optional
+        Sky geometry to compute angular separation, `flat` (default) or `curve`.
+        See `compute_shear`.
+    validate: bool, optional
+        If `True` (default), check that the lens and source coordinates are within their
+        domains.
+    source_index: SourceIndex, optional
+        Spatial index of the source catalog, to reuse across calls. Built from the source
+        positions if not provided.
+
+    Returns
+    -------
+    pairs: astropy.table.Table
+        Table with one row per lens-source pair, ordered by lens, with columns `lens_index`
+        and `source_index`, the indices of the lens and the source in the inputs, `theta`,
+        their angular separation in radians, and `gt` and `gx`, the tangential and cross
+        shears of the source relative to the lens.
+    """
+    if galcat is not None:
+        required_cols = ['ra', 'dec', 'e1', 'e2']
+        if not all([t_ in galcat.columns for t_ in required_cols]):
+            raise TypeError('Galaxy catalog missing required columns.')
+        ra_source_list, dec_source_list = galcat['ra'], galcat['dec']
+        shear1, shear2 = galcat['e1'], galcat['e2']
+    elif any(t_ is None for t_ in (ra_source_list, dec_source_list, shear1, shear2)):
+        raise TypeError('To compute shear, please provide a galaxy catalog or ra and dec ' +\
+                        'and both shears or ellipticities of the sources.')
+    if not all(len(t_) == len(ra_source_list) for t_ in [dec_source_list, shear1, shear2]):
+        raise TypeError('To compute the shear you should supply the same number of source' +\
+                        'positions and shear.')
+    if geometry not in ('flat', 'curve'):
+        raise NotImplementedError(f"Sky geometry {geometry} is not currently supported")
+
+    ra_lens, dec_lens = np.atleast_1d(ra_lens), np.atleast_1d(dec_lens)
+    ra_source_list, dec_source_list = np.asarray(ra_source_list), np.asarray(dec_source_list)
+    if validate:
+        _validate_coordinates(ra_lens, dec_lens, 'lens list')
+        _validate_coordinates(ra_source_list, dec_source_list, 'source catalog')
+
+    # Find the sources around each lens
+    if source_index is None:
+        source_index = SourceIndex(ra_source_list, dec_source_list)
+    elif len(source_index) != len(ra_source_list):
+        raise TypeError('source_index was not built from this source catalog.')
+    lens_index, source_index = source_index.query_apertures(ra_lens, dec_lens, max_angsep)
+
+    # Compute the shears of all the pairs at once
+    if geometry == 'flat':
+        angsep, deltax, deltay = _compute_lensing_offsets_flatsky(
+            ra_lens[lens_index], dec_lens[lens_index], ra_source_list[source_index],
+            dec_source_list[source_index], validate=False)
+    else:
+        angsep, deltax, deltay = _compute_lensing_offsets_curvedsky(
+            ra_lens[lens_index], dec_lens[lens_index], ra_source_list[source_index],
+            dec_source_list[source_index], validate=False)
+    tangential_shear, cross_shear = _compute_tangential_and_cross_shear(
+        np.asarray(shear1)[source_index], np.asarray(shear2)[source_index], deltax, deltay)
+
+    # Separations of approximate geometries can differ slightly from the chord selection
+    keep = angsep <= max_angsep
+    return Table([lens_index[keep], source_index[keep], angsep[keep], tangential_shear[keep],
+                  cross_shear[keep]], names=('lens_index', 'source_index', 'theta', 'gt', 'gx'))
+
+
+def _compute_lensing_angles_flatsky(ra_lens, dec_lens, ra_source_list, dec_source_list,
+                                    validate=True):
     r"""Compute the angular separation between the lens and the source and the azimuthal
     angle from the lens to the source in radians.
 
@@ -157,29 +270,144 @@ def _compute_lensing_angles_flatsky(ra_lens, dec_lens, ra_source_list, dec_sourc
 
     For extended descriptions of parameters, see `compute_shear()` documentation.
     """
-    if not -360. <= ra_lens <= 360.:
-        raise ValueError(f"ra = {ra_lens} of lens if out of domain")
-    if not -90. <= dec_lens <= 90.:
-        raise ValueError(f"dec = {dec_lens} of lens if out of domain")
-    if not all(-360. <= x_ <= 360. for x_ in ra_source_list):
-        raise ValueError("Cluster has an invalid ra in source catalog")
-    if not all(-90. <= x_ <= 90 for x_ in dec_source_list):
-        raise ValueError("Cluster has an invalid dec in the source catalog")
-
-    deltax = np.radians(ra_source_list - ra_lens) * math.cos(math.radians(dec_lens))
+    angsep, deltax, deltay = _compute_lensing_offsets_flatsky(ra_lens, dec_lens, ra_source_list,
+                                                              dec_source_list, validate=validate)
+    phi = np.arctan2(deltay, -deltax)
+    return angsep, phi
+
+
+def _compute_lensing_offsets_flatsky(ra_lens, dec_lens, ra_source_list, dec_source_list,
+                                     validate=True):
+    r"""Compute the angular separation between the lens and the source and the offsets of
+    the source from the lens in the flat sky approximation, all in radians.
+
+    .. math::
+        \Delta x = \left(\alpha_s-\alpha_l\right)\cos(\delta_l)
+
+        \Delta y = \delta_s - \delta_l
+
+    The azimuthal angle of the source is :math:`\phi = {\rm arctan2}(\Delta y, -\Delta x)`.
+
+    For extended descriptions of parameters, see `compute_shear()` documentation.
+
+    Returns
+    -------
+    angsep: array_like
+        Angular separation between lens and each source galaxy in radians
+    deltax, deltay: array_like
+        Offsets of each source galaxy from the lens in radians
+    """
+    if validate:
+        _validate_coordinates(ra_lens, dec_lens, 'lens')
+        _validate_coordinates(ra_source_list, dec_source_list, 'source catalog')
+    ra_source_list, dec_source_list = np.asarray(ra_source_list), np.asarray(dec_source_list)
+
+    # Python floats for a single lens so that single precision sources are not upcast
+    if np.ndim(dec_lens) == 0:
+        cos_dec_lens = math.cos(math.radians(dec_lens))
+    else:
+        cos_dec_lens = np.cos(np.radians(dec_lens))
+    deltax = np.radians(ra_source_list - ra_lens) * cos_dec_lens
     deltay = np.radians(dec_source_list - dec_lens)
 
     # Ensure that abs(delta ra) < pi
     deltax[deltax >= np.pi] = deltax[deltax >= np.pi] - 2.*np.pi
     deltax[deltax < -np.pi] = deltax[deltax < -np.pi] + 2.*np.pi
 
-    angsep = np.sqrt(deltax**2 + deltay**2)
-    phi = np.arctan2(deltay, -deltax)
+    angsep = np.hypot(deltax, deltay)
 
     if np.any(angsep > np.pi/180.):
         warnings.warn("Using the flat-sky approximation with separations >1 deg may be inaccurate")
 
-    return angsep, phi
+    return angsep, deltax, deltay
+
+
+def _compute_lensing_offsets_curvedsky(ra_lens, dec_lens, ra_source_list, dec_source_list,
+                                       validate=True):
+    r"""Compute the great-circle separation between the lens and the source and the direction
+    of the source in the plane tangent to the sphere at the lens position.
+
+    With :math:`\Delta\alpha = \alpha_s - \alpha_l`, the source direction is given by
+
+    .. math::
+        \Delta x = \cos\delta_s\sin\Delta\alpha
+
+        \Delta y = \cos\delta_l\sin\delta_s - \sin\delta_l\cos\delta_s\cos\Delta\alpha
+
+    which reduce to the flat sky offsets for small separations, so that the position angle is
+    again :math:`\phi = {\rm arctan2}(\Delta y, -\Delta x)`. The separation is computed with the
+    Vincenty formula, accurate at all separations, which reuses the same terms
+
+    .. math::
+        \theta = {\rm arctan2}\left(\sqrt{\Delta x^2 + \Delta y^2},
+        \sin\delta_l\sin\delta_s + \cos\delta_l\cos\delta_s\cos\Delta\alpha\right)
+
+    All inputs are broadcast against each other, so several lenses can be processed at once,
+    e.g. by passing lens coordinates of shape (n_lens, 1) with source coordinates of shape
+    (n_source,), or lens and source coordinates of matching lens-source pairs.
+
+    For extended descriptions of parameters, see `compute_shear()` documentation.
+
+    Returns
+    -------
+    angsep: array_like
+        Angular separation between lens and each source galaxy in radians
+    deltax, deltay: array_like
+        Direction of each source galaxy from the lens, with norm :math:`\sin\theta`
+    """
+    if validate:
+        _validate_coordinates(ra_lens, dec_lens, 'lens')
+        _validate_coordinates(ra_source_list, dec_source_list, 'source catalog')
+    ra_source_list, dec_source_list = np.asarray(ra_source_list), np.asarray(dec_source_list)
+    ra_lens, dec_lens = np.asarray(ra_lens), np.radians(dec_lens)
+
+    sin_dec_lens, cos_dec_lens = np.sin(dec_lens), np.cos(dec_lens)
+    dec_source_list = np.radians(dec_source_list)
+    sin_dec_source, cos_dec_source = np.sin(dec_source_list), np.cos(dec_source_list)
+    delta_ra = np.radians(ra_source_list - ra_lens)
+    cos_delta_ra = np.cos(delta_ra)
+
+    deltax = cos_dec_source * np.sin(delta_ra)
+    cos_dec_source = cos_dec_source * cos_delta_ra
+    deltay = cos_dec_lens*sin_dec_source - sin_dec_lens*cos_dec_source
+    angsep = np.arctan2(np.hypot(deltax, deltay),
+                        sin_dec_lens*sin_dec_source + cos_dec_lens*cos_dec_source)
+
+    return angsep, deltax, deltay
+
+
+def _validate_coordinates(ra_list, dec_list, label):
+    r"""Check that right ascensions are within [-360, 360] deg and declinations within
+    [-90, 90] deg using array operations.
+
+    Parameters
+    ----------
+    ra_list: array_like
+        Right ascensions in degrees
+    dec_list: array_like
+        Declinations in degrees
+    label: str
+        Name of the objects checked, used in the error message
+
+    Raises
+    ------
+    ValueError
+        If any coordinate is out of its domain or is not a number. The message reports the
+        number of offending rows and their first indices.
+    """
+    for name, values, bound in (('ra', ra_list, 360.), ('dec', dec_list, 90.)):
+        values = np.asarray(values)
+        # Written as a negation so that NaNs are flagged too
+        invalid = ~((values >= -bound) & (values <= bound))
+        if not invalid.any():
+            continue
+        if values.ndim == 0:
+            raise ValueError(f"{name} = {values} of {label} is out of domain "
+                             f"[{-bound}, {bound}]")
+        badids = np.flatnonzero(invalid)
+        raise ValueError(f"{len(badids)} invalid {name} value(s) out of domain "
+                         f"[{-bound}, {bound}] in {label}, at indices "
+                         f"{badids[:10].tolist()}{'...' if len(badids) > 10 else ''}")
 
 
 def _compute_tangential_shear(shear1, shear2, phi):
@@ -209,8 +437,84 @@ def _compute_cross_shear(shear1, shear2, phi):
     return shear1 * np.sin(2.*phi) - shear2 * np.cos(2.*phi)
 
 
+def _compute_tangential_and_cross_shear(shear1, shear2, deltax, deltay,
+                                        tangential_shear=None, cross_shear=None):
+    r"""Compute the tangential and cross shears from the offsets of the sources to the lens.
+
+    Instead of evaluating the azimuthal angle :math:`\phi = {\rm arctan2}(\Delta y, -\Delta x)`
+    and then its trigonometric functions, we directly use
+
+    .. math::
+        \cos(2\phi) = \frac{\Delta x^2 - \Delta y^2}{\Delta x^2 + \Delta y^2}, \quad
+        \sin(2\phi) = \frac{-2\Delta x\Delta y}{\Delta x^2 + \Delta y^2}
+
+    in the expressions of `_compute_tangential_shear` and `_compute_cross_shear`. The offsets
+    only need to be proportional to the position of the source in the plane tangent to the
+    lens, so this works with any sky geometry. A source at the lens position is given
+    :math:`\phi=\pi`, as `arctan2` would.
+
+    Parameters
+    ----------
+    shear1, shear2: array_like
+        The two shear components of the source galaxies
+    deltax, deltay: array_like
+        Offsets of the source galaxies from the lens
+    tangential_shear, cross_shear: array_like, optional
+        Preallocated arrays to write the results into
+
+    Returns
+    -------
+    tangential_shear: array_like
+        Tangential shear for each source galaxy
+    cross_shear: array_like
+        Cross shear for each source galaxy
+
+    Notes
+    -----
+    The computation is done in the precision of the inputs, so single precision inputs
+    are not upcast.
+    """
+    shear1, shear2 = np.asarray(shear1), np.asarray(shear2)
+    deltax, deltay = np.asarray(deltax), np.asarray(deltay)
+    dtype = np.result_type(shear1, shear2, deltax, deltay, np.float32)
+    shape = np.broadcast(shear1, shear2, deltax, deltay).shape
+    if tangential_shear is None:
+        tangential_shear = np.empty(shape, dtype=dtype)
+    if cross_shear is None:
+        cross_shear = np.empty(shape, dtype=dtype)
+
+    cos2phi = np.empty(shape, dtype=dtype)
+    sin2phi = np.empty(shape, dtype=dtype)
+    rsq = np.empty(shape, dtype=dtype)
+    np.multiply(deltax, deltax, out=cos2phi)
+    np.multiply(deltay, deltay, out=sin2phi)
+    np.add(cos2phi, sin2phi, out=rsq)
+    cos2phi -= sin2phi
+    np.multiply(deltax, deltay, out=sin2phi)
+    sin2phi *= -2.
+
+    atlens = rsq == 0.
+    if atlens.any():
+        rsq[atlens] = 1.
+        cos2phi[atlens] = 1.
+    cos2phi /= rsq
+    sin2phi /= rsq
+
+    # rsq is used as a work buffer from here on
+    np.multiply(shear1, cos2phi, out=tangential_shear)
+    np.multiply(shear2, sin2phi, out=rsq)
+    tangential_shear += rsq
+    np.negative(tangential_shear, out=tangential_shear)
+
+    np.multiply(shear1, sin2phi, out=cross_shear)
+    np.multiply(shear2, cos2phi, out=rsq)
+    cross_shear -= rsq
+
+    return tangential_shear, cross_shear
+
+
 def make_shear_profile(cluster, angsep_units, bin_units, bins=10, cosmo=None,
-                       add_to_cluster=True, include_empty_bins=False):
+                       add_to_cluster=True, include_empty_bins=False, weights=None):
     r"""Compute the shear profile of the cluster
 
     We assume that the cluster object contains information on the cross and
@@ -248,13 +552,19 @@ def make_shear_profile(cluster, angsep_units, bin_units, bins=10, cosmo=None,
         Attach the profile to the cluster object as `cluster.profile`
     include_empty_bins: bool, optional
         Also include empty bins in the returned table
+    weights: str or array_like, optional
+        Weights of the source galaxies, either the name of a column of the `galcat` or an
+        array, e.g. inverse variance weights from `compute_inverse_variance_weights`. If
+        provided, the profile is made of weighted means and their weighted errors, see
+        `compute_radial_averages`.
 
     Returns
     -------
     profile : astropy.table.Table
         Output table containing the radius grid points, the tangential and cross shear profiles
         on that grid, and the errors in the two shear profiles. The errors are defined as the
-        standard errors in each bin.
+        standard errors in each bin. With weights, the table also contains the effective
+        number of sources, `n_eff`, and the sum of the weights, `weights_sum`, of each bin.
     """
     if not all([t_ in cluster.galcat.columns for t_ in ('gt', 'gx', 'theta')]):
         raise TypeError('Shear information is missing in galaxy catalog must have tangential' +\
@@ -274,17 +584,21 @@ def make_shear_profile(cluster, angsep_units, bin_units, bins=10, cosmo=None,
         bins = make_bins(np.min(source_seps), np.max(source_seps), bins)
 
     # Compute the binned average shears and associated errors
-    r_avg, gt_avg, gt_err, nsrc = compute_radial_averages(
-        source_seps, cluster.galcat['gt'].data, xbins=bins, error_model='std/sqrt_n')
-    r_avg, gx_avg, gx_err, _ = compute_radial_averages(
-        source_seps, cluster.galcat['gx'].data, xbins=bins, error_model='std/sqrt_n')
-    r_avg, z_avg, z_err, _ = compute_radial_averages(
-        source_seps, cluster.galcat['z'].data, xbins=bins, error_model='std/sqrt_n')
+    if isinstance(weights, str):
+        weights = cluster.galcat[weights].data
+    r_avg, (gt_avg, gx_avg, z_avg), (gt_err, gx_err, z_err), nsrc, n_eff, sum_w = \
+        _compute_binned_statistics(source_seps, [cluster.galcat['gt'].data,
+                                                 cluster.galcat['gx'].data,
+                                                 cluster.galcat['z'].data],
+                                   xbins=bins, error_model='std/sqrt_n', weights=weights)
 
     profile_table = Table([bins[:-1], r_avg, bins[1:], gt_avg, gt_err, gx_avg, gx_err,
                            z_avg, z_err, nsrc],
                           names=('radius_min', 'radius', 'radius_max', 'gt', 'gt_err',
                                  'gx', 'gx_err', 'z', 'z_err', 'n_src'))
+    if weights is not None:
+        profile_table['n_eff'] = n_eff
+        profile_table['weights_sum'] = sum_w
     # return empty bins?
     if not include_empty_bins:
         profile_table = profile_table[profile_table['n_src'] > 1]
@@ -0,0 +1,149 @@
+"""@file sourceindex.py
+The SourceIndex class, a spatial index over the positions of a source catalog
+"""
+import math
+import numpy as np
+from scipy.spatial import cKDTree
+
+
+def _radec_to_unit_vectors(ra_list, dec_list):
+    r"""Convert right ascensions and declinations in degrees to unit vectors on the sphere
+
+    Parameters
+    ----------
+    ra_list: array_like
+        Right ascensions in degrees
+    dec_list: array_like
+        Declinations in degrees
+
+    Returns
+    -------
+    xyz: array_like
+        Array of shape (len(ra_list), 3) with the cartesian coordinates of the unit vectors
+    """
+    ra_list, dec_list = np.radians(ra_list), np.radians(dec_list)
+    cos_dec = np.cos(dec_list)
+    return np.column_stack((cos_dec*np.cos(ra_list), cos_dec*np.sin(ra_list), np.sin(dec_list)))
+
+
+def _angsep_to_chord(angsep):
+    r"""Convert an angular separation in radians to the chord length between two unit vectors,
+    :math:`2\sin(\theta/2)`"""
+    return 2.*math.sin(min(angsep, np.pi)/2.)
+
+
+class SourceIndex():
+    """Spatial index over the positions of a source catalog
+
+    The index is a KD-tree over the unit vectors of the source positions, so it is exact at
+    all separations and anywhere on the sphere. It is built once and then answers aperture
+    and annulus queries around any point in :math:`O(\\log N + k)` instead of scanning the
+    N sources of the catalog.
+
+    Attributes
+    ----------
+    ra : array_like
+        Right ascension of the sources (in degrees)
+    dec : array_like
+        Declination of the sources (in degrees)
+    """
+    def __init__(self, ra, dec):
+        ra, dec = np.asarray(ra, dtype=float), np.asarray(dec, dtype=float)
+        if ra.shape != dec.shape or ra.ndim != 1:
+            raise TypeError('ra and dec must be 1D arrays of the same length.')
+        self.ra = ra
+        self.dec = dec
+        self._xyz = _radec_to_unit_vectors(ra, dec)
+        self._tree = cKDTree(self._xyz)
+
+    @classmethod
+    def from_table(cls, galcat):
+        """Builds the index of a source catalog with `ra` and `dec` columns, e.g. the
+        `galcat` of a `GalaxyCluster`"""
+        if not all(t_ in galcat.columns for t_ in ('ra', 'dec')):
+            raise TypeError('Galaxy catalog missing ra and dec columns.')
+        return cls(galcat['ra'], galcat['dec'])
+
+    def __len__(self):
+        return len(self.ra)
+
+    def query_aperture(self, ra, dec, radius):
+        """Finds the sources within an angular distance of a point
+
+        Parameters
+        ----------
+        ra : float
+            Right ascension of the center of the aperture in degrees
+        dec : float
+            Declination of the center of the aperture in degrees
+        radius : float
+            Radius of the aperture in radians
+
+        Returns
+        -------
+        source_index : array_like
+            Sorted indices of the sources in the aperture
+        """
+        center = _radec_to_unit_vectors(ra, dec)[0]
+        return np.sort(np.array(self._tree.query_ball_point(center, _angsep_to_chord(radius)),
+                                dtype=int))
+
+    def query_annulus(self, ra, dec, radius_min, radius_max):
+        """Finds the sources at an angular distance between `radius_min` and `radius_max`
+        (both included) of a point
+
+        Parameters
+        ----------
+        ra : float
+            Right ascension of the center of the annulus in degrees
+        dec : float
+            Declination of the center of the annulus in degrees
+        radius_min : float
+            Inner radius of the annulus in radians
+        radius_max : float
+            Outer radius of the annulus in radians
+
+        Returns
+        -------
+        source_index : array_like
+            Sorted indices of the sources in the annulus
+        """
+        if radius_min > radius_max:
+            raise ValueError(f"Invalid annulus, radius_min={radius_min} > "
+                             f"radius_max={radius_max}")
+        source_index = self.query_aperture(ra, dec, radius_max)
+        center = _radec_to_unit_vectors(ra, dec)[0]
+        chord = np.linalg.norm(self._xyz[source_index] - center, axis=1)
+        return source_index[chord >= _angsep_to_chord(radius_min)]
+
+    def query_apertures(self, ra_list, dec_list, radius):
+        """Finds the sources within an angular distance of each of several points
+
+        Parameters
+        ----------
+        ra_list : array_like
+            Right ascensions of the centers of the apertures in degrees
+        dec_list : array_like
+            Declinations of the centers of the apertures in degrees
+        radius : float
+            Radius of the apertures in radians
+
+        Returns
+        -------
+        center_index : array_like
+            Index of the aperture of each center-source pair, in increasing order
+        source_index : array_like
+            Index of the source of each center-source pair
+        """
+        neighbors = self._tree.query_ball_point(
+            _radec_to_unit_vectors(np.atleast_1d(ra_list), np.atleast_1d(dec_list)),
+            _angsep_to_chord(radius))
+        nsources = np.fromiter((len(t_) for t_ in neighbors), dtype=int, count=len(neighbors))
+        center_index = np.repeat(np.arange(len(neighbors)), nsources)
+        source_index = np.fromiter((i_ for t_ in neighbors for i_ in t_), dtype=int,
+                                   count=nsources.sum())
+        return center_index, source_index
+
+    def __repr__(self):
+        """Generates string for print(SourceIndex)"""
+        return f'SourceIndex over {len(self)} sources'
@@ -0,0 +1,170 @@
+"""@file stacking.py
+The StackedProfile class, to stack the shear profiles of many clusters
+"""
+import numpy as np
+from astropy.table import Table
+from .utils import convert_units, _digitize_bins
+
+
+class StackedProfile():
+    """Accumulates the tangential and cross shears of the sources of many clusters in fixed
+    radial bins, to build their stacked shear profile
+
+    Only the sufficient statistics of each bin are kept: the number of sources, the sum of
+    the weights and of their squares, and the weighted sums of the radii, of the shears and of
+    their squares. The memory used is therefore proportional to the number of bins, whatever
+    the number of clusters and sources fed in, and accumulators filled separately (e.g. by
+    different processes) can be merged.
+
+    Attributes
+    ----------
+    bins : array_like
+        Radial bin edges
+    bin_units : str
+        Units of the radial bins, e.g. "Mpc"
+    nclusters : int
+        Number of clusters added
+    """
+    _sums = ('n_src', 'sum_w', 'sum_w2', 'sum_wr', 'sum_wgt', 'sum_wgt2', 'sum_wgx', 'sum_wgx2')
+
+    def __init__(self, bins, bin_units='Mpc'):
+        bins = np.asarray(bins, dtype=float)
+        if bins.ndim != 1 or len(bins) < 2 or np.any(np.diff(bins) <= 0.):
+            raise ValueError("bins must be an increasing sequence of at least two bin edges")
+        self.bins = bins
+        self.bin_units = bin_units
+        self.nclusters = 0
+        for name in self._sums:
+            setattr(self, name, np.zeros(len(bins)-1, dtype=int if name == 'n_src' else float))
+
+    def add(self, radius, gt, gx, weights=None):
+        """Adds the sources of one cluster to the stack
+
+        Parameters
+        ----------
+        radius : array_like
+            Distance of each source to the cluster center, in `bin_units`
+        gt : array_like
+            Tangential shear of each source
+        gx : array_like
+            Cross shear of each source
+        weights : array_like, optional
+            Weight of each source. Sources are equally weighted if not provided.
+        """
+        radius, gt, gx = np.asarray(radius, float), np.asarray(gt, float), np.asarray(gx, float)
+        weights = np.ones(len(radius)) if weights is None else np.asarray(weights, float)
+        if not all(len(t_) == len(radius) for t_ in (gt, gx, weights)):
+            raise TypeError('radius, gt, gx and weights must have the same length.')
+
+        binnumber, inrange = _digitize_bins(radius, self.bins)
+        binnumber = binnumber[inrange]
+        radius, gt, gx, weights = radius[inrange], gt[inrange], gx[inrange], weights[inrange]
+        nbins = len(self.bins) - 1
+
+        self.n_src += np.bincount(binnumber, minlength=nbins)
+        for name, values in (('sum_w', weights), ('sum_w2', weights*weights),
+                             ('sum_wr', weights*radius), ('sum_wgt', weights*gt),
+                             ('sum_wgt2', weights*gt*gt), ('sum_wgx', weights*gx),
+                             ('sum_wgx2', weights*gx*gx)):
+            getattr(self, name)[:] += np.bincount(binnumber, weights=values, minlength=nbins)
+        self.nclusters += 1
+
+    def add_cluster(self, cluster, angsep_units='radians', cosmo=None, weights=None):
+        """Adds the sources of a `GalaxyCluster` to the stack
+
+        The cluster must have been processed with `compute_shear`, the angular separations are
+        converted to `bin_units` at the cluster redshift.
+
+        Parameters
+        ----------
+        cluster : GalaxyCluster
+            Instance of GalaxyCluster with `theta`, `gt` and `gx` columns in its `galcat`
+        angsep_units : str, optional
+            Units of the separations of the sources, defaults to "radians"
+        cosmo : astropy.cosmology, optional
+            Cosmology used to convert angular separations to physical distances
+        weights : str or array_like, optional
+            Name of a `galcat` column with the weights of the sources, or the weights
+        """
+        if not all([t_ in cluster.galcat.columns for t_ in ('gt', 'gx', 'theta')]):
+            raise TypeError('Shear information is missing in galaxy catalog must have tangential' +\
+                            'and cross shears (gt,gx). Run compute_shear first!')
+        radius = cluster.galcat['theta']
+        if angsep_units != self.bin_units:
+            radius = convert_units(radius, angsep_units, self.bin_units, redshift=cluster.z,
+                                   cosmo=cosmo)
+        if isinstance(weights, str):
+            weights = cluster.galcat[weights]
+        self.add(radius, cluster.galcat['gt'], cluster.galcat['gx'], weights=weights)
+
+    def merge(self, other):
+        """Adds the content of another StackedProfile, with the same bins, to this one
+
+        Parameters
+        ----------
+        other : StackedProfile
+            Stack to merge into this one
+
+        Returns
+        -------
+        self : StackedProfile
+            This stack, updated
+        """
+        if not isinstance(other, StackedProfile):
+            raise TypeError(f'Cannot merge a StackedProfile with {type(other)}')
+        if self.bin_units != other.bin_units or not np.array_equal(self.bins, other.bins):
+            raise ValueError('Cannot merge stacked profiles with different bins')
+        for name in self._sums:
+            getattr(self, name)[:] += getattr(other, name)
+        self.nclusters += other.nclusters
+        return self
+
+    def __iadd__(self, other):
+        return self.merge(other)
+
+    def __add__(self, other):
+        total = StackedProfile(self.bins, self.bin_units)
+        return total.merge(self).merge(other)
+
+    def make_profile(self, include_empty_bins=False):
+        r"""Computes the stacked shear profile
+
+        In each bin, the shears are the weighted means of the shears of the sources and their
+        errors are the weighted standard deviations divided by the square root of the
+        effective number of sources, :math:`n_{\rm eff} = (\sum w)^2/\sum w^2`. Without
+        weights, these are the same quantities as in `make_shear_profile`.
+
+        Parameters
+        ----------
+        include_empty_bins: bool, optional
+            Also include empty bins in the returned table
+
+        Returns
+        -------
+        profile : astropy.table.Table
+            Output table containing the radius grid points, the tangential and cross shear
+            profiles on that grid, their errors, and the number of sources, the effective
+            number of sources and the sum of the weights in each bin.
+        """
+        with np.errstate(divide='ignore', invalid='ignore'):
+            radius = self.sum_wr/self.sum_w
+            n_eff = self.sum_w**2/self.sum_w2
+            stats = []
+            for sum_wg, sum_wg2 in ((self.sum_wgt, self.sum_wgt2), (self.sum_wgx, self.sum_wgx2)):
+                mean = sum_wg/self.sum_w
+                std = np.sqrt(np.clip(sum_wg2/self.sum_w - mean**2, 0., None))
+                stats += [mean, std/np.sqrt(n_eff)]
+
+        profile_table = Table([self.bins[:-1], radius, self.bins[1:], *stats, self.n_src, n_eff,
+                               self.sum_w],
+                              names=('radius_min', 'radius', 'radius_max', 'gt', 'gt_err',
+                                     'gx', 'gx_err', 'n_src', 'n_eff', 'weights_sum'))
+        # return empty bins?
+        if not include_empty_bins:
+            profile_table = profile_table[profile_table['n_src'] > 1]
+        return profile_table
+
+    def __repr__(self):
+        """Generates string for print(StackedProfile)"""
+        return f'StackedProfile of {self.nclusters} clusters in {len(self.bins)-1} bins ' +\
+               f'of {self.bin_units}\n> {self.n_src.sum()} source galaxies'
@@ -1,50 +1,174 @@
 """General utility functions that are used in multiple modules"""
 import numpy as np
-from scipy.stats import binned_statistic
 from astropy import units as u
 
 
-def compute_radial_averages(xvals, yvals, xbins, error_model='std/sqrt_n'):
-    """ Given a list of xvalss, yvals and bins, sort into bins
+def compute_radial_averages(xvals, yvals, xbins, error_model='std/sqrt_n', weights=None):
+    r""" Given a list of xvalss, yvals and bins, sort into bins
+
+    The x values are assigned to bins only once and the count, sum and sum of squared
+    deviations of every y column are then accumulated with `np.bincount`, so several
+    quantities can be binned together at little extra cost. Bins follow the
+    `scipy.stats.binned_statistic` convention: they are half open, :math:`[x_i, x_{i+1})`,
+    except for the last one which also includes its right edge.
+
+    If weights are given, the means are weighted means, the standard deviation is the weighted
+    standard deviation :math:`\sqrt{\sum w (y-\bar{y})^2/\sum w}` and the error model
+    'std/sqrt_n' uses the effective number of objects :math:`n_{\rm eff}=(\sum w)^2/\sum w^2`.
+    These reduce to the unweighted statistics for equal weights.
 
     Parameters
     ----------
     xvals : array_like
         Values to be binned
     yvals : array_like
-        Values to compute statistics on
+        Values to compute statistics on. Either a single array with the same length as
+        `xvals` or a 2D array of shape (n_columns, len(xvals)) to compute the statistics of
+        several quantities at once.
     xbins: array_like
         Bin edges to sort into
     error_model : str, optional
         Error model to use for y uncertainties.
         std/sqrt_n - Standard Deviation/sqrt(Counts) (Default)
         std - Standard deviation
+    weights : array_like, optional
+        Weight of each value. Values are equally weighted if not provided.
 
     Returns
     -------
     meanx : array_like
         Mean x value in each bin
     meany : array_like
-        Mean y value in each bin
+        Mean y value in each bin. Has shape (n_columns, n_bins) if `yvals` is 2D.
     yerr : array_like
         Error on the mean y value in each bin. Specified by error_model
     n : array_like
         Number of objects in each bin
     """
-    meanx, xbins = binned_statistic(xvals, xvals, statistic='mean', bins=xbins)[:2]
-    meany = binned_statistic(xvals, yvals, statistic='mean', bins=xbins)[0]
-    # number of objects
-    n = np.histogram(xvals, xbins)[0]
+    meanx, meany, yerr, n, _, _ = _compute_binned_statistics(xvals, yvals, xbins,
+                                                             error_model=error_model,
+                                                             weights=weights)
+    return meanx, meany, yerr, n
 
-    if error_model == 'std':
-        yerr = binned_statistic(xvals, yvals, statistic='std', bins=xbins)[0]
-    elif error_model == 'std/sqrt_n':
-        yerr = binned_statistic(xvals, yvals, statistic='std', bins=xbins)[0]
-        yerr = yerr/np.sqrt(binned_statistic(xvals, yvals, statistic='count', bins=xbins)[0])
-    else:
+
+def _compute_binned_statistics(xvals, yvals, xbins, error_model='std/sqrt_n', weights=None):
+    """ Computes the binned statistics of `compute_radial_averages`, together with the
+    effective number of objects and the sum of the weights in each bin.
+
+    For extended descriptions of parameters, see `compute_radial_averages()` documentation.
+
+    Returns
+    -------
+    meanx, meany, yerr, n : array_like
+        See `compute_radial_averages()`
+    n_eff : array_like
+        Effective number of objects in each bin, equal to `n` without weights
+    sum_w : array_like
+        Sum of the weights in each bin, equal to `n` without weights
+    """
+    if error_model not in ('std', 'std/sqrt_n'):
         raise ValueError(f"{error_model} not supported err model for binned stats")
 
-    return meanx, meany, yerr, n
+    xvals = np.asarray(xvals, dtype=float)
+    yvals = np.asarray(yvals, dtype=float)
+    nbins = len(xbins) - 1
+
+    binnumber, inrange = _digitize_bins(xvals, xbins)
+    binnumber = binnumber[inrange]
+
+    # number of objects
+    n = np.bincount(binnumber, minlength=nbins)
+    if weights is None:
+        wvals = None
+        sum_w = sum_w2 = n.astype(float)
+        sumx = np.bincount(binnumber, weights=xvals[inrange], minlength=nbins)
+    else:
+        wvals = np.asarray(weights, dtype=float)
+        if wvals.shape != xvals.shape:
+            raise TypeError('weights must have the same length as xvals')
+        wvals = wvals[inrange]
+        sum_w = np.bincount(binnumber, weights=wvals, minlength=nbins)
+        sum_w2 = np.bincount(binnumber, weights=wvals*wvals, minlength=nbins)
+        sumx = np.bincount(binnumber, weights=wvals*xvals[inrange], minlength=nbins)
+
+    # The variance is accumulated around the mean of each bin, computed in a first pass, so
+    # that the sum of squares does not lose precision and a NaN only affects its own bin
+    ycols = np.atleast_2d(yvals)[:, inrange]
+    sumy = np.empty((len(ycols), nbins))
+    for i, ycol in enumerate(ycols):
+        sumy[i] = np.bincount(binnumber, weights=ycol if wvals is None else wvals*ycol,
+                              minlength=nbins)
+
+    with np.errstate(divide='ignore', invalid='ignore'):
+        nonempty = sum_w > 0
+        meanx = np.where(nonempty, sumx/sum_w, np.nan)
+        meany = np.where(nonempty, sumy/sum_w, np.nan)
+
+    sumy2 = np.empty((len(ycols), nbins))
+    for i, ycol in enumerate(ycols):
+        ycol = ycol - meany[i, binnumber]
+        wycol = ycol if wvals is None else wvals*ycol
+        sumy2[i] = np.bincount(binnumber, weights=wycol*ycol, minlength=nbins)
+
+    with np.errstate(divide='ignore', invalid='ignore'):
+        yvar = np.where(nonempty, sumy2/sum_w, np.nan)
+        n_eff = np.where(nonempty, sum_w**2/sum_w2, 0.)
+        yerr = np.sqrt(np.clip(yvar, 0., None))
+        if error_model == 'std/sqrt_n':
+            yerr = yerr/np.sqrt(n_eff)
+
+    if yvals.ndim < 2:
+        return meanx, meany[0], yerr[0], n, n_eff, sum_w
+    return meanx, meany, yerr, n, n_eff, sum_w
+
+
+def compute_inverse_variance_weights(shape_err, shape_noise=0.):
+    r""" Computes inverse variance weights of source galaxies
+
+    .. math::
+        w = \frac{1}{\sigma_e^2 + \sigma_{\rm int}^2}
+
+    Parameters
+    ----------
+    shape_err : array_like
+        Measurement error of the shape of each galaxy, :math:`\sigma_e`
+    shape_noise : float or array_like, optional
+        Intrinsic shape noise, :math:`\sigma_{\rm int}`. Defaults to 0.
+
+    Returns
+    -------
+    weights : array_like
+        Weight of each galaxy
+    """
+    variance = np.asarray(shape_err, dtype=float)**2 + np.asarray(shape_noise, dtype=float)**2
+    if np.any(variance <= 0.):
+        raise ValueError("Shape errors and shape noise can not both be zero")
+    return 1./variance
+
+
+def _digitize_bins(xvals, xbins):
+    """ Find the bin of each value, following the `scipy.stats.binned_statistic`
+    convention that the last bin includes its right edge.
+
+    Parameters
+    ----------
+    xvals : array_like
+        Values to be binned
+    xbins: array_like
+        Bin edges to sort into
+
+    Returns
+    -------
+    binnumber : array_like
+        Index of the bin of each value
+    inrange : array_like
+        Mask of the values falling inside of the bins
+    """
+    xbins = np.asarray(xbins, dtype=float)
+    binnumber = np.digitize(xvals, xbins) - 1
+    binnumber[xvals == xbins[-1]] = len(xbins) - 2
+    inrange = (binnumber >= 0) & (binnumber < len(xbins) - 1)
+    return binnumber, inrange
 
 
 def make_bins(rmin, rmax, nbins=10, method='evenwidth'):
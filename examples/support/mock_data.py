@@ -1,14 +1,16 @@
 """Functions to generate mock source galaxy distributions to demo lensing code"""
+import os
+from concurrent.futures import ProcessPoolExecutor
 import numpy as np
-from astropy.table import Table
+from astropy.table import Table, vstack
 from scipy import integrate
-from scipy.interpolate import interp1d
 from astropy import units
 from clmm.modeling import predict_reduced_tangential_shear, angular_diameter_dist_a1a2
 
 
 def generate_galaxy_catalog(cluster_m, cluster_z, cluster_c, cosmo, ngals, Delta_SO, zsrc, zsrc_min=0.4,
-                            zsrc_max=7., shapenoise=None, photoz_sigma_unscaled=None, nretry=5):
+                            zsrc_max=7., shapenoise=None, photoz_sigma_unscaled=None, nretry=5,
+                            rng=None):
     """Generates a mock dataset of sheared background galaxies.
 
     We build galaxy catalogs following a series of steps.
@@ -17,8 +19,9 @@ def generate_galaxy_catalog(cluster_m, cluster_z, cluster_c, cosmo, ngals, Delta
     parameters `zsrc` and `zsrc_max`. `zsrc` can be a `float` in which case every source is
     at the given redshift or a `str` describing a specific model to use for the source
     distribution. Currently, the only supported model for source galaxy distribution is that
-    of Chang et al. 2013 arXiv:1305.0793. When a model is used to describe the distribution,
-    `zsrc_max` is the maximum allowed redshift of a source galaxy.
+    of Chang et al. 2013 arXiv:1305.0793. A user distribution can also be given as a table
+    of redshifts and :math:`n(z)` values, or as a `SourceRedshiftSampler`. When a model is used
+    to describe the distribution, `zsrc_max` is the maximum allowed redshift of a source galaxy.
 
     2. Apply photometric redshift errors to the source galaxy population. This step is
     described by the parameter `photoz_sigma_unscaled`. If this parameter is set to a float,
@@ -30,7 +33,9 @@ def generate_galaxy_catalog(cluster_m, cluster_z, cluster_c, cosmo, ngals, Delta
 
     We additionally include two columns in the output catalog, `pzbins` and `pzpdf` which
     desribe the photo-z distribution as a Gaussian centered at :math:`z^{\rm true} with a
-    width :math:`\sigma_{\rm photo-z} = \sigma_{\rm photo-z}^{\rm unscaled}(1+z^{\rm true})`
+    width :math:`\sigma_{\rm photo-z} = \sigma_{\rm photo-z}^{\rm unscaled}(1+z^{\rm true})`.
+    They are 2d columns with one row of redshifts and PDF values per galaxy, which can be
+    converted to a `clmm.PhotoZPDFs` with `PhotoZPDFs.from_ragged`.
 
     If `photoz_sigma_unscaled` is `None`, the `z` column in the output catalog is the true
     redshift.
@@ -73,11 +78,15 @@ def generate_galaxy_catalog(cluster_m, cluster_z, cluster_c, cosmo, ngals, Delta
         :math:`R_{\Delta{\rm SO}}` where the mean density is :math:`\Delta_{\rm SO}` times
         the mean density of the Universe at the cluster redshift
         :math:`M_{\Delta{\rm SO}}=4/3\pi\Delta_{\rm SO}\rho_{m}(z_{\rm lens})R_{\Delta{\rm SO}}^3`
-    zsrc : float or str
+    zsrc : float, str, tuple or SourceRedshiftSampler
         Choose the source galaxy distribution to be fixed or drawn from a predefined distribution.
         float : All sources galaxies at this fixed redshift
         str : Draws individual source gal redshifts from predefined distribution. Options
               are: chang13
+        tuple : Draws individual source gal redshifts from a user distribution tabulated as
+                (z, nz) arrays
+        SourceRedshiftSampler : Draws individual source gal redshifts from a user sampler,
+                                which avoids integrating a tabulated distribution at each call
     zsrc_min : float, optional
         The minimum source redshift allowed.
     zsrc_max : float, optional
@@ -88,6 +97,8 @@ def generate_galaxy_catalog(cluster_m, cluster_z, cluster_c, cosmo, ngals, Delta
         If set, applies photo-z errors to source redshifts
     nretry : int, optional
         The number of times that we re-draw each galaxy with non-sensical derived properties
+    rng : numpy.random.Generator, optional
+        Random generator of the catalog. Defaults to the global `numpy.random` state.
 
     Returns
     -------
@@ -100,128 +111,341 @@ def generate_galaxy_catalog(cluster_m, cluster_z, cluster_c, cosmo, ngals, Delta
     """
     params = {'cluster_m' : cluster_m, 'cluster_z' : cluster_z, 'cluster_c' : cluster_c,
               'cosmo' : cosmo, 'Delta_SO' : Delta_SO, 'zsrc' : zsrc, 'zsrc_min' : zsrc_min,
-              'zsrc_max' : zsrc_max,'shapenoise' : shapenoise, 'photoz_sigma_unscaled' : photoz_sigma_unscaled}
+              'zsrc_max' : zsrc_max,'shapenoise' : shapenoise, 'photoz_sigma_unscaled' : photoz_sigma_unscaled,
+              # The functions of the global state have the same names as the Generator methods
+              'rng' : np.random if rng is None else rng}
     galaxy_catalog = _generate_galaxy_catalog(ngals=ngals, **params)
+    galaxy_catalog, rejected = _split_aphysical_galaxies(galaxy_catalog, zsrc_min)
 
-    # Check for bad galaxies and replace them
+    # Replace the bad galaxies: draw more galaxies than missing according to the fraction of
+    # good galaxies so far, and keep the good ones until the catalog is complete. The batches
+    # are limited to a few times the number of missing galaxies, so that the memory used stays
+    # bounded when most galaxies are aphysical.
+    ndrawn = ngals
     for i in range(nretry):
-        nbad, badids = _find_aphysical_galaxies(galaxy_catalog, zsrc_min)
-        if nbad < 1:
+        ngood = len(galaxy_catalog['z'])
+        if ngood >= ngals:
             break
-        replacements = _generate_galaxy_catalog(ngals=nbad, **params)
-        galaxy_catalog[badids] = replacements
-
-    # Final check to see if there are bad galaxies left
-    nbad, _ = _find_aphysical_galaxies(galaxy_catalog, zsrc_min)
+        acceptance = max(ngood/ndrawn, 0.01)
+        ndraw = min(int(1.1*(ngals-ngood)/acceptance)+1, 4*(ngals-ngood))
+        replacements, rejected = _split_aphysical_galaxies(
+            _generate_galaxy_catalog(ngals=ndraw, **params), zsrc_min)
+        galaxy_catalog = {name: np.concatenate((column, replacements[name]))
+                          for name, column in galaxy_catalog.items()}
+        ndrawn += ndraw
+
+    # Complete the catalog with bad galaxies if there are not enough good ones left
+    nbad = ngals-len(galaxy_catalog['z'])
+    if nbad > 0:
+        galaxy_catalog = {name: np.concatenate((column, rejected[name][:nbad]))
+                          for name, column in galaxy_catalog.items()}
     if nbad > 1:
         print("Not able to remove {} aphysical objects after {} iterations".format(nbad, nretry))
 
-    # Now that the catalog is final, add an id column
+    # Now that the catalog is final, build the table and add an id column
+    galaxy_catalog = Table({name: column[:ngals] for name, column in galaxy_catalog.items()})
     galaxy_catalog['id'] = np.arange(ngals)
     return galaxy_catalog
 
 
+def generate_galaxy_catalog_chunks(cluster_m, cluster_z, cluster_c, cosmo, ngals, Delta_SO, zsrc,
+                                   chunk_size=1000000, seed=None, chunks=None, **kwargs):
+    """Generates a mock dataset of sheared background galaxies by chunks of `chunk_size`
+    galaxies, so that the memory used does not depend on the number of galaxies.
+
+    Each chunk has its own random generator, seeded by the child `numpy.random.SeedSequence`
+    of `seed` of the same index. A chunk is therefore identical whichever process generates
+    it and whichever chunks are generated before it, and the chunks of a catalog can be split
+    between processes with the `chunks` parameter.
+
+    Parameters
+    ----------
+    cluster_m, cluster_z, cluster_c, cosmo, ngals, Delta_SO, zsrc
+        See `generate_galaxy_catalog`
+    chunk_size : int, optional
+        Number of galaxies of each chunk, the last chunk being smaller if needed
+    seed : int, optional
+        Seed of the catalog. If not set, the catalog is not reproducible and the chunks of
+        different calls do not belong to the same catalog.
+    chunks : iterable, optional
+        Indices of the chunks to generate. Defaults to all the chunks.
+    **kwargs
+        Other parameters of `generate_galaxy_catalog`
+
+    Yields
+    ------
+    galaxy_catalog : astropy.table.Table
+        Table of the source galaxies of a chunk, whose `id` column is the index of the galaxies
+        in the full catalog
+    """
+    nchunks = -(-ngals//chunk_size)
+    seeds = np.random.SeedSequence(seed).spawn(nchunks)
+    for chunk in (range(nchunks) if chunks is None else chunks):
+        start = chunk*chunk_size
+        galaxy_catalog = generate_galaxy_catalog(cluster_m, cluster_z, cluster_c, cosmo,
+                                                 min(chunk_size, ngals-start), Delta_SO, zsrc,
+                                                 rng=np.random.default_rng(seeds[chunk]),
+                                                 **kwargs)
+        galaxy_catalog['id'] += start
+        yield galaxy_catalog
+
+
+def write_galaxy_catalog_chunks(filename, cluster_m, cluster_z, cluster_c, cosmo, ngals, Delta_SO,
+                                zsrc, overwrite=False, **kwargs):
+    """Generates a mock dataset of sheared background galaxies by chunks and writes each chunk
+    to its own file as soon as it is generated.
+
+    Parameters
+    ----------
+    filename : str
+        Name of the file of each chunk, with a `{chunk}` field replaced by the index of the
+        chunk, e.g. "mock_{chunk:04d}.fits". The format is guessed from the extension by
+        `astropy.table.Table.write`.
+    cluster_m, cluster_z, cluster_c, cosmo, ngals, Delta_SO, zsrc
+        See `generate_galaxy_catalog`
+    overwrite : bool, optional
+        Overwrite existing files
+    **kwargs
+        Other parameters of `generate_galaxy_catalog_chunks`, e.g. `chunk_size`, `seed` and
+        `chunks`
+
+    Returns
+    -------
+    filenames : list
+        Names of the files written
+    """
+    chunks = kwargs.pop('chunks', None)
+    chunk_size = kwargs.get('chunk_size', 1000000)
+    chunks = range(-(-ngals//chunk_size)) if chunks is None else list(chunks)
+    filenames = []
+    for chunk, galaxy_catalog in zip(chunks, generate_galaxy_catalog_chunks(
+            cluster_m, cluster_z, cluster_c, cosmo, ngals, Delta_SO, zsrc, chunks=chunks,
+            **kwargs)):
+        filenames.append(filename.format(chunk=chunk))
+        galaxy_catalog.write(filenames[-1], overwrite=overwrite)
+    return filenames
+
+
+def generate_cluster_population(cluster_m, cluster_z, cluster_c, cosmo, ngals, Delta_SO, zsrc,
+                                seed=None, nprocs=None, combine=False, **kwargs):
+    """Generates mock datasets of sheared background galaxies for a population of clusters,
+    in parallel processes.
+
+    Each cluster has its own random generator, seeded by the child `numpy.random.SeedSequence`
+    of `seed` of the same index, so that the catalogs do not depend on the number of
+    processes nor on the order in which the clusters are processed.
+
+    Parameters
+    ----------
+    cluster_m : array_like
+        Cluster masses
+    cluster_z : array_like
+        Cluster redshifts
+    cluster_c : array_like
+        Cluster concentrations in the same mass definition as Delta_SO
+    cosmo : dict
+        Dictionary of cosmological parameters, see `generate_galaxy_catalog`
+    ngals : int or array_like
+        Number of galaxies of each cluster
+    Delta_SO, zsrc
+        See `generate_galaxy_catalog`
+    seed : int, optional
+        Seed of the population
+    nprocs : int, optional
+        Number of processes. Defaults to the number of processors, and the clusters are
+        generated in the current process if set to 1.
+    combine : bool, optional
+        Return a single catalog with a `cluster_id` column, the index of the cluster of each
+        galaxy, instead of one catalog per cluster
+    **kwargs
+        Other parameters of `generate_galaxy_catalog`
+
+    Returns
+    -------
+    galaxy_catalogs : list or astropy.table.Table
+        Table of the source galaxies of each cluster, or of all the clusters if `combine`
+    """
+    cluster_m, cluster_z, cluster_c, ngals = np.broadcast_arrays(
+        np.ravel(cluster_m), np.ravel(cluster_z), np.ravel(cluster_c), np.ravel(ngals))
+    seeds = np.random.SeedSequence(seed).spawn(len(cluster_m))
+    tasks = [((mass, redshift, concentration, cosmo, int(ngals_), Delta_SO, zsrc), seed_, kwargs)
+             for mass, redshift, concentration, ngals_, seed_
+             in zip(cluster_m, cluster_z, cluster_c, ngals, seeds)]
+    nprocs = nprocs or os.cpu_count() or 1
+    if nprocs == 1:
+        galaxy_catalogs = list(map(_generate_cluster_galaxy_catalog, tasks))
+    else:
+        with ProcessPoolExecutor(nprocs) as pool:
+            galaxy_catalogs = list(pool.map(_generate_cluster_galaxy_catalog, tasks,
+                                            chunksize=max(1, len(tasks)//(4*nprocs))))
+    if not combine:
+        return galaxy_catalogs
+    galaxy_catalog = vstack(galaxy_catalogs)
+    galaxy_catalog['cluster_id'] = np.repeat(np.arange(len(galaxy_catalogs)), ngals)
+    return galaxy_catalog
+
+
+def _generate_cluster_galaxy_catalog(task):
+    """Generates the catalog of one cluster of a population, in a worker process"""
+    args, seed, kwargs = task
+    return generate_galaxy_catalog(*args, rng=np.random.default_rng(seed), **kwargs)
+
+
 def _generate_galaxy_catalog(cluster_m, cluster_z, cluster_c, cosmo, ngals, Delta_SO, zsrc,
-                             zsrc_min=0.4, zsrc_max=7., shapenoise=None, photoz_sigma_unscaled=None):
+                             zsrc_min=0.4, zsrc_max=7., shapenoise=None, photoz_sigma_unscaled=None,
+                             rng=np.random):
     """A private function that skips the sanity checks on derived properties. This
     function should only be used when called directly from `generate_galaxy_catalog`.
-    Takes the same parameters and returns the same things as the before mentioned function.
+    Takes the same parameters as the before mentioned function, and returns the columns of
+    the catalog as a dict of arrays.
 
     For a more detailed description of each of the parameters, see the documentation of
     `generate_galaxy_catalog`.
     """
     # Set the source galaxy redshifts
-    galaxy_catalog = _draw_source_redshifts(zsrc, cluster_z, zsrc_min, zsrc_max, ngals)
+    galaxy_catalog = _draw_source_redshifts(zsrc, cluster_z, zsrc_min, zsrc_max, ngals, rng)
 
     # Add photo-z errors and pdfs to source galaxy redshifts
     if photoz_sigma_unscaled is not None:
-        galaxy_catalog = _compute_photoz_pdfs(galaxy_catalog, photoz_sigma_unscaled, ngals)
+        galaxy_catalog = _compute_photoz_pdfs(galaxy_catalog, photoz_sigma_unscaled, ngals, rng)
 
     # Draw galaxy positions
-    galaxy_catalog = _draw_galaxy_positions(galaxy_catalog, ngals, cluster_z, cosmo)
+    galaxy_catalog = _draw_galaxy_positions(galaxy_catalog, ngals, cluster_z, cosmo, rng)
 
-    # Compute the shear on each source galaxy
+    # Compute the shear on each source galaxy from its true redshift
     gamt = predict_reduced_tangential_shear(galaxy_catalog['r_mpc'], mdelta=cluster_m,
                                             cdelta=cluster_c, z_cluster=cluster_z,
-                                            z_source=galaxy_catalog['z'], cosmo=cosmo,
+                                            z_source=galaxy_catalog['ztrue'], cosmo=cosmo,
                                             delta_mdef=Delta_SO, halo_profile_model='nfw',
-                                            z_src_model='single_plane')
+                                            z_src_model='known_z_src')
     galaxy_catalog['gammat'] = gamt
 
     # Add shape noise to source galaxy shears
     if shapenoise is not None:
-        galaxy_catalog['gammat'] += shapenoise*np.random.standard_normal(ngals)
+        galaxy_catalog['gammat'] += shapenoise*rng.standard_normal(ngals)
 
     # Compute ellipticities
     galaxy_catalog['posangle'] = np.arctan2(galaxy_catalog['y_mpc'], galaxy_catalog['x_mpc'])
     galaxy_catalog['e1'] = -galaxy_catalog['gammat']*np.cos(2*galaxy_catalog['posangle'])
     galaxy_catalog['e2'] = -galaxy_catalog['gammat']*np.sin(2*galaxy_catalog['posangle'])
 
+    names = ['ra', 'dec', 'e1', 'e2', 'z']
     if photoz_sigma_unscaled is not None:
-        return galaxy_catalog['ra', 'dec', 'e1', 'e2', 'z', 'pzbins', 'pzpdf']
-    return galaxy_catalog['ra', 'dec', 'e1', 'e2', 'z']
+        names += ['pzbins', 'pzpdf']
+    return {name: galaxy_catalog[name] for name in names}
+
+
+def _split_aphysical_galaxies(galaxy_catalog, zsrc_min):
+    """Splits the columns of a catalog between the good and the aphysical galaxies"""
+    good = np.ones(len(galaxy_catalog['z']), dtype=bool)
+    good[_find_aphysical_galaxies(galaxy_catalog, zsrc_min)[1]] = False
+    return ({name: column[good] for name, column in galaxy_catalog.items()},
+            {name: column[~good] for name, column in galaxy_catalog.items()})
+
+
+def _chang13_nz(z):
+    """Redshift distribution of Chang et al. 2013 arXiv:1305.0793, not normalized"""
+    alpha, beta, z0 = 1.24, 1.01, 0.51
+    return (z**alpha)*np.exp(-(z/z0)**beta)
+
+
+_SOURCE_NZ_MODELS = {'chang13': _chang13_nz}
+
+
+class SourceRedshiftSampler():
+    """Draws source redshifts from a redshift distribution tabulated on a grid
+
+    The cumulative distribution is integrated once with the trapezoidal rule, and the
+    redshifts are drawn by interpolation of its inverse at uniform deviates (transformation
+    method, Numerical Recipes in C, Chap 7.2).
+
+    Attributes
+    ----------
+    z : array_like
+        Redshift grid
+    cdf : array_like
+        Cumulative distribution on the grid, from 0 to 1
+    """
+    def __init__(self, z, nz):
+        z, nz = np.asarray(z, dtype=float), np.asarray(nz, dtype=float)
+        if z.ndim != 1 or len(z) < 2 or np.any(np.diff(z) <= 0.) or nz.shape != z.shape:
+            raise ValueError("The redshift distribution must be tabulated on an increasing grid")
+        cdf = integrate.cumulative_trapezoid(nz, z, initial=0.)
+        if not cdf[-1] > 0.:
+            raise ValueError("The redshift distribution must have a positive integral")
+        self.z, self.cdf = z, cdf/cdf[-1]
 
+    def draw(self, ngals, rng=np.random):
+        """Draws the redshifts of `ngals` galaxies, with the random generator `rng`"""
+        return np.interp(rng.uniform(0., 1., ngals), self.cdf, self.z)
 
-def _draw_source_redshifts(zsrc, cluster_z, zsrc_min, zsrc_max, ngals):
+
+_SAMPLERS = {}
+
+
+def _get_source_redshift_sampler(zsrc, zsrc_min, zsrc_max):
+    """Sampler of a predefined redshift distribution, built once per model and redshift range"""
+    key = (zsrc, zsrc_min, zsrc_max)
+    if key not in _SAMPLERS:
+        zsrc_domain = np.arange(zsrc_min, zsrc_max, 0.001)
+        _SAMPLERS[key] = SourceRedshiftSampler(zsrc_domain, _SOURCE_NZ_MODELS[zsrc](zsrc_domain))
+    return _SAMPLERS[key]
+
+
+def _draw_source_redshifts(zsrc, cluster_z, zsrc_min, zsrc_max, ngals, rng=np.random):
     """Set source galaxy redshifts either set to a fixed value or draw from a predefined
-    distribution. Return an astropy table of the source galaxies
+    distribution. Return the columns of the source galaxies as a dict of arrays
 
-    Uses a sampling technique found in Numerical Recipes in C, Chap 7.2: Transformation Method.
-    Pulling out random values from a given probability distribution.
+    Redshifts of distributions are drawn with a `SourceRedshiftSampler`, whose cumulative
+    distribution is computed once per distribution and redshift range.
     """
     # Set zsrc to constant value
     if isinstance(zsrc, float):
         zsrc_list = np.ones(ngals)*zsrc
 
-    # Draw zsrc from Chang et al. 2013
-    elif zsrc == 'chang13':
-        def pzfxn(z):
-            """Redshift distribution function"""
-            alpha, beta, z0 = 1.24, 1.01, 0.51
-            return (z**alpha)*np.exp(-(z/z0)**beta)
+    # Draw zsrc from a user distribution
+    elif isinstance(zsrc, SourceRedshiftSampler):
+        zsrc_list = zsrc.draw(ngals, rng)
+    elif isinstance(zsrc, tuple):
+        zsrc_list = SourceRedshiftSampler(*zsrc).draw(ngals, rng)
 
-        def integrated_pzfxn(zmax, func):
-            """Integrated redshift distribution function for transformation method"""
-            val, _ = integrate.quad(func, zsrc_min, zmax)
-            return val
-        vectorization_integrated_pzfxn = np.vectorize(integrated_pzfxn)
+    # Draw zsrc from a predefined distribution, e.g. Chang et al. 2013
+    elif zsrc in _SOURCE_NZ_MODELS:
+        zsrc_list = _get_source_redshift_sampler(zsrc, zsrc_min, zsrc_max).draw(ngals, rng)
 
-        zsrc_domain = np.arange(zsrc_min, zsrc_max, 0.001)
-        probdist = vectorization_integrated_pzfxn(zsrc_domain, pzfxn)
-
-        uniform_deviate = np.random.uniform(probdist.min(), probdist.max(), ngals)
-        zsrc_list = interp1d(probdist, zsrc_domain, kind='linear')(uniform_deviate)
-    
     # Draw zsrc from a uniform distribution between zmin and zmax
     elif zsrc == 'uniform':
-        zsrc_list = np.random.uniform(cluster_z + 0.1, zsrc_max, ngals)
+        zsrc_list = rng.uniform(cluster_z + 0.1, zsrc_max, ngals)
 
     # Invalid entry
     else:
-        raise ValueError("zsrc must be a float or chang13. You set: {}".format(zsrc))
+        raise ValueError("zsrc must be a float, chang13, uniform, a (z, nz) table or a "
+                         "SourceRedshiftSampler. You set: {}".format(zsrc))
+
+    return {'ztrue': zsrc_list, 'z': np.array(zsrc_list)}
 
-    return Table([zsrc_list, zsrc_list], names=('ztrue', 'z'))
 
+def _compute_photoz_pdfs(galaxy_catalog, photoz_sigma_unscaled, ngals, rng=np.random):
+    r"""Add photo-z errors and PDFs to the mock catalog.
 
-def _compute_photoz_pdfs(galaxy_catalog, photoz_sigma_unscaled, ngals):
-    r"""Add photo-z errors and PDFs to the mock catalog."""
+    The PDFs are evaluated on a grid of offsets from the true redshift shared by all the
+    galaxies, so that `pzbins` and `pzpdf` are 2d columns of shape (ngals, nbins) computed in
+    a single broadcast.
+    """
     galaxy_catalog['pzsigma'] = photoz_sigma_unscaled*(1.+galaxy_catalog['ztrue'])
     galaxy_catalog['z'] = galaxy_catalog['ztrue'] + \
-                          galaxy_catalog['pzsigma']*np.random.standard_normal(ngals)
+                          galaxy_catalog['pzsigma']*rng.standard_normal(ngals)
 
-    pzbins_grid, pzpdf_grid = [], []
-    for row in galaxy_catalog:
-        zmin, zmax = row['ztrue'] - 0.5, row['ztrue'] + 0.5
-        zbins = np.arange(zmin, zmax, 0.03)
-        pzbins_grid.append(zbins)
-        pzpdf_grid.append(np.exp(-0.5*((zbins - row['ztrue'])/row['pzsigma'])**2)/np.sqrt(2*np.pi*row['pzsigma']**2))
-    galaxy_catalog['pzbins'] = pzbins_grid
-    galaxy_catalog['pzpdf'] = pzpdf_grid
+    ztrue = np.asarray(galaxy_catalog['ztrue'])[:, None]
+    pzsigma = np.asarray(galaxy_catalog['pzsigma'])[:, None]
+    zbins = ztrue + np.arange(-0.5, 0.5, 0.03)
+    galaxy_catalog['pzbins'] = zbins
+    galaxy_catalog['pzpdf'] = np.exp(-0.5*((zbins - ztrue)/pzsigma)**2)/np.sqrt(2*np.pi*pzsigma**2)
 
     return galaxy_catalog
 
 
-def _draw_galaxy_positions(galaxy_catalog, ngals, cluster_z, cosmo):
+def _draw_galaxy_positions(galaxy_catalog, ngals, cluster_z, cosmo, rng=np.random):
     """Draw positions of source galaxies around lens
 
     We draw physical x and y positions from uniform distribution with -4 and 4 Mpc of the
@@ -229,8 +453,8 @@ def _draw_galaxy_positions(galaxy_catalog, ngals, cluster_z, cosmo):
 
     Parameters
     ----------
-    galaxy_catalog : astropy.table.Table
-        Source galaxy catalog
+    galaxy_catalog : dict
+        Columns of the source galaxy catalog
     ngals : float
         The number of source galaxies to draw
     cluster_z : float
@@ -238,15 +462,17 @@ def _draw_galaxy_positions(galaxy_catalog, ngals, cluster_z, cosmo):
     cosmo : dict
         Dictionary of cosmological parameters. Must contain at least, Omega_c, Omega_b,
         and H0
+    rng : numpy.random.Generator, optional
+        Random generator
 
     Returns
     -------
-    galaxy_catalog : astropy.table.Table
-        Source galaxy catalog with positions added
+    galaxy_catalog : dict
+        Columns of the source galaxy catalog with positions added
     """
     Dl = angular_diameter_dist_a1a2(cosmo, 1./(1.+cluster_z))*units.pc.to(units.Mpc)
-    galaxy_catalog['x_mpc'] = np.random.uniform(-4., 4., size=ngals)
-    galaxy_catalog['y_mpc'] = np.random.uniform(-4., 4., size=ngals)
+    galaxy_catalog['x_mpc'] = rng.uniform(-4., 4., size=ngals)
+    galaxy_catalog['y_mpc'] = rng.uniform(-4., 4., size=ngals)
     galaxy_catalog['r_mpc'] = np.sqrt(galaxy_catalog['x_mpc']**2 + galaxy_catalog['y_mpc']**2)
     galaxy_catalog['ra'] = -(galaxy_catalog['x_mpc']/Dl)*(180./np.pi)
     galaxy_catalog['dec'] = (galaxy_catalog['y_mpc']/Dl)*(180./np.pi)
@@ -266,8 +492,8 @@ def _find_aphysical_galaxies(galaxy_catalog, zsrc_min):
 
     Parameters
     ----------
-    galaxy_catalog : astropy.table.Table
-        Galaxy source catalog
+    galaxy_catalog : dict or astropy.table.Table
+        Columns of the galaxy source catalog
     zsrc_min : float
         Minimum galaxy redshift allowed 
 
@@ -0,0 +1,25 @@
+"""Helpers shared by the tests"""
+import numpy as np
+from astropy.table import Table
+
+import clmm
+
+
+def make_random_cluster(seed, ngals=300, unique_id=None, z=0.3, compute_shear=True):
+    """ A cluster at (ra, dec) = (120, 42) with random sources around it
+
+    The galaxy catalog has the positions ra and dec, the ellipticities e1 and e2 and their
+    error e_err, the redshift z, a weight w and a patch index in [0, 5) of each source. The
+    tangential and cross shears are computed unless `compute_shear` is False.
+    """
+    rng = np.random.RandomState(seed)
+    galcat = Table([rng.uniform(119.9, 120.1, ngals), rng.uniform(41.9, 42.1, ngals),
+                    rng.uniform(-0.3, 0.3, ngals), rng.uniform(-0.3, 0.3, ngals),
+                    rng.uniform(0.05, 0.3, ngals), rng.uniform(0.5, 1.5, ngals),
+                    rng.uniform(0.5, 2., ngals), rng.randint(0, 5, ngals)],
+                   names=('ra', 'dec', 'e1', 'e2', 'e_err', 'z', 'w', 'patch'))
+    cluster = clmm.GalaxyCluster(unique_id=str(seed) if unique_id is None else unique_id,
+                                 ra=120., dec=42., z=z, galcat=galcat)
+    if compute_shear:
+        cluster.compute_shear()
+    return cluster
@@ -0,0 +1,94 @@
+"""Tests for clusterarchive.py"""
+import os
+import numpy as np
+from numpy import testing
+from astropy.table import MaskedColumn
+import clmm
+from .helpers import make_random_cluster
+
+
+def _make_cluster(unique_id, ngals):
+    """ A random cluster with integer, multidimensional, masked and object columns """
+    cluster = make_random_cluster(int(unique_id), ngals, unique_id=unique_id, z=0.1*ngals,
+                                  compute_shear=False)
+    cluster.galcat['id'] = np.arange(ngals)
+    cluster.galcat['pzpdf'] = np.ones((ngals, 3))
+    cluster.galcat['e1'] = MaskedColumn(cluster.galcat['e1'], mask=np.arange(ngals) % 2 == 0)
+    cluster.galcat['pzbins'] = np.array([np.arange(i) for i in range(ngals)]+[None],
+                                        dtype=object)[:-1]
+    return cluster
+
+
+def test_archive():
+    filename = 'testarchive.clmm'
+    clusters = [_make_cluster(str(i), ngals) for i, ngals in enumerate([5, 0, 3])]
+    with clmm.ClusterArchive(filename, mode='w') as archive:
+        archive.append(clusters[:2])
+        archive.append(clusters[2])
+        testing.assert_raises(ValueError, archive.append, clusters[0])
+
+    archive = clmm.ClusterArchive(filename)
+    assert len(archive) == 3
+    assert archive.unique_ids == ['0', '1', '2']
+    assert 2 in archive and '3' not in archive
+    testing.assert_allclose(archive.metadata['z'], [0.5, 0., 0.3])
+    testing.assert_equal(archive.metadata['ngals'], [5, 0, 3])
+    for cluster, cluster_read in zip(clusters, archive):
+        assert cluster_read.unique_id == cluster.unique_id
+        assert cluster_read.galcat.colnames == cluster.galcat.colnames
+        for name in ('id', 'ra', 'pzpdf'):
+            testing.assert_equal(np.asarray(cluster_read.galcat[name]),
+                                 np.asarray(cluster.galcat[name]))
+        testing.assert_equal(cluster_read.galcat['e1'].mask, cluster.galcat['e1'].mask)
+        for pzbins, pzbins_read in zip(cluster.galcat['pzbins'], cluster_read.galcat['pzbins']):
+            testing.assert_equal(pzbins_read, pzbins)
+
+    # Random access to selected columns
+    cluster = archive.get('2', columns=['ra'], mmap=False)
+    assert cluster.galcat.colnames == ['ra']
+    testing.assert_equal(np.asarray(cluster.galcat['ra']), np.asarray(clusters[2].galcat['ra']))
+    testing.assert_raises(KeyError, archive.get, '3')
+    testing.assert_raises(ValueError, archive.append, clusters[0])
+    archive.close()
+
+    # Appending keeps the clusters already stored
+    with clmm.ClusterArchive(filename, mode='a') as archive:
+        archive.append(_make_cluster('3', 4))
+    with clmm.ClusterArchive(filename) as archive:
+        assert archive.unique_ids == ['0', '1', '2', '3']
+        testing.assert_equal(np.asarray(archive['0'].galcat['ra']),
+                             np.asarray(clusters[0].galcat['ra']))
+    os.remove(filename)
+
+    with open(filename, 'wb') as fout:
+        fout.write(b'not an archive')
+    testing.assert_raises(ValueError, clmm.ClusterArchive, filename)
+    os.remove(filename)
+    testing.assert_raises(ValueError, clmm.ClusterArchive, filename, mode='x')
+
+
+def test_archive_failed_append():
+    filename = 'testarchive.clmm'
+    with clmm.ClusterArchive(filename, mode='w') as archive:
+        archive.append(_make_cluster('0', 3))
+        # Metadata that cannot be written in the index
+        cluster = _make_cluster('1', 2)
+        cluster.galcat.meta['zmax'] = np.float32(3.)
+        testing.assert_raises(TypeError, archive.append, [_make_cluster('2', 2), cluster])
+        assert archive.unique_ids == ['0', '2'] and '1' not in archive
+        del cluster.galcat.meta['zmax']
+        archive.append(cluster)
+    with clmm.ClusterArchive(filename) as archive:
+        assert archive.unique_ids == ['0', '2', '1']
+        testing.assert_equal(np.asarray(archive['1'].galcat['ra']),
+                             np.asarray(cluster.galcat['ra']))
+
+    # An append interrupted before the index is written leaves the previous index readable
+    with open(filename, 'ab') as fout:
+        fout.write(bytes(100)+b'CLMMARCH'+bytes(30))
+    with clmm.ClusterArchive(filename, mode='a') as archive:
+        assert archive.unique_ids == ['0', '2', '1']
+        archive.append(_make_cluster('3', 1))
+    with clmm.ClusterArchive(filename) as archive:
+        assert archive.unique_ids == ['0', '2', '1', '3']
+    os.remove(filename)
@@ -0,0 +1,89 @@
+"""Tests for covariance.py"""
+import numpy as np
+from numpy import testing
+
+import clmm
+import clmm.polaraveraging as pa
+from clmm.covariance import compute_shear_covariance, compute_stacked_covariance
+from .helpers import make_random_cluster
+
+TOLERANCE = {'atol':1.e-10, 'rtol':1.e-7}
+
+
+def test_jackknife_covariance():
+    cluster = make_random_cluster(1, ngals=1000)
+    bins = np.linspace(0., 0.0015, 5)
+    for weights in (None, 'w'):
+        cov_gt, cov_gx = compute_shear_covariance(cluster, 'radians', 'radians', bins,
+                                                  patches='patch', weights=weights)
+        assert cov_gt.shape == (4, 4)
+
+        # Brute force delete one patch jackknife
+        profiles = []
+        for patch in range(5):
+            subcluster = clmm.GalaxyCluster(unique_id='sub', ra=120., dec=42., z=0.3,
+                                            galcat=cluster.galcat[cluster.galcat['patch'] != patch])
+            profiles.append(pa.make_shear_profile(subcluster, 'radians', 'radians', bins,
+                                                  add_to_cluster=False, include_empty_bins=True,
+                                                  weights=weights))
+        for col, cov in (('gt', cov_gt), ('gx', cov_gx)):
+            samples = np.array([profile[col] for profile in profiles])
+            testing.assert_allclose(cov, 4.*np.cov(samples.T, ddof=0), **TOLERANCE)
+
+    # Angular sectors with the same number of sources
+    cov_gt, _ = compute_shear_covariance(cluster, 'radians', 'radians', bins, patches=8)
+    testing.assert_allclose(cov_gt, cov_gt.T, **TOLERANCE)
+    assert np.all(np.diag(cov_gt) > 0.)
+    testing.assert_raises(ValueError, compute_shear_covariance, cluster, 'radians', 'radians',
+                          bins, patches=np.zeros(len(cluster.galcat)))
+    testing.assert_raises(TypeError, compute_shear_covariance, cluster, 'radians', 'radians',
+                          bins, patches=np.zeros(3))
+    testing.assert_raises(ValueError, compute_shear_covariance, cluster, 'radians', 'radians',
+                          bins, method='glue')
+
+
+def test_bootstrap_covariance():
+    cluster = make_random_cluster(2, ngals=4000)
+    bins = np.linspace(0., 0.0015, 4)
+    cov_gt, cov_gx = compute_shear_covariance(cluster, 'radians', 'radians', bins,
+                                              method='bootstrap', nboot=400, seed=3)
+    # Bootstrap over the sources recovers the standard errors of the profile
+    profile = pa.make_shear_profile(cluster, 'radians', 'radians', bins, add_to_cluster=False)
+    testing.assert_allclose(np.sqrt(np.diag(cov_gt)), profile['gt_err'], rtol=0.15)
+    testing.assert_allclose(np.sqrt(np.diag(cov_gx)), profile['gx_err'], rtol=0.15)
+
+    # Same seed, same resamples
+    testing.assert_array_equal(cov_gt, compute_shear_covariance(
+        cluster, 'radians', 'radians', bins, method='bootstrap', nboot=400, seed=3)[0])
+    testing.assert_raises(ValueError, compute_shear_covariance, cluster, 'radians', 'radians',
+                          bins, method='bootstrap', nboot=1)
+
+
+def test_empty_bins():
+    cluster = make_random_cluster(4, ngals=1000)
+    cov_gt, _ = compute_shear_covariance(cluster, 'radians', 'radians', [0., 0.001, 1., 2.],
+                                         patches='patch')
+    assert np.all(np.isfinite(cov_gt[:2, :2]))
+    assert np.all(np.isnan(cov_gt[2])) and np.all(np.isnan(cov_gt[:, 2]))
+
+
+def test_stacked_covariance():
+    bins = np.linspace(0., 0.0015, 4)
+    stacks = []
+    for seed in range(6):
+        stack = clmm.StackedProfile(bins, 'radians')
+        stack.add_cluster(make_random_cluster(seed), weights='w')
+        stacks.append(stack)
+
+    cov_gt, cov_gx = compute_stacked_covariance(stacks)
+    profiles = [sum(stacks[:i]+stacks[i+1:], clmm.StackedProfile(bins, 'radians')).make_profile()
+                for i in range(6)]
+    for col, cov in (('gt', cov_gt), ('gx', cov_gx)):
+        samples = np.array([profile[col] for profile in profiles])
+        testing.assert_allclose(cov, 5.*np.cov(samples.T, ddof=0), **TOLERANCE)
+
+    cov_gt, _ = compute_stacked_covariance(stacks, method='bootstrap', nboot=50, seed=1)
+    assert cov_gt.shape == (3, 3)
+    testing.assert_raises(ValueError, compute_stacked_covariance, [])
+    testing.assert_raises(ValueError, compute_stacked_covariance,
+                          [stacks[0], clmm.StackedProfile([0., 1.], 'radians')])
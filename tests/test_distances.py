@@ -0,0 +1,53 @@
+"""Tests for distances.py"""
+import warnings
+import numpy as np
+from numpy.testing import assert_raises, assert_allclose
+from astropy.cosmology import FlatLambdaCDM, LambdaCDM
+
+from clmm.distances import DistanceTable
+
+TOLERANCE = {'rtol': 1.0e-9, 'atol': 0}
+
+
+def _astropy_distance_z1z2(cosmo, redshift1, redshift2):
+    """ Angular diameter distance between two redshifts with astropy, whose interface changed
+    across versions """
+    with warnings.catch_warnings():
+        warnings.simplefilter('ignore')
+        return cosmo.angular_diameter_distance_z1z2(redshift1, redshift2).value
+
+
+def test_distances():
+    """ Compare the tabulated distances with astropy """
+    np.random.seed(0)
+    redshift1 = np.random.uniform(0., 1., 100)
+    redshift2 = np.random.uniform(1., 6., 100)
+    for cosmo in (FlatLambdaCDM(H0=70., Om0=0.3, Ob0=0.05),
+                  LambdaCDM(H0=67., Om0=0.3, Ode0=0.8, Ob0=0.05),
+                  LambdaCDM(H0=70., Om0=0.3, Ode0=0.6, Ob0=0.05),
+                  FlatLambdaCDM(H0=70., Om0=0.3, Ob0=0.05, Tcmb0=2.7255)):
+        table = DistanceTable(cosmo, zmax=3.)
+        assert_allclose(table.comoving_distance(redshift2),
+                        cosmo.comoving_distance(redshift2).value, **TOLERANCE)
+        assert_allclose(table.transverse_comoving_distance(redshift2),
+                        cosmo.comoving_transverse_distance(redshift2).value, **TOLERANCE)
+        assert_allclose(table.angular_diameter_distance(redshift1),
+                        cosmo.angular_diameter_distance(redshift1).value, **TOLERANCE)
+        assert_allclose(table.angular_diameter_distance_z1z2(redshift1, redshift2),
+                        _astropy_distance_z1z2(cosmo, redshift1, redshift2), **TOLERANCE)
+        assert_allclose(table.distance_ratio(redshift1, redshift2),
+                        _astropy_distance_z1z2(cosmo, redshift1, redshift2)
+                        /cosmo.angular_diameter_distance(redshift2).value, **TOLERANCE)
+        # The table was extended to the largest redshift
+        assert table.zmax >= 6.
+
+    # Scalars, broadcasting and limits
+    table = DistanceTable(FlatLambdaCDM(H0=70., Om0=0.3, Ob0=0.05))
+    assert table.comoving_distance(0.) == 0.
+    assert np.ndim(table.angular_diameter_distance(1.)) == 0
+    assert table.angular_diameter_distance_z1z2(0.5, [1., 2.]).shape == (2,)
+    assert table.distance_ratio([[0.2], [0.4]], [1., 2., 3.]).shape == (2, 3)
+    assert table.distance_ratio(1., 0.5) < 0.
+    assert table.comoving_distance([]).shape == (0,)
+    assert_raises(ValueError, table.comoving_distance, [1., -0.5])
+    assert isinstance(repr(table), str)
@@ -2,9 +2,11 @@
 Tests for datatype and galaxycluster
 """
 from numpy import testing
+import numpy as np
 import clmm
-from astropy.table import Table
+from astropy.table import Table, MaskedColumn
 import os
+import shutil
 
 def test_initialization():
     testdict1 = {'unique_id': '1', 'ra': 161.3, 'dec': 34., 'z': 0.3, 'galcat': Table()}
@@ -49,7 +51,7 @@ def test_integrity(): # Converge on name
 
 def test_save_load():
     cl1 = clmm.GalaxyCluster(unique_id='1', ra=161.3, dec=34., z=0.3, galcat=Table())
-    cl1.save('testcluster.pkl')
+    cl1.save('testcluster.pkl', format='pickle')
     cl2 = clmm.load_cluster('testcluster.pkl')
     os.system('rm testcluster.pkl')
 
@@ -58,7 +60,64 @@ def test_save_load():
     testing.assert_equal(cl2.dec, cl1.dec)
     testing.assert_equal(cl2.z, cl1.z)
 
-    # remeber to add tests for the tables of the cluster
+    testing.assert_raises(ValueError, cl1.save, 'testcluster', format='bleh')
+
+
+def _is_memmap(array):
+    """ Whether an array is a view of a memory-mapped file """
+    while array is not None:
+        if isinstance(array, np.memmap):
+            return True
+        array = array.base
+    return False
+
+
+def test_save_load_columnar():
+    galcat = Table([np.arange(5), np.linspace(161., 162., 5), np.linspace(34., 35., 5),
+                    np.ones((5, 3), dtype=np.float32),
+                    MaskedColumn([1., 2., 3., 4., 5.], mask=[0, 1, 0, 0, 1]),
+                    np.array([np.arange(i) for i in range(5)], dtype=object)],
+                   names=('id', 'ra', 'dec', 'pzpdf', 'e1', 'pzbins'))
+    galcat['ra'].unit = 'deg'
+    galcat.meta['source'] = 'test'
+    cl1 = clmm.GalaxyCluster(unique_id='1', ra=161.3, dec=34., z=0.3, galcat=galcat)
+    cl1.save('testcluster')
+    cl2 = clmm.load_cluster('testcluster')
+
+    testing.assert_equal(cl2.unique_id, cl1.unique_id)
+    testing.assert_equal([cl2.ra, cl2.dec, cl2.z], [cl1.ra, cl1.dec, cl1.z])
+    assert cl2.galcat.colnames == galcat.colnames
+    assert cl2.galcat.meta['source'] == 'test'
+    assert cl2.galcat['ra'].unit == 'deg'
+    assert cl2.galcat['pzpdf'].dtype == np.float32
+    for name in ('id', 'ra', 'dec', 'pzpdf'):
+        testing.assert_equal(np.asarray(cl2.galcat[name]), np.asarray(galcat[name]))
+        assert _is_memmap(cl2.galcat[name])
+    testing.assert_equal(cl2.galcat['e1'].mask, galcat['e1'].mask)
+    testing.assert_equal(cl2.galcat['e1'].filled(0.), galcat['e1'].filled(0.))
+    testing.assert_equal(cl2.galcat['pzbins'][3], np.arange(3))
+
+    # Selected columns, read in memory
+    cl2 = clmm.load_cluster('testcluster', columns=['ra', 'dec'], mmap=False)
+    assert cl2.galcat.colnames == ['ra', 'dec']
+    assert not _is_memmap(cl2.galcat['ra'])
+    testing.assert_raises(KeyError, clmm.load_cluster, 'testcluster', columns=['bleh'])
+
+    # Saving again replaces the columns
+    del cl2
+    cl1.galcat = galcat['ra', 'dec']
+    cl1.save('testcluster')
+    assert clmm.load_cluster('testcluster').galcat.colnames == ['ra', 'dec']
+    assert len(os.listdir('testcluster')) == 3
+
+    # A save that fails keeps the previous one
+    cl1.galcat.meta['zmax'] = np.float32(3.)
+    testing.assert_raises(TypeError, cl1.save, 'testcluster')
+    cl2 = clmm.load_cluster('testcluster')
+    assert cl2.galcat.colnames == ['ra', 'dec']
+    testing.assert_equal(np.asarray(cl2.galcat['ra']), np.asarray(galcat['ra']))
+    assert len(os.listdir('testcluster')) == 3
+    shutil.rmtree('testcluster')
 
 
 # def test_find_data():
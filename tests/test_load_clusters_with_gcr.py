@@ -21,17 +21,22 @@ def test_ranges():
     testing.assert_raises(ValueError, clmm.lsst.load_from_dc2, 5, 'cosmoDC2_v1.1.4_small', '.',
                           (0.3, -0.3), (-0.3, 0.3), (0.1, 1.5), _reader='test')
 
-def test_values():
-    clmm.lsst.load_from_dc2(10, 'cosmoDC2_v1.1.4_small', '.', _reader='test')
-    
-    c = clmm.load_cluster('./3.p')
+def test_values(tmp_path):
+    save_dir = str(tmp_path)
+    clmm.lsst.load_from_dc2(10, 'cosmoDC2_v1.1.4_small', save_dir, _reader='test')
+    assert os.listdir(save_dir) == ['clusters.clmm']
+    with clmm.ClusterArchive(os.path.join(save_dir, 'clusters.clmm')) as archive:
+        assert len(archive) == 10
+        c = archive['3']
     testing.assert_equal(len(c.galcat), 10)
-    testing.assert_equal(c.galcat.columns.keys(), 
+    testing.assert_equal(c.galcat.colnames,
+                         ['galaxy_id', 'ra', 'dec', 'e1', 'e2', 'z', 'kappa'])
+
+    clmm.lsst.load_from_dc2(10, 'cosmoDC2_v1.1.4_small', save_dir, archive=None,
+                            _reader='test')
+    c = clmm.load_cluster(os.path.join(save_dir, '3.p'))
+    testing.assert_equal(len(c.galcat), 10)
+    testing.assert_equal(c.galcat.colnames,
                          ['galaxy_id', 'ra', 'dec', 'e1', 'e2', 'z', 'kappa'])
     testing.assert_equal(c.galcat[5]['e1'], 2.)
     testing.assert_equal(c.galcat[4]['z'], 0.4)
-    
-    for file in os.listdir('.'):
-        if file[-2:]=='.p':
-            os.remove(file)
-
@@ -0,0 +1,78 @@
+"""Tests for the mock data generator of the examples, examples/support/mock_data.py"""
+import os
+import sys
+import numpy as np
+from numpy import testing
+from astropy.table import Table
+
+sys.path.append(os.path.join(os.path.dirname(__file__), '..', 'examples', 'support'))
+import mock_data # pylint: disable=wrong-import-position
+
+
+COSMO = {'Omega_c': 0.25, 'Omega_b': 0.05, 'H0': 70.}
+CLUSTER = (1.e15, 0.3, 4., COSMO)
+
+
+def test_low_acceptance():
+    # All the sources are in front of the minimum source redshift, so that every galaxy is
+    # aphysical: the redraws must stay a few times the size of the catalog
+    ndraws = []
+    generate = mock_data._generate_galaxy_catalog
+    def _generate_galaxy_catalog(*args, **kwargs):
+        ndraws.append(kwargs['ngals'])
+        return generate(*args, **kwargs)
+    mock_data._generate_galaxy_catalog = _generate_galaxy_catalog
+    try:
+        galaxy_catalog = mock_data.generate_galaxy_catalog(*CLUSTER, 200, 200, 0.2, zsrc_min=0.4,
+                                                           rng=np.random.default_rng(1))
+    finally:
+        mock_data._generate_galaxy_catalog = generate
+    assert len(galaxy_catalog) == 200
+    assert max(ndraws) <= 4*200 and len(ndraws) == 6
+
+
+def test_photoz_shear():
+    # The shear is computed from the true redshift, 0.5, and not from the photometric one
+    galaxy_catalog = mock_data.generate_galaxy_catalog(*CLUSTER, 500, 200, 0.5, zsrc_min=0.,
+                                                       photoz_sigma_unscaled=0.3,
+                                                       rng=np.random.default_rng(2))
+    assert np.any(galaxy_catalog['z'] < CLUSTER[1])
+    assert np.all(galaxy_catalog['e1']**2+galaxy_catalog['e2']**2 > 0.)
+
+
+def test_galaxy_catalog_chunks(tmp_path):
+    kwargs = {'chunk_size': 40, 'seed': 3, 'shapenoise': 0.05}
+    chunks = list(mock_data.generate_galaxy_catalog_chunks(*CLUSTER, 100, 200, 'chang13',
+                                                           **kwargs))
+    assert [len(chunk) for chunk in chunks] == [40, 40, 20]
+    testing.assert_array_equal(np.concatenate([chunk['id'] for chunk in chunks]),
+                               np.arange(100))
+
+    # A chunk does not depend on the chunks generated before it
+    chunk, = mock_data.generate_galaxy_catalog_chunks(*CLUSTER, 100, 200, 'chang13',
+                                                      chunks=[2], **kwargs)
+    for name in chunk.colnames:
+        testing.assert_array_equal(chunk[name], chunks[2][name])
+
+    filenames = mock_data.write_galaxy_catalog_chunks(
+        str(tmp_path/'mock_{chunk:02d}.fits'), *CLUSTER, 100, 200, 'chang13', chunks=[0, 2],
+        **kwargs)
+    assert [os.path.basename(filename) for filename in filenames] == ['mock_00.fits',
+                                                                     'mock_02.fits']
+    chunk = Table.read(filenames[1])
+    for name in chunk.colnames:
+        testing.assert_array_equal(chunk[name], chunks[2][name])
+
+
+def test_cluster_population():
+    args = ([1.e14, 1.e15, 5.e14], [0.2, 0.3, 0.4], 4., COSMO, [30, 20, 10], 200, 'chang13')
+    catalogs = mock_data.generate_cluster_population(*args, seed=5, nprocs=1)
+    assert [len(catalog) for catalog in catalogs] == [30, 20, 10]
+
+    # The catalogs do not depend on the number of processes
+    combined = mock_data.generate_cluster_population(*args, seed=5, nprocs=2, combine=True)
+    testing.assert_array_equal(combined['cluster_id'], np.repeat([0, 1, 2], [30, 20, 10]))
+    for cluster_id, catalog in enumerate(catalogs):
+        for name in catalog.colnames:
+            testing.assert_array_equal(combined[name][combined['cluster_id'] == cluster_id],
+                                       catalog[name])
@@ -2,8 +2,10 @@
 import json
 import numpy as np
 from numpy.testing import assert_raises, assert_allclose, assert_equal
+from scipy.integrate import quad, trapezoid
 from astropy.cosmology import FlatLambdaCDM, LambdaCDM
 import clmm.modeling as md
+from clmm import PhotoZPDFs
 from clmm.constants import Constants as clc
 
 
@@ -151,6 +153,36 @@ def test_astropyify_ccl_cosmo():
     assert_raises(TypeError, md.astropyify_ccl_cosmo, [70., 0.3, 0.25, 0.05])
 
 
+def test_cosmology_registry():
+    """ Unit tests for the registry of cosmologies used by the modeling functions """
+    registry = md._CosmologyRegistry(maxsize=2)
+    cclcosmo = {'Omega_c': 0.25, 'Omega_b': 0.05, 'h': 0.7, 'H0': 70.}
+    apycosmo = FlatLambdaCDM(H0=70., Om0=0.3, Ob0=0.05)
+
+    # Equal parameters share the same objects
+    entry = registry.get(cclcosmo)
+    assert registry.get(dict(reversed(list(cclcosmo.items())))) is entry
+    assert_equal(md.cclify_astropy_cosmo(entry.astropy), cclcosmo)
+    assert registry.get(apycosmo).astropy is apycosmo
+    assert registry.get(FlatLambdaCDM(H0=70., Om0=0.3, Ob0=0.05)).astropy is apycosmo
+    assert len(registry) == 2
+
+    # The least recently used cosmology is evicted
+    registry.get(cclcosmo)
+    registry.get({'Omega_c': 0.2, 'Omega_b': 0.05, 'h': 0.7, 'H0': 70.})
+    assert len(registry) == 2
+    assert registry._key(apycosmo) not in registry._entries
+    assert registry.get(cclcosmo) is entry
+    registry.clear()
+    assert len(registry) == 0
+    assert_raises(TypeError, registry.get, 70.)
+
+    # Conversions of the module use the shared registry
+    assert md.astropyify_ccl_cosmo(cclcosmo) is md.astropyify_ccl_cosmo(dict(cclcosmo))
+    assert md._COSMOLOGIES.get(cclcosmo).distance_table.cosmo is \
+        md.astropyify_ccl_cosmo(cclcosmo)
+
+
 def test_scale_factor_redshift_conversion():
     """ Unit tests for redshift and scalefactor conversion """
     # Convert from a to z - scalar, list, ndarray
@@ -261,6 +293,54 @@ def test_profiles():
                     cfg['numcosmo_profiles']['DeltaSigma'], 2.0e-9)
 
 
+def test_profiles_backends():
+    """ Tests of the implementations of the profiles """
+    r3d = np.logspace(-2, 2, 20)
+    cclcosmo = {'Omega_c': 0.25, 'Omega_b': 0.05}
+    for func in (md.get_3d_density, md.predict_surface_density,
+                 md.predict_excess_surface_density):
+        assert_allclose(func(r3d, 1.e15, 4., 0.2, cclcosmo, backend='template'),
+                        func(r3d, 1.e15, 4., 0.2, cclcosmo, backend='analytic'), 1.0e-10)
+        assert_raises(ValueError, func, r3d, 1.e15, 4., 0.2, cclcosmo, backend='bleh')
+
+        # Masses, concentrations and redshifts broadcast together, followed by the radii
+        mdelta = np.array([1.e14, 5.e14, 1.e15])[:, None]
+        cdelta = np.array([3., 5.])
+        profiles = func(r3d, mdelta, cdelta, 0.2, cclcosmo)
+        assert profiles.shape == (3, 2, 20)
+        assert_allclose(profiles[1, 0], func(r3d, 5.e14, 3., 0.2, cclcosmo), 1.0e-14)
+        assert_allclose(func(r3d, 1.e15, 4., [0.1, 0.3], cclcosmo),
+                        [func(r3d, 1.e15, 4., z_cl, cclcosmo) for z_cl in [0.1, 0.3]], 1.0e-14)
+        assert func(r3d.reshape(4, 5), [1.e14, 1.e15], 4., 0.2, cclcosmo).shape == (2, 4, 5)
+
+    # cluster_toolkit is only needed by its backend
+    try:
+        import cluster_toolkit
+    except ImportError:
+        for func in (md.get_3d_density, md.predict_surface_density,
+                     md.predict_excess_surface_density):
+            assert_raises(ImportError, func, r3d, 1.e15, 4., 0.2, cclcosmo,
+                          backend='cluster_toolkit')
+
+
+def test_profiles_template():
+    """ Validation tests of the template implementation of the profiles """
+    cfg = load_validation_config()
+    constants_conversion = clc.SOLAR_MASS.value/cfg['TEST_CASE']['Msun[kg]']
+    cosmo = cfg['cosmo']
+    cosmo['Omega_c'] = cosmo['Omega_c']*constants_conversion
+    cosmo['Omega_b'] = cosmo['Omega_b']*constants_conversion
+
+    assert_allclose(md.predict_surface_density(cosmo=cosmo, backend='template',
+                                               **cfg['SIGMA_PARAMS']),
+                    cfg['numcosmo_profiles']['Sigma'], 2.0e-9)
+    assert_allclose(md.predict_excess_surface_density(cosmo=cosmo, backend='template',
+                                                      **cfg['SIGMA_PARAMS']),
+                    cfg['numcosmo_profiles']['DeltaSigma'], 2.0e-9)
+    for func in (md.predict_surface_density, md.predict_excess_surface_density):
+        assert_raises(ValueError, func, cosmo=cosmo, backend='bleh', **cfg['SIGMA_PARAMS'])
+
+
 def test_angular_diameter_dist_a1a2():
     """ Test function that computes angular diameter distance between
     two scale factors. """
@@ -280,6 +360,11 @@ def test_angular_diameter_dist_a1a2():
                     md.angular_diameter_dist_a1a2(apycosmo, sf1, a2=1.),
                     **TOLERANCE)
 
+    # Test arrays of scale factors
+    assert_allclose(md.angular_diameter_dist_a1a2(cclcosmo, [sf1, sf2, 1.]),
+                    [md.angular_diameter_dist_a1a2(cclcosmo, sf1),
+                     md.angular_diameter_dist_a1a2(cclcosmo, sf2), 0.], **TOLERANCE)
+
     # Validation tests
     cfg = load_validation_config()
     assert_allclose(md.angular_diameter_dist_a1a2(cfg['cosmo'], cfg['TEST_CASE']['aexp_cluster']),
@@ -300,6 +385,15 @@ def test_get_critical_surface_density():
                                                     z_source=cfg['TEST_CASE']['z_source']),
                     cfg['TEST_CASE']['nc_Sigmac'], 1.0e-8)
 
+    # Many sources at once, and the distance table is reused
+    z_source = np.linspace(1.5, 3., 5)
+    assert_allclose(md.get_critical_surface_density(cfg['cosmo'], cfg['TEST_CASE']['z_cluster'],
+                                                    z_source),
+                    [md.get_critical_surface_density(cfg['cosmo'],
+                                                     cfg['TEST_CASE']['z_cluster'], z_s)
+                     for z_s in z_source], 1.0e-12)
+    assert_raises(ValueError, md.get_critical_surface_density, cfg['cosmo'], 0.5, -1.)
+
 
 def helper_physics_functions(func):
     """ A helper function to repeat a set of unit tests on several functions
@@ -337,6 +431,137 @@ def helper_physics_functions(func):
                   200, 'nfw', 'bleh')
 
 
+def test_shear_convergence_parameter_arrays():
+    """ The shear and convergence of many halos are evaluated in one call """
+    rproj = np.logspace(-1, 1, 10)
+    z_src = np.linspace(0.5, 2., 10)
+    cosmo = {'Omega_c': 0.25, 'Omega_b': 0.05, 'H0': 70.}
+    mdelta = np.array([1.e14, 3.e14, 1.e15])[:, None]
+    cdelta = np.array([3., 4., 5., 6.])
+    for func in (md.predict_tangential_shear, md.predict_convergence,
+                 md.predict_reduced_tangential_shear):
+        profiles = func(rproj, mdelta, cdelta, 0.2, z_src, cosmo)
+        assert profiles.shape == (3, 4, 10)
+        assert_allclose(profiles[2, 1], func(rproj, 1.e15, 4., 0.2, z_src, cosmo), 1.0e-12)
+        profiles = func(rproj, 1.e15, 4., [0.2, 0.3], z_src, cosmo)
+        assert_allclose(profiles[1], func(rproj, 1.e15, 4., 0.3, z_src, cosmo), 1.0e-12)
+
+
+def test_lensing_observables():
+    """ The combined evaluator matches the individual shear and convergence functions """
+    rproj = np.logspace(-2, 1, 20)
+    z_src = np.linspace(0.5, 2., 20)
+    cosmo = {'Omega_c': 0.25, 'Omega_b': 0.05, 'H0': 70.}
+    mdelta = np.array([1.e14, 1.e15])[:, None]
+    for backend in ('analytic', 'template'):
+        args = (rproj, mdelta, 4., 0.2, z_src, cosmo)
+        observables = md.predict_lensing_observables(*args, backend=backend,
+                                                     magnification=True)
+        gammat = md.predict_tangential_shear(*args, backend=backend)
+        kappa = md.predict_convergence(*args, backend=backend)
+        assert_allclose(observables['gammat'], gammat, 1.0e-12)
+        assert_allclose(observables['kappa'], kappa, 1.0e-12)
+        assert_allclose(observables['gt'], gammat/(1.-kappa), 1.0e-12)
+        assert_allclose(observables['mu'], 1./((1.-kappa)**2-gammat**2), 1.0e-12)
+        assert_allclose(md.predict_reduced_tangential_shear(*args, backend=backend),
+                        observables['gt'], 1.0e-12)
+    assert 'mu' not in md.predict_lensing_observables(rproj, 1.e15, 4., 0.2, z_src, cosmo)
+    assert_raises(ValueError, md.predict_lensing_observables, rproj, 1.e15, 4., 0.2, z_src,
+                  cosmo, z_src_model='bleh')
+
+
+def test_known_z_src():
+    """ Each source is lensed according to its own redshift """
+    rproj = np.logspace(-1, 1, 8)
+    z_src = np.array([-0.1, 0.2, 0.5, 1., 0.5, 1., 2., 0.5])
+    cosmo = {'Omega_c': 0.25, 'Omega_b': 0.05, 'H0': 70.}
+    for func in (md.predict_tangential_shear, md.predict_convergence,
+                 md.predict_reduced_tangential_shear):
+        profile = func(rproj, 1.e15, 4., 0.2, z_src, cosmo, z_src_model='known_z_src')
+        behind = z_src > 0.2
+        assert_allclose(profile[behind],
+                        func(rproj[behind], 1.e15, 4., 0.2, z_src[behind], cosmo), 1.0e-12)
+        assert_allclose(profile[~behind], 0.)
+        # Redshifts per radius of a 2d array of radii, for several cluster redshifts
+        profiles = func(rproj.reshape(2, 4), 1.e15, 4., [0.2, 0.3], z_src.reshape(2, 4), cosmo,
+                        z_src_model='known_z_src')
+        assert profiles.shape == (2, 2, 4)
+        assert_allclose(profiles[0].ravel(), profile, 1.0e-12)
+        assert_allclose(profiles[1].ravel()[z_src <= 0.3], 0.)
+
+
+def test_z_src_distribution():
+    """ Lensing efficiency moments and observables of a source redshift distribution """
+    cosmo = {'Omega_c': 0.25, 'Omega_b': 0.05, 'H0': 70.}
+    def nz(z):
+        return z**2*np.exp(-(z/0.5)**1.5)
+    def beta_s(z):
+        return max(0., md._COSMOLOGIES.get(cosmo).distance_table.distance_ratio(0.3, z))
+    norm = quad(nz, 0., 10.)[0]
+    truth = [quad(lambda z: nz(z)*beta_s(z)**k, 0.3, 10.)[0]/norm for k in (1, 2)]
+    moments = md.compute_beta_s_moments(cosmo, 0.3, nz)
+    assert_allclose(moments, truth, 1.0e-6)
+
+    # The moments are cached with the cosmology
+    cache = md._COSMOLOGIES.get(cosmo).beta_s_moments
+    ncached = len(cache)
+    beta_s_mean, beta_s_square_mean = md.compute_beta_s_moments(cosmo, [[0.3, 0.5]], nz)
+    assert beta_s_mean.shape == (1, 2)
+    assert len(cache) == ncached+1
+    assert_equal([beta_s_mean[0, 0], beta_s_square_mean[0, 0]], moments)
+    assert_raises(ValueError, md.compute_beta_s_moments, cosmo, 12., nz)
+
+    # The cache is bounded, the least recently used moments being evicted
+    md.compute_beta_s_moments(cosmo, np.linspace(0.1, 1., cache.maxsize), nz)
+    assert len(cache) == cache.maxsize
+    assert cache.get((nz, 0.5, 10.)) is None
+    assert_equal(md.compute_beta_s_moments(cosmo, 0.3, nz), moments)
+
+    rproj = np.logspace(-1, 1, 10)
+    mdelta = np.array([1.e14, 1.e15])[:, None]
+    args = (rproj, mdelta, 4., 0.3)
+    observables = md.predict_lensing_observables(*args, nz, cosmo,
+                                                 z_src_model='z_src_distribution')
+    sigma_c_inf = md._get_critical_surface_density_inf(md._COSMOLOGIES.get(cosmo).distance_table,
+                                                       0.3)
+    gammat_inf = md.predict_excess_surface_density(*args, cosmo)/sigma_c_inf
+    kappa_inf = md.predict_surface_density(*args, cosmo)/sigma_c_inf
+    assert_allclose(observables['gammat'], truth[0]*gammat_inf, 1.0e-6)
+    assert_allclose(observables['kappa'], truth[0]*kappa_inf, 1.0e-6)
+    assert_allclose(observables['gt'], truth[0]*gammat_inf/(1.-truth[1]/truth[0]*kappa_inf),
+                    1.0e-6)
+    for func, key in ((md.predict_tangential_shear, 'gammat'),
+                      (md.predict_convergence, 'kappa'),
+                      (md.predict_reduced_tangential_shear, 'gt')):
+        assert_allclose(func(*args, nz, cosmo, z_src_model='z_src_distribution'),
+                        observables[key], 1.0e-12)
+
+
+def test_mean_inverse_critical_surface_density():
+    """ Mean inverse critical surface density over photometric redshift PDFs """
+    cosmo = {'Omega_c': 0.25, 'Omega_b': 0.05, 'H0': 70.}
+    zbins = np.linspace(-0.2, 3., 321)
+    zmean = np.array([0.1, 0.5, 1., 2.])
+    pdfs = PhotoZPDFs(zbins, np.exp(-0.5*((zbins-zmean[:, None])/0.1)**2))
+    sigma_c_inv = md.compute_mean_inverse_critical_surface_density(cosmo, 0.3, pdfs)
+    assert sigma_c_inv.shape == (4,)
+
+    # Integral over each PDF with the inverse critical surface density set to zero in front
+    # of the cluster
+    behind = zbins > 0.3
+    row = np.zeros(len(zbins))
+    row[behind] = 1./md.get_critical_surface_density(cosmo, 0.3, zbins[behind])
+    for sigma_c_inv_, pdf in zip(sigma_c_inv, pdfs.pdfs.astype(float)):
+        assert_allclose(sigma_c_inv_, trapezoid(pdf*row, x=zbins), 1.0e-5)
+    assert_allclose(sigma_c_inv[-1], 1./md.get_critical_surface_density(cosmo, 0.3, 2.), 1.0e-2)
+
+    sigma_c_inv = md.compute_mean_inverse_critical_surface_density(cosmo, [[0.3], [0.5]], pdfs)
+    assert sigma_c_inv.shape == (2, 1, 4)
+    # The PDFs are stored in single precision
+    assert_allclose(sigma_c_inv[0, 0], md.compute_mean_inverse_critical_surface_density(
+        cosmo, 0.3, pdfs), 1.0e-6)
+
+
 def test_shear_convergence_unittests():
     """ Unit and validation tests for the shear and convergence calculations """
     helper_physics_functions(md.predict_tangential_shear)
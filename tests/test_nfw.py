@@ -0,0 +1,58 @@
+"""Tests for nfw.py"""
+import numpy as np
+from numpy.testing import assert_allclose
+from scipy.integrate import quad
+
+from clmm import nfw
+
+TOLERANCE = {'rtol': 1.0e-10, 'atol': 0}
+
+
+def _sigma_numerical(x):
+    """ Reduced NFW surface density, integrating the density along the line of sight """
+    return 2.*quad(lambda z: 1./(np.hypot(x, z)*(1.+np.hypot(x, z))**2), 0., np.inf,
+                   epsabs=0., epsrel=1.e-12, limit=200)[0]
+
+
+def test_closed_forms():
+    """ Compare the closed forms of the projected NFW profile with numerical integrals """
+    xvals = np.array([1.e-3, 0.2, 0.5, 0.99, 0.999999, 1., 1.001, 1.2, 10., 300.])
+    sigma = np.array([_sigma_numerical(x) for x in xvals])
+    assert_allclose(nfw._nfw_sigma_reduced(xvals), sigma, **TOLERANCE)
+    mean_sigma = [2./x**2*quad(lambda r: r*_sigma_numerical(r), 0., x, epsabs=0., epsrel=1.e-11,
+                               limit=200)[0] for x in xvals[1:]]
+    assert_allclose(nfw._nfw_mean_sigma_reduced(xvals[1:]), mean_sigma, **TOLERANCE)
+
+    # Limits at x=1
+    assert_allclose(nfw._nfw_sigma_reduced(1.), 2./3., **TOLERANCE)
+    assert_allclose(nfw._nfw_mean_sigma_reduced(1.), 4.*(1.-np.log(2.)), **TOLERANCE)
+
+    # Continuity across the changes of expressions
+    for x in (np.sqrt(0.99), np.sqrt(1.01), 0.5):
+        xvals = x*np.array([1.-1.e-12, 1.+1.e-12])
+        for func in (nfw._nfw_f, nfw._nfw_sigma_reduced, nfw._nfw_mean_sigma_reduced):
+            assert_allclose(*func(xvals), rtol=1.e-10)
+
+
+def test_nfw_scales():
+    """ The mass within r_delta of the scaled halo is mdelta """
+    rho_m = nfw._get_rho_m(0.3, 0.5)
+    r_s, rho_s = nfw._get_nfw_scales(1.e14, 5., rho_m, 200)
+    mass = 4.*np.pi*rho_s*r_s**3*(np.log(6.)-5./6.)
+    assert_allclose(mass, 1.e14, **TOLERANCE)
+    assert_allclose(mass/(4./3.*np.pi*(5.*r_s)**3), 200.*rho_m, **TOLERANCE)
+
+
+def test_template():
+    """ The template matches the closed forms, inside and outside its grid """
+    template = nfw.NFWTemplate()
+    np.random.seed(0)
+    xvals = np.exp(np.random.uniform(np.log(1.e-7), np.log(1.e7), 10000))
+    assert_allclose(template.sigma(xvals), nfw._nfw_sigma_reduced(xvals), **TOLERANCE)
+    assert_allclose(template.excess_sigma(xvals),
+                    nfw._nfw_mean_sigma_reduced(xvals)-nfw._nfw_sigma_reduced(xvals),
+                    **TOLERANCE)
+    assert_allclose(template.sigma([template.xmin, 1., template.xmax]),
+                    nfw._nfw_sigma_reduced([template.xmin, 1., template.xmax]), **TOLERANCE)
+    assert np.ndim(template.excess_sigma(2.)) == 0
+    assert nfw._get_nfw_template() is nfw._get_nfw_template()
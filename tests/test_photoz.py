@@ -0,0 +1,29 @@
+"""Tests for photoz.py"""
+import numpy as np
+from numpy.testing import assert_raises, assert_allclose
+from clmm import PhotoZPDFs
+
+
+def test_photoz_pdfs():
+    """ Unit tests for the PhotoZPDFs container """
+    zbins = np.linspace(0., 3., 301)
+    zmean = np.array([0.5, 1., 1.5])
+    pdfs = PhotoZPDFs(zbins, 2.*np.exp(-0.5*((zbins-zmean[:, None])/0.1)**2))
+    assert len(pdfs) == 3
+    assert pdfs.pdfs.dtype == np.float32
+    assert_allclose(pdfs.integrate(np.ones(len(zbins))), 1., 1.0e-6)
+    assert_allclose(pdfs.integrate(zbins), zmean, 1.0e-6)
+    means = pdfs.integrate(np.array([zbins, zbins**2]).T)
+    assert means.shape == (3, 2)
+    assert_allclose(means[:, 1], zmean**2+0.01, 1.0e-5)
+    assert_raises(ValueError, pdfs.integrate, zbins[1:])
+
+    # PDFs on a grid per galaxy
+    pzbins = [np.arange(z-0.5, z+0.5, 0.01) for z in zmean]
+    pzpdf = [np.exp(-0.5*((z_-z)/0.1)**2) for z_, z in zip(pzbins, zmean)]
+    assert_allclose(PhotoZPDFs.from_ragged(pzbins, pzpdf, zbins).integrate(zbins), zmean, 1.0e-5)
+    assert_raises(TypeError, PhotoZPDFs.from_ragged, pzbins, pzpdf[1:], zbins)
+
+    assert_raises(ValueError, PhotoZPDFs, zbins[::-1], pdfs.pdfs)
+    assert_raises(ValueError, PhotoZPDFs, zbins, pdfs.pdfs[:, 1:])
+    assert_raises(ValueError, PhotoZPDFs, zbins, np.zeros((2, len(zbins))))
@@ -5,6 +5,7 @@ from astropy.table import Table
 
 import clmm
 import clmm.polaraveraging as pa
+from .helpers import make_random_cluster
 
 TOLERANCE = {'atol':1.e-7, 'rtol':1.e-7}
 
@@ -81,6 +82,16 @@ def test_compute_lensing_angles_flatsky():
                           ra_l, dec_l, ra_s, dec_s-10.)
     testing.assert_raises(ValueError, pa._compute_lensing_angles_flatsky,
                           ra_l, dec_l, ra_s, dec_s+10.)
+    testing.assert_raises(ValueError, pa._compute_lensing_angles_flatsky,
+                          ra_l, dec_l, ra_s, np.array([np.nan, 85.]))
+
+    # The error reports the number and the indices of the offending sources
+    with testing.assert_raises_regex(ValueError, r"2 invalid dec .* indices \[1, 3\]"):
+        pa._compute_lensing_angles_flatsky(ra_l, dec_l, np.zeros(4),
+                                           np.array([0., 91., 0., -91.]))
+
+    # Validation can be turned off for trusted inputs
+    pa._compute_lensing_angles_flatsky(ra_l, dec_l, ra_s, dec_s+10., validate=False)
 
     # Ensure that we throw a warning with >1 deg separation
     testing.assert_warns(UserWarning, pa._compute_lensing_angles_flatsky,
@@ -296,3 +307,179 @@ def test_make_shear_profiles():
                             err_msg="Cross shear in bin not expected")
     testing.assert_array_equal(profile4['n_src'], [1,2])
 
+
+
+def test_compute_tangential_and_cross_shear():
+    shear1 = np.array([0.15, 0.40, -0.2, 0.3])
+    shear2 = np.array([0.08, 0.30, 0.1, -0.5])
+    deltax = np.array([1.e-3, -2.e-4, 0., 3.e-3])
+    deltay = np.array([-5.e-4, 7.e-4, 2.e-3, 0.])
+    phi = np.arctan2(deltay, -deltax)
+
+    # Fused kernel matches the separate computations from the azimuthal angle
+    tangential_shear, cross_shear = pa._compute_tangential_and_cross_shear(shear1, shear2,
+                                                                           deltax, deltay)
+    testing.assert_allclose(tangential_shear, pa._compute_tangential_shear(shear1, shear2, phi),
+                            **TOLERANCE)
+    testing.assert_allclose(cross_shear, pa._compute_cross_shear(shear1, shear2, phi),
+                            **TOLERANCE)
+
+    # Results are written into preallocated buffers when provided
+    gt_out, gx_out = np.empty(4), np.empty(4)
+    outputs = pa._compute_tangential_and_cross_shear(shear1, shear2, deltax, deltay,
+                                                     tangential_shear=gt_out, cross_shear=gx_out)
+    assert outputs[0] is gt_out and outputs[1] is gx_out
+    testing.assert_allclose(gt_out, tangential_shear, **TOLERANCE)
+
+    # Single precision inputs are not upcast
+    outputs = pa._compute_tangential_and_cross_shear(*(np.float32(x_) for x_ in
+                                                       (shear1, shear2, deltax, deltay)))
+    assert outputs[0].dtype == np.float32 and outputs[1].dtype == np.float32
+    testing.assert_allclose(outputs[0], tangential_shear, rtol=1.e-5)
+
+    # A source at the lens position behaves as phi=pi
+    testing.assert_allclose(pa._compute_tangential_and_cross_shear(0.2, 0.1, 0., 0.),
+                            [pa._compute_tangential_shear(0.2, 0.1, np.pi),
+                             pa._compute_cross_shear(0.2, 0.1, np.pi)], **TOLERANCE)
+
+
+def test_compute_lensing_offsets_curvedsky():
+    # Domain checks are shared with the flat sky
+    testing.assert_raises(ValueError, pa._compute_lensing_offsets_curvedsky,
+                          161., 95., np.array([161.]), np.array([51.]))
+    testing.assert_raises(ValueError, pa._compute_lensing_offsets_curvedsky,
+                          161., 51., np.array([161.]), np.array([91.]))
+
+    # Exact separations and position angles at large separations
+    angsep, deltax, deltay = pa._compute_lensing_offsets_curvedsky(
+        0., 0., np.array([90., 0., 0., 180.]), np.array([0., 30., -90., 0.]))
+    testing.assert_allclose(angsep, [np.pi/2., np.pi/6., np.pi/2., np.pi], **TOLERANCE)
+    testing.assert_allclose(np.arctan2(deltay, -deltax)[:3], [np.pi, np.pi/2., -np.pi/2.],
+                            **TOLERANCE)
+
+    # Agrees with the flat sky approximation at small separations
+    ra_l, dec_l = 161.32, 51.49
+    ra_s, dec_s = np.array([161.29, 161.34, 161.32]), np.array([51.45, 51.55, 51.50])
+    flat = pa._compute_lensing_angles_flatsky(ra_l, dec_l, ra_s, dec_s)
+    angsep, deltax, deltay = pa._compute_lensing_offsets_curvedsky(ra_l, dec_l, ra_s, dec_s)
+    testing.assert_allclose(angsep, flat[0], rtol=1.e-3)
+    testing.assert_allclose(np.arctan2(deltay, -deltax), flat[1], rtol=1.e-3)
+
+    # Several lenses at once
+    ra_ls, dec_ls = np.array([[161.32], [161.30]]), np.array([[51.49], [51.52]])
+    angsep, deltax, deltay = pa._compute_lensing_offsets_curvedsky(ra_ls, dec_ls, ra_s, dec_s)
+    assert angsep.shape == (2, 3)
+    for i in range(2):
+        testing.assert_allclose(
+            [angsep[i], deltax[i], deltay[i]],
+            pa._compute_lensing_offsets_curvedsky(ra_ls[i, 0], dec_ls[i, 0], ra_s, dec_s),
+            **TOLERANCE)
+
+
+def test_compute_shear_curve():
+    ra_lens, dec_lens = 120., 42.
+    ra_source_list = np.array([120.1, 119.9, 150., 90.])
+    dec_source_list = np.array([41.9, 42.2, 10., 80.])
+    shear1 = np.array([0.2, 0.4, 0.1, -0.3])
+    shear2 = np.array([0.3, 0.5, -0.2, 0.05])
+
+    # Close to the lens, curved and flat sky agree
+    flat = pa.compute_shear(ra_lens=ra_lens, dec_lens=dec_lens,
+                            ra_source_list=ra_source_list[:2], dec_source_list=dec_source_list[:2],
+                            shear1=shear1[:2], shear2=shear2[:2], add_to_cluster=False)
+    curve = pa.compute_shear(ra_lens=ra_lens, dec_lens=dec_lens,
+                             ra_source_list=ra_source_list[:2],
+                             dec_source_list=dec_source_list[:2], shear1=shear1[:2],
+                             shear2=shear2[:2], geometry='curve', add_to_cluster=False)
+    testing.assert_allclose(curve, flat, rtol=1.e-3, atol=2.e-3)
+
+    # Far from the lens, the shears follow the exact position angles
+    angsep, tshear, xshear = pa.compute_shear(ra_lens=ra_lens, dec_lens=dec_lens,
+                                              ra_source_list=ra_source_list,
+                                              dec_source_list=dec_source_list,
+                                              shear1=shear1, shear2=shear2, geometry='curve',
+                                              add_to_cluster=False)
+    _, deltax, deltay = pa._compute_lensing_offsets_curvedsky(ra_lens, dec_lens, ra_source_list,
+                                                              dec_source_list)
+    phi = np.arctan2(deltay, -deltax)
+    testing.assert_allclose(tshear, pa._compute_tangential_shear(shear1, shear2, phi), **TOLERANCE)
+    testing.assert_allclose(xshear, pa._compute_cross_shear(shear1, shear2, phi), **TOLERANCE)
+    testing.assert_raises(NotImplementedError, pa.compute_shear, ra_lens=ra_lens,
+                          dec_lens=dec_lens, ra_source_list=ra_source_list,
+                          dec_source_list=dec_source_list, shear1=shear1, shear2=shear2,
+                          geometry='bleh', add_to_cluster=False)
+
+
+def test_compute_shear_batch():
+    np.random.seed(42)
+    ngals = 500
+    galcat = Table([np.random.uniform(119., 121., ngals), np.random.uniform(41., 43., ngals),
+                    np.random.uniform(-0.3, 0.3, ngals), np.random.uniform(-0.3, 0.3, ngals)],
+                   names=('ra', 'dec', 'e1', 'e2'))
+    ra_lens, dec_lens = np.array([119.7, 120., 120.4]), np.array([41.8, 42., 42.3])
+    max_angsep = np.radians(0.3)
+
+    for geometry in ('flat', 'curve'):
+        pairs = pa.compute_shear_batch(ra_lens, dec_lens, max_angsep, galcat, geometry=geometry)
+        assert pairs.colnames == ['lens_index', 'source_index', 'theta', 'gt', 'gx']
+        testing.assert_array_equal(pairs['lens_index'], np.sort(pairs['lens_index']))
+
+        # Each lens gets the same sources and shears as a single compute_shear call
+        for i, (ra_l, dec_l) in enumerate(zip(ra_lens, dec_lens)):
+            angsep, tshear, xshear = pa.compute_shear(
+                ra_lens=ra_l, dec_lens=dec_l, ra_source_list=galcat['ra'],
+                dec_source_list=galcat['dec'], shear1=galcat['e1'], shear2=galcat['e2'],
+                geometry=geometry, add_to_cluster=False)
+            inside = np.flatnonzero(angsep <= max_angsep)
+            lens_pairs = pairs[pairs['lens_index'] == i]
+            lens_pairs.sort('source_index')
+            testing.assert_array_equal(lens_pairs['source_index'], inside)
+            testing.assert_allclose(lens_pairs['theta'], angsep[inside], **TOLERANCE)
+            testing.assert_allclose(lens_pairs['gt'], tshear[inside], **TOLERANCE)
+            testing.assert_allclose(lens_pairs['gx'], xshear[inside], **TOLERANCE)
+
+    # Arrays can be passed instead of a table
+    pairs2 = pa.compute_shear_batch(ra_lens, dec_lens, max_angsep, ra_source_list=galcat['ra'],
+                                    dec_source_list=galcat['dec'], shear1=galcat['e1'],
+                                    shear2=galcat['e2'], geometry='curve')
+    testing.assert_array_equal(pairs2['source_index'], pairs['source_index'])
+
+    # Error handling
+    testing.assert_raises(TypeError, pa.compute_shear_batch, ra_lens, dec_lens, max_angsep,
+                          galcat['ra', 'dec'])
+    testing.assert_raises(TypeError, pa.compute_shear_batch, ra_lens, dec_lens, max_angsep,
+                          ra_source_list=galcat['ra'])
+    testing.assert_raises(ValueError, pa.compute_shear_batch, [120., 400.], dec_lens[:2],
+                          max_angsep, galcat)
+    testing.assert_raises(NotImplementedError, pa.compute_shear_batch, ra_lens, dec_lens,
+                          max_angsep, galcat, geometry='bleh')
+
+
+def test_make_shear_profile_weights():
+    cluster = make_random_cluster(11, ngals=200, z=0.5)
+    bins = np.linspace(0., 0.002, 4)
+
+    # Unweighted profiles do not change
+    profile = pa.make_shear_profile(cluster, 'radians', 'radians', bins=bins)
+    assert 'n_eff' not in profile.colnames
+
+    # Weights from a column or an array
+    cluster.galcat['w'] = clmm.compute_inverse_variance_weights(cluster.galcat['e_err'], 0.25)
+    wprofile = pa.make_shear_profile(cluster, 'radians', 'radians', bins=bins, weights='w')
+    wprofile2 = pa.make_shear_profile(cluster, 'radians', 'radians', bins=bins,
+                                      weights=np.array(cluster.galcat['w']))
+    testing.assert_array_equal(wprofile, wprofile2)
+    for i, row in enumerate(wprofile):
+        inbin = (cluster.galcat['theta'] >= bins[i]) & (cluster.galcat['theta'] < bins[i+1])
+        weights = cluster.galcat['w'][inbin]
+        testing.assert_allclose(row['gt'], np.average(cluster.galcat['gt'][inbin],
+                                                      weights=weights), **TOLERANCE)
+        testing.assert_allclose(row['n_eff'], weights.sum()**2/(weights**2).sum(), **TOLERANCE)
+        testing.assert_allclose(row['weights_sum'], weights.sum(), **TOLERANCE)
+        assert row['n_src'] == inbin.sum()
+
+    # Weighted profile agrees with the stacked profile of the single cluster
+    stack = clmm.StackedProfile(bins, 'radians')
+    stack.add_cluster(cluster, weights='w')
+    for col in ('radius', 'gt', 'gt_err', 'gx', 'gx_err', 'n_eff'):
+        testing.assert_allclose(stack.make_profile()[col], wprofile[col], **TOLERANCE)
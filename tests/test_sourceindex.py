@@ -0,0 +1,66 @@
+"""Tests for sourceindex.py"""
+import numpy as np
+from numpy import testing
+from astropy.table import Table
+
+import clmm
+from clmm.sourceindex import SourceIndex
+import clmm.polaraveraging as pa
+
+
+def _separations(ra_center, dec_center, ra_list, dec_list):
+    """ Brute force great-circle separations in radians """
+    return pa._compute_lensing_offsets_curvedsky(ra_center, dec_center, ra_list, dec_list)[0]
+
+
+def test_initialization():
+    ra, dec = np.array([10., 20., 30.]), np.array([-5., 0., 5.])
+    index = SourceIndex(ra, dec)
+    assert len(index) == 3
+    testing.assert_array_equal(index.ra, ra)
+    assert isinstance(repr(index), str)
+
+    index2 = SourceIndex.from_table(Table([ra, dec], names=('ra', 'dec')))
+    testing.assert_array_equal(index2.dec, dec)
+    assert isinstance(clmm.SourceIndex(ra, dec), SourceIndex)
+
+    testing.assert_raises(TypeError, SourceIndex, ra, dec[:2])
+    testing.assert_raises(TypeError, SourceIndex.from_table, Table([ra], names=('ra',)))
+
+
+def test_queries():
+    np.random.seed(7)
+    ra, dec = np.random.uniform(0., 360., 3000), np.degrees(np.arcsin(np.random.uniform(-1., 1., 3000)))
+    index = SourceIndex(ra, dec)
+
+    # Apertures and annuli agree with brute force separations, including wide ones and
+    # across ra=0
+    for ra_c, dec_c, rmin, rmax in [(0.5, 10., 0.02, 0.1), (200., -60., 0.1, 0.8),
+                                    (359.9, 89., 0., 2.)]:
+        angsep = _separations(ra_c, dec_c, ra, dec)
+        testing.assert_array_equal(index.query_aperture(ra_c, dec_c, rmax),
+                                   np.flatnonzero(angsep <= rmax))
+        testing.assert_array_equal(index.query_annulus(ra_c, dec_c, rmin, rmax),
+                                   np.flatnonzero((angsep >= rmin) & (angsep <= rmax)))
+    testing.assert_raises(ValueError, index.query_annulus, 10., 10., 0.2, 0.1)
+
+    # Several apertures at once
+    ra_c, dec_c = np.array([10., 100., 250.]), np.array([0., 45., -30.])
+    center_index, source_index = index.query_apertures(ra_c, dec_c, 0.2)
+    testing.assert_array_equal(center_index, np.sort(center_index))
+    for i in range(3):
+        testing.assert_array_equal(np.sort(source_index[center_index == i]),
+                                   index.query_aperture(ra_c[i], dec_c[i], 0.2))
+
+
+def test_compute_shear_batch_with_index():
+    np.random.seed(3)
+    galcat = Table([np.random.uniform(119., 121., 200), np.random.uniform(41., 43., 200),
+                    np.random.uniform(-0.3, 0.3, 200), np.random.uniform(-0.3, 0.3, 200)],
+                   names=('ra', 'dec', 'e1', 'e2'))
+    index = SourceIndex.from_table(galcat)
+    ra_lens, dec_lens = np.array([119.7, 120.4]), np.array([41.8, 42.3])
+    pairs = pa.compute_shear_batch(ra_lens, dec_lens, 0.005, galcat, source_index=index)
+    testing.assert_array_equal(pairs, pa.compute_shear_batch(ra_lens, dec_lens, 0.005, galcat))
+    testing.assert_raises(TypeError, pa.compute_shear_batch, ra_lens, dec_lens, 0.005,
+                          galcat[:10], source_index=index)
@@ -0,0 +1,91 @@
+"""Tests for stacking.py"""
+import numpy as np
+from numpy import testing
+from astropy.table import Table
+from astropy.cosmology import FlatLambdaCDM
+
+import clmm
+from clmm.stacking import StackedProfile
+from .helpers import make_random_cluster
+
+TOLERANCE = {'atol':1.e-7, 'rtol':1.e-7}
+
+
+def test_initialization():
+    stack = StackedProfile([0., 1., 2.], 'radians')
+    assert stack.nclusters == 0
+    testing.assert_array_equal(stack.n_src, [0, 0])
+    assert isinstance(repr(stack), str)
+    testing.assert_raises(ValueError, StackedProfile, [1.])
+    testing.assert_raises(ValueError, StackedProfile, [0., 2., 1.])
+    testing.assert_raises(TypeError, stack.add, [0.5, 1.5], [0.1], [0.1, 0.2])
+
+
+def test_single_cluster_matches_make_shear_profile():
+    cluster = make_random_cluster(1)
+    bins = np.linspace(0., 0.002, 6)
+    profile = cluster.make_shear_profile('radians', 'radians', bins=bins)
+
+    stack = StackedProfile(bins, 'radians')
+    stack.add_cluster(cluster)
+    stacked_profile = stack.make_profile()
+    for col in ('radius_min', 'radius', 'radius_max', 'gt', 'gt_err', 'gx', 'gx_err', 'n_src'):
+        testing.assert_allclose(stacked_profile[col], profile[col], **TOLERANCE)
+    testing.assert_allclose(stacked_profile['n_eff'], profile['n_src'], **TOLERANCE)
+
+    # Physical units
+    cosmo = FlatLambdaCDM(H0=70., Om0=0.3)
+    stack = StackedProfile(np.linspace(0., 0.5, 6), 'Mpc')
+    stack.add_cluster(cluster, cosmo=cosmo)
+    profile = cluster.make_shear_profile('radians', 'Mpc', bins=np.linspace(0., 0.5, 6),
+                                         cosmo=cosmo)
+    testing.assert_allclose(stack.make_profile()['gt'], profile['gt'], **TOLERANCE)
+
+
+def test_stack_and_merge():
+    clusters = [make_random_cluster(seed) for seed in range(4)]
+    bins = np.linspace(0., 0.002, 5)
+
+    # Stacking is the same as a profile of all the sources together
+    stack = StackedProfile(bins, 'radians')
+    for cluster in clusters:
+        stack.add_cluster(cluster, weights='w')
+    assert stack.nclusters == 4
+    radius = np.concatenate([cl.galcat['theta'] for cl in clusters])
+    gt = np.concatenate([cl.galcat['gt'] for cl in clusters])
+    weights = np.concatenate([cl.galcat['w'] for cl in clusters])
+    profile = stack.make_profile(include_empty_bins=True)
+    for i in range(len(bins)-1):
+        inbin = (radius >= bins[i]) & (radius < bins[i+1])
+        mean = np.average(gt[inbin], weights=weights[inbin])
+        std = np.sqrt(np.average((gt[inbin]-mean)**2, weights=weights[inbin]))
+        n_eff = weights[inbin].sum()**2/(weights[inbin]**2).sum()
+        testing.assert_allclose(profile['gt'][i], mean, **TOLERANCE)
+        testing.assert_allclose(profile['gt_err'][i], std/np.sqrt(n_eff), **TOLERANCE)
+        testing.assert_allclose(profile['n_eff'][i], n_eff, **TOLERANCE)
+        testing.assert_allclose(profile['weights_sum'][i], weights[inbin].sum(), **TOLERANCE)
+        assert profile['n_src'][i] == inbin.sum()
+
+    # Stacks filled separately can be merged
+    stack1, stack2 = StackedProfile(bins, 'radians'), StackedProfile(bins, 'radians')
+    for cluster in clusters[:1]:
+        stack1.add_cluster(cluster, weights='w')
+    for cluster in clusters[1:]:
+        stack2.add_cluster(cluster, weights='w')
+    total = stack1 + stack2
+    assert total.nclusters == 4 and stack1.nclusters == 1
+    for col in profile.colnames:
+        testing.assert_allclose(total.make_profile(True)[col], profile[col], **TOLERANCE)
+    stack1 += stack2
+    testing.assert_allclose(stack1.make_profile(True)['gx'], profile['gx'], **TOLERANCE)
+
+    testing.assert_raises(ValueError, stack1.merge, StackedProfile(bins[:-1], 'radians'))
+    testing.assert_raises(ValueError, stack1.merge, StackedProfile(bins, 'Mpc'))
+    testing.assert_raises(TypeError, stack1.merge, profile)
+
+    # Empty bins are dropped by default
+    stack = StackedProfile([0., 0.001, 0.002, 0.5, 1.], 'radians')
+    stack.add_cluster(clusters[0])
+    assert len(stack.make_profile()) == 3 and len(stack.make_profile(True)) == 4
+    testing.assert_raises(TypeError, StackedProfile(bins).add_cluster,
+                          clmm.GalaxyCluster('1', 120., 42., 0.3, Table()))
@@ -5,7 +5,7 @@ from numpy.testing import assert_raises, assert_allclose
 from astropy.cosmology import FlatLambdaCDM
 
 import clmm.utils as utils
-from clmm.utils import compute_radial_averages, make_bins
+from clmm.utils import compute_radial_averages, compute_inverse_variance_weights, make_bins
 
 
 TOLERANCE = {'rtol': 1.0e-6, 'atol': 0}
@@ -61,6 +61,68 @@ def test_compute_radial_averages():
                      [np.std(inbin1), np.std(inbin2), np.std(inbin3)],
                      [inbin1.size, inbin2.size, inbin3.size]], **TOLERANCE)
 
+    # Several columns binned at once must match binning them one by one
+    yvals = np.array([binvals, binvals**2, -3.*binvals+1.e3])
+    xbins3 = [0.0, 2.5, 7.5, 10.0]
+    for error_model in ('std', 'std/sqrt_n'):
+        meanx, meany, yerr, nsrc = compute_radial_averages(binvals, yvals, xbins3,
+                                                           error_model=error_model)
+        assert meany.shape == (3, 3) and yerr.shape == (3, 3)
+        for ycol, meancol, errcol in zip(yvals, meany, yerr):
+            truth = compute_radial_averages(binvals, ycol, xbins3, error_model=error_model)
+            assert_allclose(meanx, truth[0], **TOLERANCE)
+            assert_allclose(meancol, truth[1], **TOLERANCE)
+            assert_allclose(errcol, truth[2], **TOLERANCE)
+            assert_allclose(nsrc, truth[3], **TOLERANCE)
+
+    # Values on the last edge belong to the last bin, values outside the bins are ignored
+    # and empty bins have undefined statistics
+    meanx, meany, yerr, nsrc = compute_radial_averages([1., 2., 4., 11.], [1., 2., 4., 11.],
+                                                       [0., 2., 3., 4.])
+    assert_allclose(meanx, [1., 2., 4.], **TOLERANCE)
+    assert_allclose(nsrc, [1, 1, 1], **TOLERANCE)
+    meanx, meany, yerr, nsrc = compute_radial_averages([1., 1.5], [1., 1.5], [0., 2., 3.])
+    assert_allclose(nsrc, [2, 0], **TOLERANCE)
+    assert np.isnan(meany[1]) and np.isnan(yerr[1])
+
+    # A NaN value only makes the statistics of its own bin undefined
+    xvals = np.array([1., 1.5, 4., 5., 6., 8., 9.])
+    yvals_nan = np.array([np.nan, 1., 4., 5., 6., 8., 9.])
+    meanx, meany, yerr, nsrc = compute_radial_averages(xvals, yvals_nan, xbins3, 'std')
+    assert np.isnan(meany[0]) and np.isnan(yerr[0])
+    assert_allclose(meany[1:], [5., 8.5], **TOLERANCE)
+    assert_allclose(yerr[1:], [np.std([4., 5., 6.]), 0.5], **TOLERANCE)
+
+    # Weighted statistics
+    weights = np.linspace(0.5, 2., len(binvals))
+    inbin = [(binvals >= xbins3[i]) & (binvals < xbins3[i+1]) for i in range(3)]
+    wmean = [np.average(binvals[m], weights=weights[m]) for m in inbin]
+    wstd = [np.sqrt(np.average((binvals[m]-mu)**2, weights=weights[m]))
+            for m, mu in zip(inbin, wmean)]
+    n_eff = [weights[m].sum()**2/(weights[m]**2).sum() for m in inbin]
+    assert_allclose(compute_radial_averages(binvals, binvals, xbins3, 'std', weights=weights),
+                    [wmean, wmean, wstd, [m.sum() for m in inbin]], **TOLERANCE)
+    assert_allclose(compute_radial_averages(binvals, binvals, xbins3, weights=weights)[2],
+                    np.array(wstd)/np.sqrt(n_eff), **TOLERANCE)
+    stats = utils._compute_binned_statistics(binvals, yvals, xbins3, weights=weights)
+    assert_allclose(stats[4], n_eff, **TOLERANCE)
+    assert_allclose(stats[5], [weights[m].sum() for m in inbin], **TOLERANCE)
+
+    # Equal weights give the unweighted statistics
+    for weighted, unweighted in zip(
+            compute_radial_averages(binvals, yvals, xbins3, weights=np.full(len(binvals), 3.)),
+            compute_radial_averages(binvals, yvals, xbins3)):
+        assert_allclose(weighted, unweighted, **TOLERANCE)
+    assert_raises(TypeError, compute_radial_averages, binvals, binvals, xbins3,
+                  weights=weights[:3])
+
+
+def test_compute_inverse_variance_weights():
+    """ Test the inverse variance weights of source galaxies """
+    assert_allclose(compute_inverse_variance_weights([0.1, 0.2], 0.25),
+                    [1./(0.01+0.0625), 1./(0.04+0.0625)], **TOLERANCE)
+    assert_allclose(compute_inverse_variance_weights(np.array([0.5])), [4.], **TOLERANCE)
+    assert_raises(ValueError, compute_inverse_variance_weights, [0.1, 0.], 0.)
 
 
 def test_make_bins():